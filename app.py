@@ -3,58 +3,317 @@ Flask Backend API for Disaster Prediction System
 Loads trained ML models and serves predictions via REST API
 """
 
-from flask import Flask, request, jsonify, render_template
-from flask_cors import CORS
-import joblib
-import numpy as np
 import os
-import pandas as pd
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from flask import Flask, Response, g, request, jsonify, render_template
+from flask_cors import CORS
+
+from batch_scheduler import MicroBatchScheduler, QueueFullError
+from drift_monitor import DriftMonitor
+from inference_engine import DisasterInferenceEngine, MODEL_DIR, MODEL_FILES, check_range
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Metrics, timing_header
+from model_bundle import is_bundle
+from model_store import ModelWatcher, artifact_signature, current_rss
+from prediction_cache import PredictionCache
+from response_formats import (FastJSONProvider, NotAcceptableError, batch_frame, check_detail, choose_encoding,
+                              compress, dumps, encode, json_columns, negotiate, orjson)
+from scenario_sweep import DEFAULT_MAX_CELLS, describe, plan_sweep, run_sweep, sweep_outputs
+from stats_cube import DEFAULT_PERCENTILES, DIMENSIONS, STATS_CUBE_FILE, CubeFile
 
 app = Flask(__name__)
-CORS(app)  # Enable CORS for frontend communication
+CORS(app, expose_headers=['X-Timing'])  # Enable CORS for frontend communication
+if orjson is not None:
+    app.json = FastJSONProvider(app)
 
 # Load all trained models and preprocessors
-MODEL_DIR = 'saved_models'
-
-print("Loading models...")
-try:
-    # Load main prediction models
-    disaster_classifier = joblib.load(os.path.join(MODEL_DIR, 'disaster_classifier.pkl'))
-    damage_regressor = joblib.load(os.path.join(MODEL_DIR, 'damage_regressor.pkl'))
-    response_regressor = joblib.load(os.path.join(MODEL_DIR, 'response_time_regressor.pkl'))
-    
-    # Load parameter prediction models (for predicting severity, population, economic loss)
-    try:
-        severity_model = joblib.load(os.path.join(MODEL_DIR, 'severity_model.pkl'))
-        population_model = joblib.load(os.path.join(MODEL_DIR, 'population_model.pkl'))
-        economic_loss_model = joblib.load(os.path.join(MODEL_DIR, 'economic_loss_model.pkl'))
-        scaler_parameters = joblib.load(os.path.join(MODEL_DIR, 'scaler_parameters.pkl'))
-        print("✓ Parameter prediction models loaded")
-    except:
-        severity_model = None
-        population_model = None
-        economic_loss_model = None
-        scaler_parameters = None
-        print("⚠ Parameter prediction models not found - will require manual input")
-    
-    # Load scalers
-    scaler_disaster = joblib.load(os.path.join(MODEL_DIR, 'scaler_disaster.pkl'))
-    scaler_damage = joblib.load(os.path.join(MODEL_DIR, 'scaler_damage.pkl'))
-    scaler_response = joblib.load(os.path.join(MODEL_DIR, 'scaler_response.pkl'))
-    
-    # Load label encoders
-    le_disaster = joblib.load(os.path.join(MODEL_DIR, 'label_encoder_disaster.pkl'))
-    le_location = joblib.load(os.path.join(MODEL_DIR, 'label_encoder_location.pkl'))
-    le_aid = joblib.load(os.path.join(MODEL_DIR, 'label_encoder_aid.pkl'))
-    
-    # Load metadata
-    metadata = joblib.load(os.path.join(MODEL_DIR, 'model_metadata.pkl'))
-    
-    print("✓ All models loaded successfully!")
-except Exception as e:
-    print(f"Error loading models: {e}")
-    raise
+# DISASTER_MMAP_MODE=r memory-maps model arrays (see `python model_store.py resave`),
+# DISASTER_LAZY_LOAD=0 loads every artifact up front and DISASTER_WARMUP=0 skips
+# the synthetic prediction that pulls every cascade model in before serving.
+# DISASTER_BACKEND=sklearn|compiled|auto picks the tree evaluator (see tree_compiler.py)
+# DISASTER_CACHE_SIZE / _TTL / _PRECISION configure the prediction cache (size 0 disables it)
+# DISASTER_MODEL_THREADS sets n_jobs of the forests (serve.py sets it per worker process)
+# DISASTER_MODEL_DIR may also name a single-file bundle built by model_bundle.py
+cache = PredictionCache.from_env()
+
+# Stage / request latency and request counters for /metrics; DISASTER_METRICS=0 turns
+# off stage timing, DISASTER_TIMING_HEADER=1 adds X-Timing to every /api/ response
+# (otherwise only to requests that send an X-Timing header)
+metrics = Metrics()
+STAGE_TIMING = os.environ.get('DISASTER_METRICS', '1') != '0'
+TIMING_HEADER = os.environ.get('DISASTER_TIMING_HEADER') == '1'
+
+# Seconds a replaced micro-batch scheduler keeps running for requests that already hold it
+RELOAD_GRACE_SECONDS = 30
+
+# Compact models built by compact_models.py, served to requests with tier=fast;
+# the full models in MODEL_DIR are tier=accurate (the default). The fast tier
+# has its own prediction cache and is not micro-batched.
+FAST_MODEL_DIR = os.environ.get('DISASTER_FAST_MODEL_DIR', os.path.join(MODEL_DIR, 'fast'))
+TIERS = ('accurate', 'fast')
+fast_cache = PredictionCache.from_env()
+
+# Shadow model set (e.g. retrained models not yet promoted) scored against the live
+# models on /api/predict traffic by the drift monitor, off the request path
+SHADOW_MODEL_DIR = os.environ.get('DISASTER_SHADOW_MODEL_DIR')
+
+# Most grid cells one /api/sweep request may ask for
+SWEEP_MAX_CELLS = int(os.environ.get('DISASTER_SWEEP_MAX_CELLS', DEFAULT_MAX_CELLS))
+
+# /api/ responses of at least DISASTER_COMPRESS_MIN_BYTES are gzip (or brotli)
+# compressed for clients that accept it, at DISASTER_COMPRESS_LEVEL; 0 turns it off
+COMPRESS_MIN_BYTES = int(os.environ.get('DISASTER_COMPRESS_MIN_BYTES', 1024))
+COMPRESS_LEVEL = int(os.environ.get('DISASTER_COMPRESS_LEVEL', 6))
+
+
+def create_engine(model_dir=MODEL_DIR, engine_cache=cache):
+    """Load the artifacts in model_dir into a new engine, configured from the environment"""
+    lazy = os.environ.get('DISASTER_LAZY_LOAD', '1') != '0'
+    new_engine = DisasterInferenceEngine(
+        model_dir,
+        mmap_mode=os.environ.get('DISASTER_MMAP_MODE') or None,
+        lazy=lazy,
+        backend=os.environ.get('DISASTER_BACKEND', 'auto'),
+        cache=engine_cache,
+        stage_observer=metrics.observe_stage if STAGE_TIMING else None
+    )
+    if os.environ.get('DISASTER_MODEL_THREADS'):
+        new_engine.limit_model_threads(int(os.environ['DISASTER_MODEL_THREADS']))
+    if os.environ.get('DISASTER_WARMUP', '1') != '0':
+        print(f"✓ Warm-up prediction completed in {new_engine.warm_up() * 1000:.1f} ms")
+    if not lazy:
+        new_engine.event_index
+    return new_engine
+
+
+def create_fast_engine():
+    """Engine of the fast tier, or None when FAST_MODEL_DIR holds no models"""
+    if not is_bundle(FAST_MODEL_DIR) and not os.path.exists(os.path.join(FAST_MODEL_DIR, MODEL_FILES['metadata'])):
+        return None
+    fast = create_engine(FAST_MODEL_DIR, fast_cache)
+    if fast.metadata.get('source_training_date') != engine.metadata.get('training_date'):
+        print(f"⚠ The fast tier in {FAST_MODEL_DIR} was built from models trained "
+              f"{fast.metadata.get('source_training_date')}; re-run compact_models.py")
+    return fast
+
+
+def create_shadow_engine():
+    """Engine of the shadow models, or None when DISASTER_SHADOW_MODEL_DIR is not set"""
+    if not SHADOW_MODEL_DIR:
+        return None
+    shadow = create_engine(SHADOW_MODEL_DIR, None)
+    # Its predictions stay out of the stage latency metrics
+    shadow.stage_observer = None
+    return shadow
+
+
+def watched_files(model_dir):
+    """(directory, {name: file name}) the watcher polls for a model directory or bundle file"""
+    if is_bundle(model_dir):
+        return os.path.dirname(model_dir) or '.', {'bundle': os.path.basename(model_dir)}
+    return model_dir, MODEL_FILES
+
+
+model_signature = artifact_signature(*watched_files(MODEL_DIR))
+engine = create_engine()
+engine.artifacts.print_report()
+metadata = engine.metadata
+fast_signature = artifact_signature(*watched_files(FAST_MODEL_DIR))
+fast_engine = create_fast_engine()
+
+# DISASTER_MICROBATCH=1 queues /api/predict requests and scores them in micro-batches
+# of up to DISASTER_BATCH_SIZE, waiting at most DISASTER_BATCH_WAIT_MS for a batch to
+# fill; DISASTER_QUEUE_DEPTH bounds the queue (requests beyond it get a 503)
+scheduler = MicroBatchScheduler.from_env(engine)
+watcher = fast_watcher = None
+
+# Input drift against the training data (reference_stats in model_metadata.pkl) and
+# shadow model deltas, fed through a bounded queue; DISASTER_DRIFT=0 turns it off,
+# DISASTER_DRIFT_QUEUE / _BATCH / _HALF_LIFE configure it (see drift_monitor.py)
+shadow_engine = create_shadow_engine()
+drift_monitor = DriftMonitor.from_env(engine, shadow_engine)
+
+# Aggregate cube for /api/stats (next to the models unless DISASTER_STATS_CUBE names it),
+# reloaded when stats_cube.py rebuilds or updates it
+stats_cube = CubeFile(os.environ.get('DISASTER_STATS_CUBE',
+                                     os.path.join(watched_files(MODEL_DIR)[0], STATS_CUBE_FILE)))
+
+
+def reload_models():
+    """
+    Load the current artifacts into a new engine and switch requests over to it.
+    Requests already running finish on the old engine. The new engine gets a
+    prediction cache of its own: old-model records stored by those requests
+    (or by the old scheduler during its grace period) never reach it.
+    """
+    global engine, metadata, scheduler, drift_monitor, cache
+    new_cache = PredictionCache.from_env()
+    new_engine = create_engine(MODEL_DIR, new_cache)
+    cache = new_cache
+    old_scheduler, old_monitor = scheduler, drift_monitor
+    engine, metadata = new_engine, new_engine.metadata
+    scheduler = MicroBatchScheduler.from_env(new_engine)
+    # Drift is measured against the new models' reference statistics from here on
+    drift_monitor = DriftMonitor.from_env(new_engine, shadow_engine)
+    if old_scheduler is not None:
+        threading.Timer(RELOAD_GRACE_SECONDS, old_scheduler.close).start()
+    if old_monitor is not None:
+        old_monitor.close()
+    print(f"✓ Reloaded models trained {metadata.get('training_date')} (pid {os.getpid()})")
+
+
+def reload_fast_models():
+    """Switch tier=fast requests over to the current artifacts in FAST_MODEL_DIR"""
+    global fast_engine, fast_cache
+    # A fresh cache, for the same reason as in reload_models
+    fast_cache = PredictionCache.from_env()
+    fast_engine = create_fast_engine()
+    print(f"✓ Reloaded the fast tier (pid {os.getpid()})")
+
+
+def start_worker(watch_interval=None):
+    """
+    Per-process setup for serve.py, called in every worker after it is forked
+    from the process that loaded the models: restarts the micro-batch scheduler
+    and the drift monitor (threads do not survive a fork) and, with
+    watch_interval, polls MODEL_DIR and FAST_MODEL_DIR and reloads the tier
+    whose artifacts changed
+    """
+    global scheduler, drift_monitor, watcher, fast_watcher
+    if scheduler is not None and not scheduler.is_alive():
+        scheduler = MicroBatchScheduler.from_env(engine)
+    if drift_monitor is not None and not drift_monitor.is_alive():
+        drift_monitor = DriftMonitor.from_env(engine, shadow_engine)
+    if watch_interval and watcher is None:
+        watcher = ModelWatcher(*watched_files(MODEL_DIR), reload_models, watch_interval, model_signature)
+        fast_watcher = ModelWatcher(*watched_files(FAST_MODEL_DIR), reload_fast_models, watch_interval,
+                                    fast_signature)
+
+
+def list_option(value):
+    """List of a query string / JSON option given as a list or comma-separated text (None when absent)"""
+    if value is None or isinstance(value, list):
+        return value
+    return [part.strip() for part in str(value).split(',') if part.strip()]
+
+
+def request_option(data, name, default=None):
+    """Option name of a request: from the JSON body data, else the query string"""
+    return (data.get(name) if isinstance(data, dict) else None) or request.args.get(name, default)
+
+
+def select_tier(data):
+    """
+    (engine, tier name) for the 'tier' of a request body or query string.
+    tier=fast is answered by the full models when no fast tier is built.
+    """
+    tier = request_option(data, 'tier', 'accurate')
+    if tier not in TIERS:
+        raise ValueError(f"tier must be one of: {', '.join(TIERS)}")
+    if tier == 'fast' and fast_engine is not None:
+        return fast_engine, 'fast'
+    return engine, 'accurate'
+
+
+def disaster_label(data):
+    """Canonical disaster type of a request body for metric labels ('unknown' if invalid)"""
+    code = engine.disaster_encoder.get(data.get('disaster_type')) if isinstance(data, dict) else None
+    return 'unknown' if code is None else engine.disaster_encoder.classes[code]
+
+
+@app.before_request
+def start_timing():
+    if request.path.startswith('/api/'):
+        g.request_start = time.perf_counter()
+        metrics.begin_request()
+
+
+@app.after_request
+def record_timing(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        elapsed = time.perf_counter() - start
+        metrics.request_seconds.observe(elapsed, request.endpoint or 'unknown')
+        timings = metrics.end_request()
+        if TIMING_HEADER or request.headers.get('X-Timing'):
+            timings['total'] = elapsed
+            response.headers['X-Timing'] = timing_header(timings)
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    """Compress large /api/ responses for clients that send Accept-Encoding: gzip (or br)"""
+    if (not COMPRESS_MIN_BYTES or not request.path.startswith('/api/') or response.direct_passthrough
+            or response.is_streamed or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None or response.content_length < COMPRESS_MIN_BYTES:
+        return response
+    start = time.perf_counter()
+    response.set_data(compress(response.get_data(), encoding, COMPRESS_LEVEL))
+    response.headers['Content-Encoding'] = encoding
+    engine.mark_stage('compress', start)
+    return response
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Metrics of this worker process in the Prometheus text format"""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+@metrics.add_collector
+def collect_engine_metrics():
+    """Model, cache and micro-batch figures read at scrape time"""
+    families = [
+        ('disaster_model_info', 'gauge', 'Loaded models (value is always 1)',
+         [({'training_date': metadata.get('training_date', 'Unknown'), 'backend': engine.backend}, 1)]),
+        ('disaster_warmup_seconds', 'gauge', 'Warm-up prediction time of the loaded models',
+         [({}, engine.warmup_seconds)]),
+        ('disaster_model_load_seconds', 'gauge', 'Time taken to load each artifact',
+         [({'artifact': entry['artifact']}, entry['load_seconds'])
+          for entry in engine.load_report() if 'load_seconds' in entry]),
+        ('disaster_model_reloads_total', 'counter', 'Model reloads after new artifacts landed',
+         [({}, watcher.reloads if watcher else 0)]),
+        ('disaster_process_resident_memory_bytes', 'gauge', 'Resident set size of this worker',
+         [({}, current_rss())]),
+    ]
+    if cache is not None:
+        tables = (('cascade', cache.cascade), ('parameters', cache.parameters))
+        families.append(('disaster_cache_entries', 'gauge', 'Entries in each prediction cache',
+                         [({'cache': name}, len(table)) for name, table in tables]))
+        for event in ('hits', 'misses', 'evictions', 'expirations'):
+            families.append((f'disaster_cache_{event}_total', 'counter', f'Prediction cache {event}',
+                             [({'cache': name}, getattr(table, event)) for name, table in tables]))
+    if scheduler is not None:
+        stats = scheduler.stats()
+        families.extend([
+            ('disaster_batch_queue_depth', 'gauge', 'Requests waiting for a micro-batch',
+             [({}, stats['queue_depth'])]),
+            ('disaster_batch_max_size', 'gauge', 'Configured micro-batch size limit',
+             [({}, stats['max_batch_size'])]),
+            ('disaster_batch_max_wait_seconds', 'gauge', 'Configured micro-batch wait limit',
+             [({}, stats['max_wait_ms'] / 1000)]),
+            ('disaster_batches_total', 'counter', 'Micro-batches run', [({}, stats['batches'])]),
+            ('disaster_batch_requests_total', 'counter', 'Requests by micro-batch outcome',
+             [({'outcome': outcome}, stats[outcome]) for outcome in ('completed', 'failed', 'rejected')]),
+        ])
+    if drift_monitor is not None:
+        report = drift_monitor.report()
+        families.extend([
+            ('disaster_feature_psi', 'gauge', 'Population Stability Index of each input feature vs training',
+             [({'feature': name}, feature['psi']) for name, feature in report['features'].items()]),
+            ('disaster_drift_observations_total', 'counter', 'Requests seen by the drift monitor by outcome',
+             [({'outcome': outcome}, report['monitor'][outcome]) for outcome in ('observed', 'dropped', 'failed')]),
+        ])
+        if report['shadow'] is not None and report['shadow']['scored']:
+            families.append(('disaster_shadow_agreement', 'gauge', 'Share of shadow decisions equal to live ones',
+                             [({'decision': name}, value) for name, value in report['shadow']['agreement'].items()]))
+    return families
 
 
 @app.route('/')
@@ -71,7 +330,26 @@ def status():
         'message': 'Disaster Prediction API is running',
         'version': '1.0.0',
         'training_date': metadata.get('training_date', 'Unknown'),
-        'model_accuracy': f"{metadata.get('model_accuracy', 0)*100:.2f}%"
+        'model_accuracy': f"{metadata.get('model_accuracy', 0)*100:.2f}%",
+        'models': {
+            'backend': engine.backend,
+            'mmap_mode': engine.artifacts.mmap_mode,
+            'warmup_seconds': engine.warmup_seconds,
+            'parameter_table': engine.parameter_table is not None,
+            'event_index': 'event_index' in engine.artifacts,
+            'rss_bytes': current_rss(),
+            'artifacts': engine.load_report()
+        },
+        'tiers': {
+            'accurate': True,
+            'fast': fast_engine is not None
+        },
+        'cache': cache.stats() if cache else None,
+        'batching': scheduler.stats() if scheduler else None,
+        'drift_monitor': drift_monitor is not None,
+        'shadow_models': shadow_engine.metadata.get('training_date') if shadow_engine else None,
+        'pid': os.getpid(),
+        'reloads': watcher.reloads if watcher else 0
     })
 
 
@@ -79,8 +357,8 @@ def status():
 def get_disaster_types():
     """Get available disaster types"""
     return jsonify({
-        'disaster_types': le_disaster.classes_.tolist(),
-        'locations': le_location.classes_.tolist()
+        'disaster_types': engine.le_disaster.classes_.tolist(),
+        'locations': engine.le_location.classes_.tolist()
     })
 
 
@@ -88,185 +366,224 @@ def get_disaster_types():
 def predict():
     """
     Main prediction endpoint
-    Expects JSON with disaster parameters and returns comprehensive predictions
+    Expects JSON with disaster parameters and returns comprehensive predictions.
+    latitude / longitude can be omitted for a known location (canonical coordinates
+    and the precomputed parameter table are used then).
+    detail=predictions leaves out the emergency_response block
     """
+    data = None
     try:
+        start = time.perf_counter()
         data = request.json
-        
-        # Extract input parameters
-        disaster_type = data.get('disaster_type')
-        location = data.get('location')
-        latitude = float(data.get('latitude'))
-        longitude = float(data.get('longitude'))
-        
-        # Get temporal parameters
-        now = datetime.now()
-        month = int(data.get('month', now.month))
-        week = int(data.get('week', 1))
-        quarter = (month - 1) // 3 + 1
-        day_of_year = data.get('day_of_year', now.timetuple().tm_yday)
-        is_summer = 1 if month in [6, 7, 8] else 0
-        is_winter = 1 if month in [12, 1, 2] else 0
-        
-        # Encode categorical variables
-        try:
-            disaster_encoded = le_disaster.transform([disaster_type])[0]
-        except:
-            disaster_encoded = 0
-            
-        try:
-            location_encoded = le_location.transform([location])[0]
-        except:
-            location_encoded = 0
-        
-        # Predict missing parameters if models are available
-        if severity_model and population_model and economic_loss_model:
-            # Prepare features for parameter prediction
-            param_features = np.array([[
-                disaster_encoded, location_encoded,
-                latitude, longitude,
-                month, week, quarter, is_summer, is_winter
-            ]])
-            param_features_scaled = scaler_parameters.transform(param_features)
-            
-            # Predict parameters
-            severity_level = max(1, min(10, int(severity_model.predict(param_features_scaled)[0])))
-            affected_population = max(0, int(population_model.predict(param_features_scaled)[0]))
-            economic_loss = max(0, float(economic_loss_model.predict(param_features_scaled)[0]))
-        else:
-            # Use provided values or defaults
-            severity_level = int(data.get('severity_level', 5))
-            affected_population = int(data.get('affected_population', 10000))
-            economic_loss = float(data.get('economic_loss', 1000000))
-        
-        # Prepare input for major disaster prediction
-        disaster_input = np.array([[
-            disaster_encoded, location_encoded, latitude, longitude,
-            severity_level, affected_population, 0.5,
-            month, quarter, day_of_year
-        ]])
-        disaster_input_scaled = scaler_disaster.transform(disaster_input)
-        
-        # Predict major disaster
-        is_major = bool(disaster_classifier.predict(disaster_input_scaled)[0])
-        major_probability = float(disaster_classifier.predict_proba(disaster_input_scaled)[0][1])
-        
-        # Prepare input for damage assessment
-        damage_input = np.array([[
-            disaster_encoded, location_encoded, latitude, longitude,
-            severity_level, affected_population, economic_loss,
-            month, quarter
-        ]])
-        damage_input_scaled = scaler_damage.transform(damage_input)
-        predicted_damage = float(damage_regressor.predict(damage_input_scaled)[0])
-        
-        # Prepare input for response time prediction
-        response_input = np.array([[
-            disaster_encoded, location_encoded, latitude, longitude,
-            severity_level, affected_population, predicted_damage, economic_loss
-        ]])
-        response_input_scaled = scaler_response.transform(response_input)
-        predicted_response_time = float(response_regressor.predict(response_input_scaled)[0])
-        
-        # Determine priority and alert level
-        if major_probability > 0.7 or severity_level >= 8:
-            priority = "CRITICAL"
-            priority_level = 5
-            alert_level = "LEVEL 5 - MAXIMUM ALERT"
-        elif major_probability > 0.5 or severity_level >= 6:
-            priority = "HIGH"
-            priority_level = 4
-            alert_level = "LEVEL 4 - HIGH ALERT"
-        elif major_probability > 0.3 or severity_level >= 4:
-            priority = "MEDIUM"
-            priority_level = 3
-            alert_level = "LEVEL 3 - MODERATE ALERT"
+        engine.mark_stage('json', start)
+        tier_engine, tier = select_tier(data)
+        detail = check_detail(request_option(data, 'detail', 'full'))
+        if tier == 'accurate' and scheduler is not None:
+            result = scheduler.predict_one(data)
         else:
-            priority = "LOW"
-            priority_level = 2
-            alert_level = "LEVEL 2 - LOW ALERT"
-        
-        # Calculate resource recommendations
-        if affected_population > 40000:
-            personnel = "500+ emergency responders"
-            medical_teams = "20+ teams"
-            rescue_units = "30+ units"
-        elif affected_population > 20000:
-            personnel = "200-500 emergency responders"
-            medical_teams = "10-20 teams"
-            rescue_units = "15-30 units"
-        else:
-            personnel = "100-200 emergency responders"
-            medical_teams = "5-10 teams"
-            rescue_units = "10-15 units"
-        
-        # Calculate shelter needs
-        if predicted_damage > 0.7:
-            shelters = int(affected_population * 0.6)
-            equipment = "Heavy equipment: Bulldozers, cranes, excavators (HIGH PRIORITY)"
-        elif predicted_damage > 0.4:
-            shelters = int(affected_population * 0.4)
-            equipment = "Heavy equipment: Moderate deployment required"
+            result = tier_engine.predict_one(data)
+        if tier == 'accurate' and drift_monitor is not None:
+            drift_monitor.observe(data, result)
+        result['tier'] = tier
+        if detail == 'predictions':
+            del result['emergency_response']
+        start = time.perf_counter()
+        response = jsonify(result)
+        engine.mark_stage('serialize', start)
+        metrics.requests.inc('predict', result['input']['disaster_type'], 'success')
+        return response
+
+    except (QueueFullError, FutureTimeoutError) as e:
+        metrics.requests.inc('predict', disaster_label(data), 'rejected')
+        return jsonify({
+            'success': False,
+            'error': str(e) or 'Prediction timed out'
+        }), 503
+    except Exception as e:
+        metrics.requests.inc('predict', disaster_label(data), 'invalid')
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+
+@app.route('/api/batch-predict', methods=['POST'])
+def batch_predict():
+    """
+    Batch prediction endpoint for multiple disaster scenarios
+    All valid scenarios go through the cascade together; a scenario that fails
+    validation gets its own error entry without affecting the rest.
+    format=columnar|msgpack|arrow (or an Accept header) returns one column per
+    field instead of one object per scenario (see response_formats.py);
+    detail=predictions leaves out the emergency response fields
+    """
+    try:
+        data = request.json
+        scenarios = data.get('scenarios', [])
+        if not isinstance(scenarios, list):
+            raise ValueError("'scenarios' must be a list")
+
+        tier_engine, tier = select_tier(data)
+        fmt = negotiate(request_option(data, 'format'), request.accept_mimetypes)
+        detail = check_detail(request_option(data, 'detail', 'full'))
+
+        if fmt != 'json':
+            frame = batch_frame(tier_engine, scenarios, detail)
+            for scenario, success, disaster_type in zip(scenarios, frame['success'], frame['disaster_type']):
+                if success:
+                    metrics.requests.inc('batch_predict', disaster_type, 'success')
+                else:
+                    metrics.requests.inc('batch_predict', disaster_label(scenario), 'invalid')
+            header = {'success': True, 'tier': tier, 'count': len(frame), 'failed': int((~frame['success']).sum())}
+            start = time.perf_counter()
+            body, content_type = encode(fmt, frame, header)
+            engine.mark_stage('serialize', start)
+            return Response(body, content_type=content_type)
+
+        results = list(tier_engine.predict_stream(scenarios, batch_size=max(len(scenarios), 1)))
+
+        for scenario, result in zip(scenarios, results):
+            result['scenario_id'] = scenario.get('id') if isinstance(scenario, dict) else None
+            if result['success']:
+                metrics.requests.inc('batch_predict', result['input']['disaster_type'], 'success')
+                if detail == 'predictions':
+                    del result['emergency_response']
+            else:
+                metrics.requests.inc('batch_predict', disaster_label(scenario), 'invalid')
+
+        start = time.perf_counter()
+        response = jsonify({
+            'success': True,
+            'tier': tier,
+            'count': len(results),
+            'failed': sum(1 for result in results if not result['success']),
+            'results': results
+        })
+        engine.mark_stage('serialize', start)
+        return response
+
+    except NotAcceptableError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 406
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+
+@app.route('/api/sweep', methods=['POST'])
+def sweep():
+    """
+    Scenario sweep endpoint (see scenario_sweep.py)
+    Expects {"scenario": {...}, "axes": {name: values or range}, optional "outputs"}
+    and scores the scenario over the Cartesian product of the axes in one pass.
+    Outputs are columnar, one value per cell with the last axis varying fastest.
+    With "stream": true the response is newline-delimited JSON: the sweep
+    description, then one {"offset", "columns"} line per chunk of cells.
+    format=msgpack|arrow (or an Accept header) encodes the unstreamed response.
+    """
+    data = None
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            raise ValueError("Request body must be a JSON object")
+        tier_engine, tier = select_tier(data)
+        fmt = negotiate(request_option(data, 'format'), request.accept_mimetypes)
+        plan = plan_sweep(tier_engine, data.get('scenario'), data.get('axes'), data.get('outputs'), SWEEP_MAX_CELLS)
+        if data.get('stream') and fmt in ('msgpack', 'arrow'):
+            raise ValueError("Streamed sweeps are newline-delimited JSON; leave out format or stream")
+    except NotAcceptableError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 406
+    except (ValueError, TypeError, KeyError) as e:
+        scenario = data.get('scenario') if isinstance(data, dict) else None
+        metrics.requests.inc('sweep', disaster_label(scenario), 'invalid')
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+    # The request is valid: failures from here on are the server's, counted as errors
+    disaster_type = plan['scenario']['disaster_type']
+    header = dict(describe(plan), success=True, tier=tier)
+    if data.get('stream'):
+        # Counted once the last chunk is produced
+        def lines():
+            yield dumps(header) + b'\n'
+            try:
+                for offset, frame in run_sweep(tier_engine, plan):
+                    yield dumps({'offset': offset, 'columns': json_columns(frame)}) + b'\n'
+            except Exception:
+                metrics.requests.inc('sweep', disaster_type, 'error')
+                raise
+            metrics.requests.inc('sweep', disaster_type, 'success')
+        return Response(lines(), content_type='application/x-ndjson')
+
+    try:
+        frame = sweep_outputs(tier_engine, plan)
+        if fmt in ('msgpack', 'arrow'):
+            body, content_type = encode(fmt, frame, header)
+            response = Response(body, content_type=content_type)
         else:
-            shelters = int(affected_population * 0.2)
-            equipment = "Heavy equipment: Standard deployment"
-        
-        # Evacuation recommendation
-        evacuation_needed = None
-        evacuation_centers = None
-        vehicles_needed = None
-        if major_probability > 0.6 or predicted_damage > 0.6:
-            evacuation_needed = int(affected_population * 0.7)
-            evacuation_centers = evacuation_needed // 500
-            vehicles_needed = evacuation_needed // 50
-        
-        # Prepare response
-        response = {
+            response = jsonify(dict(header, columns=json_columns(frame)))
+    except Exception as e:
+        metrics.requests.inc('sweep', disaster_type, 'error')
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+    metrics.requests.inc('sweep', disaster_type, 'success')
+    return response
+
+
+@app.route('/api/nearest-events', methods=['GET', 'POST'])
+def nearest_events():
+    """
+    Nearest historical disasters to a point, from the spatial event index
+    Parameters (query string or JSON): latitude, longitude, optional
+    disaster_type (same type only) and k (default 5, at most 100)
+    """
+    try:
+        if engine.event_index is None:
+            return jsonify({
+                'success': False,
+                'error': 'Event index not found; run `python spatial_index.py build`'
+            }), 503
+
+        params = dict(request.args.to_dict(), **(request.get_json(silent=True) or {}))
+        latitude = float(params['latitude'])
+        longitude = float(params['longitude'])
+        check_range('latitude', latitude)
+        check_range('longitude', longitude)
+        k = int(params.get('k', 5))
+        if not 1 <= k <= 100:
+            raise ValueError("k must be between 1 and 100")
+        disaster_type = params.get('disaster_type')
+        if disaster_type is not None:
+            disaster_type = engine.disaster_encoder.canonical(disaster_type)
+
+        return jsonify({
             'success': True,
-            'input': {
-                'disaster_type': disaster_type,
-                'location': location,
+            'query': {
                 'latitude': latitude,
                 'longitude': longitude,
-                'severity_level': severity_level,
-                'affected_population': affected_population,
-                'economic_loss': economic_loss
-            },
-            'predictions': {
-                'is_major_disaster': is_major,
-                'major_probability': round(major_probability * 100, 2),
-                'predicted_damage_index': round(predicted_damage, 3),
-                'predicted_response_time_hours': round(predicted_response_time, 1)
+                'disaster_type': disaster_type,
+                'k': k,
+                'inferred_location': engine.event_index.infer_location(latitude, longitude)
             },
-            'emergency_response': {
-                'priority': priority,
-                'priority_level': priority_level,
-                'alert_level': alert_level,
-                'resources': {
-                    'personnel': personnel,
-                    'medical_teams': medical_teams,
-                    'rescue_units': rescue_units,
-                    'temporary_shelters': shelters,
-                    'equipment': equipment
-                },
-                'evacuation': {
-                    'recommended': evacuation_needed is not None,
-                    'people_to_evacuate': evacuation_needed,
-                    'evacuation_centers': evacuation_centers,
-                    'vehicles_needed': vehicles_needed
-                },
-                'action_items': [
-                    f"Activate Emergency Operations Center within {predicted_response_time/2:.1f} hours",
-                    f"Deploy first responders within {predicted_response_time:.1f} hours",
-                    "Establish communication networks and evacuation routes",
-                    "Coordinate with local hospitals and emergency services",
-                    "Set up relief distribution centers"
-                ]
-            }
-        }
-        
-        return jsonify(response)
-        
+            'events': engine.event_index.nearest(latitude, longitude, k, disaster_type)
+        })
+
+    except KeyError as e:
+        return jsonify({
+            'success': False,
+            'error': f"Missing parameter {e}"
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -274,31 +591,34 @@ def predict():
         }), 400
 
 
-@app.route('/api/batch-predict', methods=['POST'])
-def batch_predict():
+@app.route('/api/stats', methods=['GET', 'POST'])
+def stats():
     """
-    Batch prediction endpoint for multiple disaster scenarios
+    Historical statistics from the aggregate cube built by stats_cube.py
+    Parameters (query string or JSON, lists or comma-separated): disaster_type,
+    location and month filters, group_by (dimensions to break down by, default
+    none: one roll-up) and percentiles (default 50,90)
     """
     try:
-        scenarios = request.json.get('scenarios', [])
-        results = []
-        
-        for scenario in scenarios:
-            # Call the predict endpoint logic for each scenario
-            # (In production, this would be refactored to avoid code duplication)
-            result = {
-                'scenario_id': scenario.get('id'),
-                'disaster_type': scenario.get('disaster_type'),
-                'location': scenario.get('location')
-            }
-            results.append(result)
-        
+        cube = stats_cube.get()
+        if cube is None:
+            return jsonify({
+                'success': False,
+                'error': 'Statistics cube not found; run `python stats_cube.py build`'
+            }), 503
+
+        params = dict(request.args.to_dict(), **(request.get_json(silent=True) or {}))
+        filters = {name: list_option(params.get(name)) for name in DIMENSIONS if params.get(name) not in (None, '')}
+        group_by = list_option(params.get('group_by')) or []
+        percentiles = [float(q) for q in list_option(params.get('percentiles')) or DEFAULT_PERCENTILES]
+        groups = cube.query(filters, group_by, percentiles)
         return jsonify({
             'success': True,
-            'count': len(results),
-            'results': results
+            'query': {'filters': filters, 'group_by': group_by, 'percentiles': percentiles},
+            'cube': {'rows': cube.rows, 'updated_at': cube.updated_at},
+            'groups': groups
         })
-        
+
     except Exception as e:
         return jsonify({
             'success': False,
@@ -306,9 +626,25 @@ def batch_predict():
         }), 400
 
 
+@app.route('/api/drift', methods=['GET'])
+def drift():
+    """
+    Input drift of /api/predict traffic against the training data (PSI per
+    feature with live vs reference histograms) and, with shadow models, their
+    prediction deltas and decision agreement with the live models
+    """
+    if drift_monitor is None:
+        return jsonify({
+            'success': False,
+            'error': 'Drift monitor is off; run `python drift_monitor.py reference` (or set DISASTER_DRIFT=1)'
+        }), 503
+    return jsonify(dict(drift_monitor.report(), success=True))
+
+
 @app.route('/api/model-info', methods=['GET'])
 def model_info():
     """Get detailed model information"""
+    decision = engine.decision
     return jsonify({
         'training_date': metadata.get('training_date'),
         'dataset_size': metadata.get('dataset_size'),
@@ -317,6 +653,21 @@ def model_info():
             'damage_r2_score': round(metadata.get('damage_r2_score', 0), 4),
             'response_r2_score': round(metadata.get('response_r2_score', 0), 4)
         },
+        'major_disaster_decision': {
+            'threshold': decision['threshold'],
+            'calibration': decision['calibration']['method'] if decision['calibration'] else None,
+            'fitted_at': decision['fitted_at'],
+            'held_out': decision['held_out']
+        } if decision else None,
+        'fast_tier': {
+            'training_date': fast_engine.metadata.get('training_date'),
+            'backend': fast_engine.backend,
+            'variants': {
+                name: report['chosen']
+                for name, report in fast_engine.metadata.get('compact_models', {}).get('models', {}).items()
+            },
+            'model_scores': fast_engine.metadata.get('model_scores')
+        } if fast_engine else None,
         'features': {
             'disaster_prediction': metadata.get('feature_columns', {}).get('disaster_prediction', []),
             'damage_assessment': metadata.get('feature_columns', {}).get('damage_assessment', []),
@@ -333,7 +684,9 @@ if __name__ == '__main__':
     print(f"  Model Accuracy: {metadata.get('model_accuracy', 0)*100:.2f}%")
     print(f"  Dataset Size: {metadata.get('dataset_size', 0):,} records")
     print("="*70)
-    print("\n  Server starting at http://localhost:5000")
-    print("  API Documentation: http://localhost:5000/\n")
-    
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    print("\n  Development server starting at http://localhost:5000")
+    print("  API Documentation: http://localhost:5000/")
+    print("  For production use `python serve.py --workers N --threads M`\n")
+
+    # DISASTER_DEBUG=1 enables the Werkzeug debugger and reloader (development only)
+    app.run(debug=os.environ.get('DISASTER_DEBUG') == '1', host='0.0.0.0', port=5000)
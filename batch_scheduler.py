@@ -0,0 +1,209 @@
+"""
+Micro-Batch Scheduler
+Queues single-scenario predictions from concurrent requests and runs them
+through the cascade together, so a burst of /api/predict calls costs a few
+batched model evaluations instead of one single-row evaluation per call
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from inference_engine import format_prediction
+
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_BATCH_WAIT_MS = 5.0
+DEFAULT_QUEUE_DEPTH = 1024
+# Longest a request waits for its result before giving up
+DEFAULT_RESULT_TIMEOUT = 30.0
+
+_STOP = object()
+
+
+class QueueFullError(RuntimeError):
+    """Raised by submit when max_queue requests are already waiting"""
+
+
+class MicroBatchScheduler:
+    """
+    Bounded request queue in front of a DisasterInferenceEngine.
+
+    submit() validates a scenario in the caller's thread and returns a Future.
+    One background thread takes the oldest waiting request, keeps collecting
+    until max_batch_size requests are in hand or max_wait_ms have passed since
+    that request arrived, scores the batch with engine.predict_scenarios (cache
+    and parameter table included) and resolves every Future with the
+    /api/predict response dict. A request therefore waits at most max_wait_ms
+    plus one batch evaluation once it reaches the head of the queue.
+    """
+
+    def __init__(self, engine, max_batch_size=DEFAULT_BATCH_SIZE, max_wait_ms=DEFAULT_BATCH_WAIT_MS,
+                 max_queue=DEFAULT_QUEUE_DEPTH):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_queue = max_queue
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_batch_size = 0
+        self.max_queue_depth = 0
+        self._queue_seconds = 0.0
+        self._batch_seconds = 0.0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='micro-batch-scheduler', daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_env(cls, engine):
+        """
+        Scheduler configured from DISASTER_MICROBATCH (1 enables it),
+        DISASTER_BATCH_SIZE, DISASTER_BATCH_WAIT_MS and DISASTER_QUEUE_DEPTH;
+        None when micro-batching is off
+        """
+        if os.environ.get('DISASTER_MICROBATCH', '0') != '1':
+            return None
+        return cls(
+            engine,
+            max_batch_size=int(os.environ.get('DISASTER_BATCH_SIZE', DEFAULT_BATCH_SIZE)),
+            max_wait_ms=float(os.environ.get('DISASTER_BATCH_WAIT_MS', DEFAULT_BATCH_WAIT_MS)),
+            max_queue=int(os.environ.get('DISASTER_QUEUE_DEPTH', DEFAULT_QUEUE_DEPTH)),
+        )
+
+    def submit(self, data, now=None):
+        """
+        Queue one scenario dict and return a Future for its response dict.
+        Validation errors are raised here; QueueFullError when the queue is full.
+        """
+        if self._closed:
+            raise RuntimeError("Scheduler is closed")
+        start = time.perf_counter()
+        scenario = self.engine.parse_scenario(data, now)
+        self.engine.mark_stage('parse', start)
+        future = Future()
+        try:
+            self._queue.put_nowait((scenario, future, time.monotonic()))
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise QueueFullError(f"Prediction queue is full ({self.max_queue} requests waiting)") from None
+        depth = self._queue.qsize()
+        with self._lock:
+            self.submitted += 1
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+        return future
+
+    def predict_one(self, data, now=None, timeout=DEFAULT_RESULT_TIMEOUT):
+        """Same result as engine.predict_one, scored in a micro-batch"""
+        future = self.submit(data, now)
+        start = time.perf_counter()
+        result = future.result(timeout)
+        # Queue wait plus the batch's cascade, as seen by the request
+        self.engine.mark_stage('batch', start)
+        return result
+
+    def _collect(self, first):
+        """first plus whatever arrives before the batch is full or its wait is over"""
+        batch = [first]
+        deadline = first[2] + self.max_wait_ms / 1000
+        stop = False
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # Past the deadline, still take requests that are already queued
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stop = True
+                break
+            batch.append(item)
+        return batch, stop
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch, stop = self._collect(item)
+            self._score(batch)
+        # Requests that raced with close()
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                item[1].set_exception(RuntimeError("Scheduler is closed"))
+
+    def _score(self, batch):
+        start = time.monotonic()
+        engine = self.engine
+        if engine.stage_observer is not None:
+            for _, _, enqueued in batch:
+                engine.stage_observer('queue', start - enqueued)
+        scenarios = [scenario for scenario, _, _ in batch]
+        try:
+            records = engine.predict_scenarios(scenarios)
+            formatted = time.perf_counter()
+            results = [format_prediction(scenario, record) for scenario, record in zip(scenarios, records)]
+            engine.mark_stage('format', formatted)
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            results = None
+        else:
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+        finished = time.monotonic()
+
+        with self._lock:
+            self.batches += 1
+            self.last_batch_size = len(batch)
+            if results is None:
+                self.failed += len(batch)
+            else:
+                self.completed += len(batch)
+            self._queue_seconds += sum(start - enqueued for _, _, enqueued in batch)
+            self._batch_seconds += finished - start
+
+    def is_alive(self):
+        """False in a forked child process, where the worker thread does not exist"""
+        return self._thread.is_alive()
+
+    def close(self, timeout=5.0):
+        """Stop the worker after the requests already queued; later submits raise"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            done = self.completed + self.failed
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait_ms,
+                'max_queue': self.max_queue,
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self.max_queue_depth,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'batches': self.batches,
+                'last_batch_size': self.last_batch_size,
+                'mean_batch_size': round(done / self.batches, 2) if self.batches else 0.0,
+                'mean_queue_wait_ms': round(self._queue_seconds / done * 1000, 3) if done else 0.0,
+                'mean_batch_ms': round(self._batch_seconds / self.batches * 1000, 3) if self.batches else 0.0,
+            }
@@ -0,0 +1,373 @@
+"""
+Benchmark Suite
+Measures the inference cascade on a workload sampled from the preprocessed
+dataset: cold start and peak memory, per-model and whole-cascade single-row
+latency percentiles, batch throughput at several batch sizes, and in-process
+Flask test-client QPS. Results are written to JSON; `compare` diffs two runs
+and exits with status 1 when a metric regressed beyond the tolerance.
+
+Usage:
+    python benchmark.py run [--model-dir saved_models] [--requests 500] [--output benchmark.json]
+                            [--batch-sizes 1 16 64 256 1024 4096] [--skip-http] [--seed 0]
+    python benchmark.py compare OLD.json NEW.json [--tolerance 0.15]
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_REQUESTS = 500
+DEFAULT_BATCH_SIZES = (1, 16, 64, 256, 1024, 4096)
+# Each throughput measurement repeats the call until it has run this long
+MIN_MEASURE_SECONDS = 0.25
+PERCENTILES = (50, 90, 99)
+DEFAULT_TOLERANCE = 0.15
+# Load / warm-up times below this are timer noise and never count as regressions
+MIN_COMPARED_SECONDS = 0.01
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        from model_store import current_rss
+        return current_rss()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def latency_summary(seconds):
+    """Mean, percentiles and max of a list of durations, in milliseconds"""
+    ms = np.asarray(seconds) * 1000
+    summary = {'mean_ms': round(float(ms.mean()), 4)}
+    for q in PERCENTILES:
+        summary[f'p{q}_ms'] = round(float(np.percentile(ms, q)), 4)
+    summary['max_ms'] = round(float(ms.max()), 4)
+    return summary
+
+
+def throughput(fn, rows):
+    """Rows per second of fn() over at least MIN_MEASURE_SECONDS"""
+    fn()  # first call outside the measurement (buffer growth, lazy imports)
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        fn()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_MEASURE_SECONDS:
+            return round(calls * rows / elapsed, 1)
+
+
+def sample_workload(data_path, n, seed=0, canonical_share=0.0):
+    """
+    n /api/predict request dicts drawn from the preprocessed dataset's events,
+    so disaster types, locations, coordinates and dates follow its distribution.
+    canonical_share of them leave out latitude / longitude (canonical coordinates).
+    """
+    from inference_engine import date_features
+
+    df = pd.read_csv(data_path, usecols=['disaster_type', 'location', 'latitude', 'longitude', 'date'])
+    rows = df.sample(n, replace=n > len(df), random_state=seed).reset_index(drop=True)
+    dates = pd.DataFrame(date_features(rows['date']))
+    canonical = np.random.default_rng(seed).random(n) < canonical_share
+    requests = []
+    for i, row in enumerate(rows.itertuples(index=False)):
+        request = {'disaster_type': row.disaster_type, 'location': row.location,
+                   'month': int(dates['month'][i]), 'week': int(dates['week'][i]),
+                   'day_of_year': int(dates['day_of_year'][i])}
+        if not canonical[i]:
+            request['latitude'] = float(row.latitude)
+            request['longitude'] = float(row.longitude)
+        requests.append(request)
+    return requests
+
+
+def cold_start(model_dir, backend):
+    """
+    Load and warm up an engine in a fresh interpreter (python benchmark.py
+    cold-start) and return its timings, peak RSS and per-artifact load report
+    """
+    command = [sys.executable, os.path.abspath(__file__), 'cold-start', '--model-dir', model_dir,
+               '--backend', backend]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def _cold_start_child(model_dir, backend):
+    start = time.perf_counter()
+    # Keep stdout for the JSON result
+    with contextlib.redirect_stdout(sys.stderr):
+        from inference_engine import DisasterInferenceEngine
+        imported = time.perf_counter()
+        engine = DisasterInferenceEngine(model_dir, lazy=False, backend=backend)
+        loaded = time.perf_counter()
+        engine.warm_up()
+    print(json.dumps({
+        'backend': engine.backend,
+        'import_seconds': round(imported - start, 4),
+        'load_seconds': round(loaded - imported, 4),
+        'warmup_seconds': engine.warmup_seconds,
+        'total_seconds': round(time.perf_counter() - start, 4),
+        'peak_rss_bytes': peak_rss(),
+        'artifacts': engine.load_report(),
+    }))
+
+
+def benchmark_models(engine, requests, batch_sizes):
+    """Single-row latency and batch throughput of each sklearn model on its scaled stage input"""
+    from inference_engine import CASCADE_STAGES
+
+    inputs = engine.stage_inputs([engine.parse_scenario(request) for request in requests])
+    results = {}
+    for stage, entries in CASCADE_STAGES.items():
+        if stage not in inputs:
+            continue
+        X = engine.scale_stage_input(stage, inputs[stage])
+        for name, offset, _ in entries:
+            model = engine.artifacts[name]
+            columns = np.ascontiguousarray(X[:, offset:offset + model.n_features_in_])
+            predict = model.predict_proba if hasattr(model, 'predict_proba') else model.predict
+            latencies = []
+            for i in range(len(columns)):
+                start = time.perf_counter()
+                predict(columns[i:i + 1])
+                latencies.append(time.perf_counter() - start)
+            sizes = [size for size in batch_sizes if size <= len(columns)]
+            results[name] = {
+                'stage': stage,
+                'n_jobs': getattr(model, 'n_jobs', None),
+                'single_row': latency_summary(latencies),
+                'batch_rows_per_second': {
+                    str(size): throughput(lambda: predict(columns[:size]), size) for size in sizes
+                },
+            }
+            print(f"  {name:<22} p50 {results[name]['single_row']['p50_ms']:>8.3f} ms   "
+                  f"p99 {results[name]['single_row']['p99_ms']:>8.3f} ms")
+    return results
+
+
+def benchmark_cascade(engine, requests, batch_sizes):
+    """predict_one latency (parse to response dict) and predict_many throughput"""
+    latencies = []
+    for request in requests:
+        start = time.perf_counter()
+        engine.predict_one(request)
+        latencies.append(time.perf_counter() - start)
+
+    scenarios = pd.DataFrame([engine.parse_scenario(request) for request in requests])
+    batch = {}
+    for size in batch_sizes:
+        frame = pd.concat([scenarios] * -(-size // len(scenarios)), ignore_index=True).iloc[:size]
+        batch[str(size)] = throughput(lambda: engine.predict_many(frame), size)
+    result = {'single_row': latency_summary(latencies), 'batch_rows_per_second': batch}
+    print(f"  {engine.backend:<22} p50 {result['single_row']['p50_ms']:>8.3f} ms   "
+          f"p99 {result['single_row']['p99_ms']:>8.3f} ms   "
+          + '   '.join(f"{size}: {rate:,.0f} rows/s" for size, rate in batch.items()))
+    return result
+
+
+def benchmark_http(requests):
+    """Sequential /api/predict requests through the Flask test client (no network, cache off)"""
+    os.environ['DISASTER_CACHE_SIZE'] = '0'
+    with contextlib.redirect_stdout(sys.stderr):
+        import app
+    client = app.app.test_client()
+    client.post('/api/predict', json=requests[0])
+    app.metrics.stage_seconds.clear()
+
+    latencies = []
+    failures = 0
+    start = time.perf_counter()
+    for request in requests:
+        began = time.perf_counter()
+        response = client.post('/api/predict', json=request)
+        latencies.append(time.perf_counter() - began)
+        failures += response.status_code != 200
+    elapsed = time.perf_counter() - start
+
+    stage_ms = {stage: round(total / count * 1000, 4)
+                for (stage,), (total, count) in app.metrics.stage_seconds.totals().items()}
+    result = {
+        'requests': len(requests),
+        'failures': failures,
+        'qps': round(len(requests) / elapsed, 1),
+        'latency': latency_summary(latencies),
+        'mean_stage_ms': stage_ms,
+    }
+    print(f"  /api/predict           {result['qps']:,.0f} requests/s   p50 {result['latency']['p50_ms']:.3f} ms   "
+          f"p99 {result['latency']['p99_ms']:.3f} ms")
+    return result
+
+
+def environment(model_dir):
+    import sklearn
+
+    from inference_engine import load_artifacts
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    with contextlib.redirect_stdout(sys.stderr):
+        metadata = load_artifacts(model_dir).get('metadata') or {}
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': commit,
+        'training_date': metadata.get('training_date'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'scikit_learn': sklearn.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def run(model_dir, data_path, n_requests, batch_sizes, seed=0, canonical_share=0.0, http=True):
+    from inference_engine import DisasterInferenceEngine
+
+    results = {'environment': environment(model_dir),
+               'workload': {'requests': n_requests, 'seed': seed, 'canonical_share': canonical_share,
+                            'batch_sizes': list(batch_sizes), 'data': data_path}}
+    requests = sample_workload(data_path, n_requests, seed, canonical_share)
+
+    print("\nCold start (fresh interpreter, every artifact loaded):")
+    results['cold_start'] = {}
+    for backend in ('sklearn', 'auto'):
+        report = cold_start(model_dir, backend)
+        results['cold_start'][report['backend']] = report
+        print(f"  {report['backend']:<22} {report['total_seconds']:.2f} s, "
+              f"peak RSS {report['peak_rss_bytes'] / 2**20:.0f} MB")
+
+    with contextlib.redirect_stdout(sys.stderr):
+        engine = DisasterInferenceEngine(model_dir, lazy=False, backend='sklearn')
+    print("\nModels (sklearn, scaled stage inputs):")
+    results['models'] = benchmark_models(engine, requests, batch_sizes)
+
+    print("\nCascade (cache off):")
+    results['cascade'] = {'sklearn': benchmark_cascade(engine, requests, batch_sizes)}
+    with contextlib.redirect_stdout(sys.stderr):
+        auto = DisasterInferenceEngine(model_dir, lazy=False)
+    if auto.backend != 'sklearn':
+        results['cascade'][auto.backend] = benchmark_cascade(auto, requests, batch_sizes)
+
+    if http:
+        print("\nHTTP (Flask test client, sequential, cache off):")
+        results['http'] = benchmark_http(requests)
+    return results
+
+
+def _flatten(results, prefix=''):
+    for key, value in results.items():
+        path = f'{prefix}{key}'
+        if isinstance(value, dict):
+            yield from _flatten(value, path + '.')
+        elif isinstance(value, list) and key == 'artifacts':
+            for entry in value:
+                if 'load_seconds' in entry:
+                    yield f"{path}.{entry['artifact']}.load_seconds", entry['load_seconds']
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield path, value
+
+
+def _higher_is_better(path):
+    return path.endswith('qps') or 'rows_per_second' in path
+
+
+def _is_measurement(path):
+    return (path.endswith(('_ms', '_seconds', '_bytes', 'qps')) or 'rows_per_second' in path) \
+        and not path.startswith('workload')
+
+
+def compare(old, new, tolerance=DEFAULT_TOLERANCE):
+    """
+    Relative change of every measurement present in both runs. Returns
+    (rows, regressions) where rows are (metric, old, new, change) and change
+    is positive when the new run is better.
+    """
+    old_values = dict(_flatten(old))
+    rows, regressions = [], []
+    for path, value in _flatten(new):
+        if path not in old_values or not _is_measurement(path) or not old_values[path]:
+            continue
+        change = (value - old_values[path]) / abs(old_values[path])
+        if not _higher_is_better(path):
+            change = -change
+        rows.append((path, old_values[path], value, change))
+        # A single worst sample and millisecond-scale load times are too noisy to gate on
+        noisy = path.endswith('max_ms') or (path.endswith('_seconds')
+                                            and max(value, old_values[path]) < MIN_COMPARED_SECONDS)
+        if change < -tolerance and not noisy:
+            regressions.append(path)
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help="Run the benchmarks and write JSON")
+    run_parser.add_argument('--model-dir', default=None)
+    run_parser.add_argument('--data', default=None, help="Dataset the workload is sampled from")
+    run_parser.add_argument('--requests', type=int, default=DEFAULT_REQUESTS,
+                            help="Single-row requests per measurement")
+    run_parser.add_argument('--batch-sizes', type=int, nargs='+', default=list(DEFAULT_BATCH_SIZES))
+    run_parser.add_argument('--canonical-share', type=float, default=0.0,
+                            help="Fraction of requests without coordinates (parameter table path)")
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--skip-http', action='store_true')
+    run_parser.add_argument('--output', default='benchmark.json')
+    compare_parser = subparsers.add_parser('compare', help="Compare two result files")
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                                help="Relative slowdown reported as a regression (default: 0.15)")
+    child_parser = subparsers.add_parser('cold-start')
+    child_parser.add_argument('--model-dir', required=True)
+    child_parser.add_argument('--backend', default='auto')
+    args = parser.parse_args(argv)
+
+    if args.command == 'cold-start':
+        _cold_start_child(args.model_dir, args.backend)
+        return
+
+    if args.command == 'compare':
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        rows, regressions = compare(old, new, args.tolerance)
+        print(f"\n  {'Metric':<72}{'Old':>14}{'New':>14}{'Change':>9}")
+        for path, before, after, change in rows:
+            flag = '  ✗' if path in regressions else ('  ✓' if change > args.tolerance else '')
+            print(f"  {path:<72}{before:>14,.4g}{after:>14,.4g}{change:>+9.1%}{flag}")
+        if regressions:
+            print(f"\n✗ {len(regressions)} metrics regressed by more than {args.tolerance:.0%}")
+            sys.exit(1)
+        print(f"\n✓ No metric regressed by more than {args.tolerance:.0%}")
+        return
+
+    # The engine and app.py read the model directory from the environment
+    if args.model_dir:
+        os.environ['DISASTER_MODEL_DIR'] = args.model_dir
+    from inference_engine import DATA_PATH, MODEL_DIR
+
+    results = run(MODEL_DIR, args.data or DATA_PATH, args.requests, args.batch_sizes, args.seed,
+                  args.canonical_share, http=not args.skip_http)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\n✓ Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+"""
+Major Disaster Decision Rule
+Calibrates the major disaster probability and chooses the decision threshold on
+the held-out split of the training data, scored through the cascade as served
+(predicted parameters, damage prior). Both are stored in model_metadata.pkl
+under 'major_decision', and the inference engine applies them to the single
+classifier pass of every prediction path
+
+Usage:
+    python calibration.py fit [--method isotonic|sigmoid|none]
+                              [--threshold T | --target-recall R | --target-precision P]
+                              [--test-size F --random-state N]
+    python calibration.py show
+    python calibration.py clear
+
+The held-out rows are the split recorded in the model metadata by
+train_pipeline.py. For older models without it, fit refuses to run unless the
+split is given with --test-size and --random-state.
+
+Without 'major_decision' the engine keeps the classifier's own rule (the more
+probable class). Changing it only rewrites model_metadata.pkl; the compiled
+models and the parameter table stay valid.
+"""
+
+import argparse
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+
+DEFAULT_THRESHOLD = 0.5
+METHODS = ('isotonic', 'sigmoid', 'none')
+
+
+def calibrate(probability, calibration):
+    """Calibrated major disaster probabilities for an array of raw classifier probabilities"""
+    if not calibration:
+        return probability
+    if calibration['method'] == 'isotonic':
+        return np.interp(probability, calibration['x'], calibration['y'])
+    if calibration['method'] == 'sigmoid':
+        return 1 / (1 + np.exp(-(calibration['a'] * probability + calibration['b'])))
+    raise ValueError(f"Unknown calibration method '{calibration['method']}'")
+
+
+def fit_calibration(probability, labels, method='isotonic'):
+    """
+    Calibration mapping (a plain dict, see calibrate) fitted on raw probabilities
+    and true labels: isotonic regression, or a logistic fit of the probability
+    (Platt scaling). None for method 'none'.
+    """
+    if method == 'none':
+        return None
+    if method == 'isotonic':
+        from sklearn.isotonic import IsotonicRegression
+        model = IsotonicRegression(y_min=0.0, y_max=1.0, out_of_bounds='clip').fit(probability, labels)
+        return {'method': 'isotonic', 'x': model.X_thresholds_.tolist(), 'y': model.y_thresholds_.tolist()}
+    if method == 'sigmoid':
+        from sklearn.linear_model import LogisticRegression
+        model = LogisticRegression(C=1e6).fit(probability.reshape(-1, 1), labels)
+        return {'method': 'sigmoid', 'a': float(model.coef_[0, 0]), 'b': float(model.intercept_[0])}
+    raise ValueError(f"Unknown calibration method '{method}'")
+
+
+def choose_threshold(probability, labels, target_recall=None, target_precision=None):
+    """
+    Decision threshold on (calibrated) probabilities: the highest one that still
+    reaches target_recall, the lowest one that reaches target_precision, or
+    DEFAULT_THRESHOLD without a target
+    """
+    if target_recall is None and target_precision is None:
+        return DEFAULT_THRESHOLD
+    from sklearn.metrics import precision_recall_curve
+    precision, recall, thresholds = precision_recall_curve(labels, probability)
+    if target_recall is not None:
+        reached = thresholds[recall[:-1] >= target_recall]
+        if not len(reached):
+            raise ValueError(f"No threshold reaches a recall of {target_recall}")
+        return float(reached.max())
+    reached = thresholds[precision[:-1] >= target_precision]
+    if not len(reached):
+        raise ValueError(f"No threshold reaches a precision of {target_precision}")
+    return float(reached.min())
+
+
+def decision_metrics(probability, labels, threshold):
+    """Accuracy, precision, recall and Brier score of probability >= threshold"""
+    predicted = probability >= threshold
+    labels = labels.astype(bool)
+    true_positives = int((predicted & labels).sum())
+    return {
+        'accuracy': float((predicted == labels).mean()),
+        'precision': true_positives / max(int(predicted.sum()), 1),
+        'recall': true_positives / max(int(labels.sum()), 1),
+        'brier': float(np.mean((probability - labels) ** 2)),
+    }
+
+
+def held_out_probabilities(engine, data_path, test_size=None, random_state=None):
+    """
+    (raw major disaster probabilities, true labels) over the rows train_pipeline.py
+    held out for testing, scored by the full cascade without a decision rule.
+    test_size and random_state are only used when the metadata does not record
+    the training split (see train_pipeline.recorded_split).
+    """
+    from sklearn.model_selection import train_test_split
+
+    from inference_engine import historical_scenarios
+    from train_pipeline import PARAMETER_MODELS, recorded_split
+
+    # The major probability comes from the classifier fed by the predicted parameters
+    test_size, random_state = recorded_split(engine.metadata, PARAMETER_MODELS + ['disaster_classifier'],
+                                             test_size, random_state)
+    labels = pd.read_csv(data_path, usecols=['is_major_disaster'])['is_major_disaster'].to_numpy().astype(int)
+    _, test_idx = train_test_split(np.arange(len(labels)), test_size=test_size, random_state=random_state,
+                                   stratify=labels)
+    scenarios = historical_scenarios(data_path).iloc[test_idx].reset_index(drop=True)
+
+    decision, engine.decision = engine.decision, None
+    try:
+        records = engine.predict_many(scenarios)
+    finally:
+        engine.decision = decision
+    return records['major_probability'], labels[test_idx]
+
+
+def fit_decision(engine, data_path, method='isotonic', threshold=None, target_recall=None, target_precision=None,
+                 test_size=None, random_state=None):
+    """The 'major_decision' metadata entry fitted on the held-out split"""
+    raw, labels = held_out_probabilities(engine, data_path, test_size, random_state)
+    calibration = fit_calibration(raw, labels, method)
+    probability = calibrate(raw, calibration)
+    if threshold is None:
+        threshold = choose_threshold(probability, labels, target_recall, target_precision)
+    return {
+        'threshold': float(threshold),
+        'calibration': calibration,
+        'fitted_at': pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'training_date': engine.metadata.get('training_date'),
+        'samples': len(labels),
+        'target_recall': target_recall,
+        'target_precision': target_precision,
+        'uncalibrated': decision_metrics(raw, labels, DEFAULT_THRESHOLD),
+        'held_out': decision_metrics(probability, labels, threshold),
+    }
+
+
+def save_decision(model_dir, decision):
+    """Store decision (None removes it) in model_metadata.pkl, replacing the file atomically"""
+    from inference_engine import MODEL_FILES
+
+    path = os.path.join(model_dir, MODEL_FILES['metadata'])
+    metadata = joblib.load(path)
+    if decision is None:
+        metadata.pop('major_decision', None)
+    else:
+        metadata['major_decision'] = decision
+    tmp_path = path + '.tmp'
+    joblib.dump(metadata, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _print_metrics(label, metrics):
+    print(f"   {label:<28}" + ", ".join(f"{key}={value:.4f}" for key, value in metrics.items()))
+
+
+def main(argv=None):
+    from inference_engine import DATA_PATH, MODEL_DIR, DisasterInferenceEngine
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['fit', 'show', 'clear'])
+    parser.add_argument('--model-dir', default=MODEL_DIR)
+    parser.add_argument('--data', default=DATA_PATH, help="Preprocessed dataset the models were trained on")
+    parser.add_argument('--method', choices=METHODS, default='isotonic', help="Probability calibration")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--threshold', type=float, default=None,
+                        help=f"Decision threshold on the calibrated probability (default: {DEFAULT_THRESHOLD})")
+    target.add_argument('--target-recall', type=float, default=None,
+                        help="Highest threshold whose held-out recall is at least this")
+    target.add_argument('--target-precision', type=float, default=None,
+                        help="Lowest threshold whose held-out precision is at least this")
+    parser.add_argument('--test-size', type=float, default=None,
+                        help="Test fraction of the training split, for models whose metadata does not record it")
+    parser.add_argument('--random-state', type=int, default=None,
+                        help="Seed of the training split, for models whose metadata does not record it")
+    args = parser.parse_args(argv)
+
+    if args.command == 'clear':
+        save_decision(args.model_dir, None)
+        print("✓ Decision rule removed; the classifier's own rule applies")
+        return
+
+    engine = DisasterInferenceEngine(args.model_dir)
+    if args.command == 'show':
+        decision = engine.metadata.get('major_decision')
+        if decision is None:
+            print("No decision rule; the classifier's own rule applies")
+            return
+        calibration = decision['calibration']
+        print(f"Threshold {decision['threshold']:.4f}, calibration "
+              f"{calibration['method'] if calibration else 'none'}, fitted {decision['fitted_at']} "
+              f"on {decision['samples']:,} held-out events")
+        _print_metrics('uncalibrated, threshold 0.5', decision['uncalibrated'])
+        _print_metrics('decision rule', decision['held_out'])
+        return
+
+    try:
+        decision = fit_decision(engine, args.data, args.method, args.threshold, args.target_recall,
+                                args.target_precision, args.test_size, args.random_state)
+    except ValueError as e:
+        print(f"✗ {e}")
+        raise SystemExit(1)
+    save_decision(args.model_dir, decision)
+    print(f"✓ Decision rule (threshold {decision['threshold']:.4f}, calibration {args.method}) fitted on "
+          f"{decision['samples']:,} held-out events and saved to model_metadata.pkl")
+    _print_metrics('uncalibrated, threshold 0.5', decision['uncalibrated'])
+    _print_metrics('decision rule', decision['held_out'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Category Encoder
+Constant-time encoding of disaster types and locations with case / whitespace
+folding and aliases, built once from the saved LabelEncoders
+"""
+
+import numpy as np
+import pandas as pd
+
+# Alternative spellings, keyed by normalized value (see normalize_category)
+DISASTER_ALIASES = {
+    'quake': 'Earthquake',
+    'earth quake': 'Earthquake',
+    'seismic event': 'Earthquake',
+    'floods': 'Flood',
+    'flooding': 'Flood',
+    'flash flood': 'Flood',
+    'typhoon': 'Hurricane',
+    'cyclone': 'Hurricane',
+    'tropical cyclone': 'Hurricane',
+    'tropical storm': 'Hurricane',
+    'landslides': 'Landslide',
+    'land slide': 'Landslide',
+    'mudslide': 'Landslide',
+    'volcano': 'Volcanic Eruption',
+    'volcanic': 'Volcanic Eruption',
+    'eruption': 'Volcanic Eruption',
+    'fire': 'Wildfire',
+    'wild fire': 'Wildfire',
+    'forest fire': 'Wildfire',
+    'bushfire': 'Wildfire',
+    'droughts': 'Drought',
+}
+LOCATION_ALIASES = {
+    'us': 'USA',
+    'u.s.': 'USA',
+    'u.s.a.': 'USA',
+    'united states': 'USA',
+    'united states of america': 'USA',
+    'america': 'USA',
+    'bharat': 'India',
+    'republic of india': 'India',
+    'republic of indonesia': 'Indonesia',
+    'italia': 'Italy',
+    'nippon': 'Japan',
+    'nihon': 'Japan',
+    'philippine islands': 'Philippines',
+    'the philippines': 'Philippines',
+    'republic of the philippines': 'Philippines',
+    'türkiye': 'Turkey',
+    'turkiye': 'Turkey',
+    'republic of chile': 'Chile',
+}
+
+
+def normalize_category(value):
+    """Case-fold and collapse whitespace so 'flood', ' Flood ' and 'FLOOD' compare equal"""
+    return ' '.join(str(value).split()).casefold()
+
+
+class UnknownCategoryError(ValueError):
+    """Raised for values that match neither a class nor an alias"""
+
+    def __init__(self, field, values, known):
+        self.field = field
+        self.values = list(values)
+        self.known = list(known)
+        shown = ', '.join(repr(value) for value in self.values[:5])
+        more = f" (+{len(self.values) - 5} more)" if len(self.values) > 5 else ""
+        super().__init__(f"Unknown {field} {shown}{more}; expected one of: {', '.join(self.known)}")
+
+
+class CategoryEncoder:
+    """
+    Dictionary encoder equivalent to LabelEncoder.transform for known classes.
+    Lookups go through normalize_category, so case, surrounding whitespace and
+    the given aliases are accepted. Unknown values raise UnknownCategoryError.
+    """
+
+    def __init__(self, classes, aliases=None, field='value'):
+        self.classes = [str(name) for name in classes]
+        self.field = field
+        self.index = {normalize_category(name): i for i, name in enumerate(self.classes)}
+        for alias, name in (aliases or {}).items():
+            if normalize_category(name) in self.index:
+                self.index.setdefault(normalize_category(alias), self.index[normalize_category(name)])
+
+    @classmethod
+    def from_label_encoder(cls, label_encoder, aliases=None, field='value'):
+        return cls(label_encoder.classes_, aliases, field)
+
+    def __contains__(self, value):
+        return value is not None and normalize_category(value) in self.index
+
+    def get(self, value, default=None):
+        """Code of value, or default when it is unknown"""
+        if value is None:
+            return default
+        return self.index.get(normalize_category(value), default)
+
+    def encode(self, value):
+        code = self.get(value)
+        if code is None:
+            raise UnknownCategoryError(self.field, [value], self.classes)
+        return code
+
+    def canonical(self, value):
+        """Class name value encodes to (e.g. 'india' -> 'India')"""
+        return self.classes[self.encode(value)]
+
+    def encode_many(self, values):
+        """
+        Encode a sequence / Series of values to an int array. Each distinct value
+        is normalized and looked up once (hash-based factorize, no sorting).
+        """
+        codes, uniques = pd.factorize(pd.Series(values, dtype=object), use_na_sentinel=False)
+        mapped = np.array([self.get(value, -1) for value in uniques], dtype=np.int64)
+        unknown = mapped < 0
+        if unknown.any():
+            raise UnknownCategoryError(self.field, uniques[unknown], self.classes)
+        return mapped[codes]
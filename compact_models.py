@@ -0,0 +1,280 @@
+"""
+Compact Models
+Builds the fast tier: small variants of the six cascade models, chosen per model
+by served single-row latency among the variants that stay within --max-loss of the full
+model's test score (accuracy for the classifier, R² for the regressors)
+
+Variants:
+    shallow           fewer, shallower trees of the same kind, trained on the true targets
+    pruned            the first trees / boosting stages of the full model, without retraining
+    distilled_hist    HistGradientBoosting trained on the full model's training set predictions
+    distilled_linear  ridge / logistic regression trained on the same predictions
+
+Tree ensembles are timed through the compiled evaluator that serves them, the
+other variants through sklearn. Every variant is reported with its size, latency
+and score delta. The chosen models are
+written with copies of the scalers, encoders and event index to --output, together
+with their parameter table and (for tree models) compiled evaluator. app.py serves
+that directory as tier=fast (see DISASTER_FAST_MODEL_DIR).
+
+Usage:
+    python compact_models.py [--model-dir saved_models] [--output saved_models/fast]
+                             [--variants shallow pruned ...] [--max-loss 0.02]
+                             [--test-size F --random-state N]
+"""
+
+import argparse
+import copy
+import os
+import pickle
+import shutil
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import (GradientBoostingRegressor, HistGradientBoostingClassifier,
+                              HistGradientBoostingRegressor, RandomForestClassifier, RandomForestRegressor)
+from sklearn.linear_model import LogisticRegression, Ridge
+from sklearn.model_selection import train_test_split
+
+from inference_engine import (CASCADE_STAGES, COMPILED_FILE, DATA_PATH, MODEL_DIR, MODEL_FILES,
+                              PARAMETER_TABLE_FILE, DisasterInferenceEngine)
+from parameter_table import build_parameter_table, save_parameter_table
+from train_pipeline import (FEATURE_SETS, MODEL_SPECS, RANDOM_STATE, SCALERS, evaluate, load_training_frame,
+                            recorded_split, write_artifacts)
+from tree_compiler import compile_cascade, compile_ensembles, save_compiled
+
+VARIANTS = ('shallow', 'pruned', 'distilled_hist', 'distilled_linear')
+DEFAULT_MAX_LOSS = 0.02
+# Variants with these estimator kinds can be compiled by tree_compiler.py
+COMPILABLE = (RandomForestClassifier, RandomForestRegressor, GradientBoostingRegressor)
+# Artifacts the fast tier shares with the full models, copied unchanged
+SHARED_ARTIFACTS = ('scaler_parameters', 'scaler_disaster', 'scaler_damage', 'scaler_response',
+                    'le_disaster', 'le_location', 'le_aid', 'event_index')
+
+SHALLOW_FOREST = dict(n_estimators=30, max_depth=8, min_samples_leaf=4)
+SHALLOW_BOOSTING = dict(n_estimators=100, learning_rate=0.1, max_depth=3)
+PRUNED_TREES = 25
+PRUNED_STAGES = 50
+DISTILLED_HIST = dict(max_iter=100, max_depth=6, learning_rate=0.1)
+
+
+def prune(model, n):
+    """Copy of a fitted forest or gradient boosting model keeping only its first n trees / stages"""
+    pruned = copy.copy(model)
+    n = min(n, len(model.estimators_))
+    pruned.estimators_ = model.estimators_[:n]
+    pruned.n_estimators = n
+    if isinstance(model, GradientBoostingRegressor):
+        pruned.n_estimators_ = n
+        pruned.train_score_ = model.train_score_[:n]
+    return pruned
+
+
+def build_variant(variant, name, teacher, X, y, random_state=RANDOM_STATE):
+    """Fit one compact variant of model name; teacher is the full model, (X, y) its training set"""
+    classifier = MODEL_SPECS[name][2] is RandomForestClassifier
+    if variant == 'pruned':
+        return prune(teacher, PRUNED_STAGES if isinstance(teacher, GradientBoostingRegressor) else PRUNED_TREES)
+    if variant == 'shallow':
+        if isinstance(teacher, GradientBoostingRegressor):
+            return GradientBoostingRegressor(**SHALLOW_BOOSTING, random_state=random_state).fit(X, y)
+        estimator_class = RandomForestClassifier if classifier else RandomForestRegressor
+        return estimator_class(**SHALLOW_FOREST, n_jobs=-1, random_state=random_state).fit(X, y)
+
+    # Distilled students learn the full model's predictions instead of the noisy targets
+    target = teacher.predict(X)
+    if variant == 'distilled_hist':
+        estimator_class = HistGradientBoostingClassifier if classifier else HistGradientBoostingRegressor
+        return estimator_class(**DISTILLED_HIST, random_state=random_state).fit(X, target)
+    if variant == 'distilled_linear':
+        if classifier:
+            return LogisticRegression(max_iter=1000).fit(X, target)
+        return Ridge(alpha=1.0).fit(X, target)
+    raise ValueError(f"Unknown variant '{variant}'")
+
+
+def model_size(model):
+    """Pickled size in bytes"""
+    return len(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def _median_seconds(fn, repeat):
+    fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def profile(name, model, X_test, y_test, repeat=50):
+    """
+    Size, single-row and 1000-row latency (as called by the engine), compiled
+    single-row latency (tree ensembles only) and test score of a model
+    """
+    if hasattr(model, 'n_jobs'):
+        model.n_jobs = 1
+    call = model.predict_proba if hasattr(model, 'predict_proba') else model.predict
+    compiled_ms = None
+    if isinstance(model, COMPILABLE):
+        compiled = compile_ensembles({name: model})
+        compiled_ms = round(_median_seconds(lambda: compiled.evaluate(X_test[:1]), repeat) * 1000, 4)
+    return {
+        'size_bytes': model_size(model),
+        'one_row_ms': round(_median_seconds(lambda: call(X_test[:1]), repeat) * 1000, 4),
+        'compiled_one_row_ms': compiled_ms,
+        'batch_ms': round(_median_seconds(lambda: call(X_test[:1000]), max(1, repeat // 10)) * 1000, 3),
+        'compilable': compiled_ms is not None,
+        **evaluate(name, model, X_test, y_test),
+    }
+
+
+def served_ms(stats):
+    """Single-row latency of the path that serves the model: compiled evaluator for tree ensembles, else sklearn"""
+    return stats['one_row_ms'] if stats['compiled_one_row_ms'] is None else stats['compiled_one_row_ms']
+
+
+def primary_score(name, stats):
+    return stats['accuracy'] if MODEL_SPECS[name][2] is RandomForestClassifier else stats['r2']
+
+
+def choose(name, full, variants, max_loss):
+    """Fastest served single-row variant within max_loss of the full model's score ('full' if none is)"""
+    baseline = primary_score(name, full)
+    within = [variant for variant, stats in variants.items() if baseline - primary_score(name, stats) <= max_loss]
+    return min(within, key=lambda variant: served_ms(variants[variant])) if within else 'full'
+
+
+def print_report(name, full, variants, chosen):
+    baseline = primary_score(name, full)
+    metric = 'accuracy' if MODEL_SPECS[name][2] is RandomForestClassifier else 'r2'
+    print(f"\n  {name:<22}{'Size':>10}{'1 row':>11}{'compiled':>11}{'1000 rows':>12}{metric:>10}{'delta':>9}")
+    for variant, stats in [('full', full)] + list(variants.items()):
+        marker = ' *' if variant == chosen else ''
+        compiled = '-' if stats['compiled_one_row_ms'] is None else f"{stats['compiled_one_row_ms']:.2f} ms"
+        print(f"    {variant:<20}{stats['size_bytes'] / 1024:>8.0f}KB{stats['one_row_ms']:>8.2f} ms{compiled:>11}"
+              f"{stats['batch_ms']:>9.1f} ms{primary_score(name, stats):>10.4f}"
+              f"{primary_score(name, stats) - baseline:>+9.4f}{marker}")
+
+
+def build_fast_tier(model_dir=MODEL_DIR, output_dir=None, data_path=DATA_PATH, variants=VARIANTS,
+                    max_loss=DEFAULT_MAX_LOSS, models=None, test_size=None, random_state=None):
+    """
+    Fit and profile the compact variants of each model (default: all six), write
+    the chosen ones as a complete model directory to output_dir and return its
+    metadata. Variants are fitted and scored on the training split recorded in
+    the metadata; test_size and random_state stand in for it on older models
+    (see train_pipeline.recorded_split).
+    """
+    output_dir = output_dir or os.path.join(model_dir, 'fast')
+    models = list(models or MODEL_SPECS)
+    metadata = joblib.load(os.path.join(model_dir, MODEL_FILES['metadata']))
+    test_size, random_state = recorded_split(metadata, models, test_size, random_state)
+
+    encoders = {name: joblib.load(os.path.join(model_dir, MODEL_FILES[name]))
+                for name in ('le_disaster', 'le_location', 'le_aid')}
+    print(f"Loading {data_path}...")
+    df, _ = load_training_frame(data_path, encoders)
+    train_idx, test_idx = train_test_split(np.arange(len(df)), test_size=test_size, random_state=random_state,
+                                           stratify=df['is_major_disaster'])
+
+    artifacts, report, scores = {}, {}, {}
+    for name in models:
+        feature_set, target = MODEL_SPECS[name][:2]
+        scaler = joblib.load(os.path.join(model_dir, MODEL_FILES[SCALERS[feature_set]]))
+        X = scaler.transform(df[FEATURE_SETS[feature_set]].to_numpy(dtype=np.float64))
+        y = df[target].to_numpy()
+        teacher = joblib.load(os.path.join(model_dir, MODEL_FILES[name]))
+
+        full = profile(name, teacher, X[test_idx], y[test_idx])
+        candidates, results = {}, {}
+        for variant in variants:
+            start = time.perf_counter()
+            candidates[variant] = build_variant(variant, name, teacher, X[train_idx], y[train_idx], random_state)
+            results[variant] = dict(profile(name, candidates[variant], X[test_idx], y[test_idx]),
+                                    fit_seconds=round(time.perf_counter() - start, 2))
+        chosen = choose(name, full, results, max_loss)
+        print_report(name, full, results, chosen)
+
+        artifacts[name] = teacher if chosen == 'full' else candidates[chosen]
+        stats = full if chosen == 'full' else results[chosen]
+        scores[name] = {key: stats[key] for key in ('accuracy', 'r2', 'mae') if key in stats}
+        report[name] = {'chosen': chosen, 'full': full, 'variants': results}
+
+    # Models not rebuilt are served by the full model
+    for name in set(MODEL_SPECS) - set(models):
+        artifacts[name] = joblib.load(os.path.join(model_dir, MODEL_FILES[name]))
+
+    fast_metadata = {key: value for key, value in metadata.items() if key != 'major_decision'}
+    fast_metadata.setdefault('model_scores', {}).update(scores)
+    if 'disaster_classifier' in scores:
+        fast_metadata['model_accuracy'] = scores['disaster_classifier']['accuracy']
+    if 'damage_regressor' in scores:
+        fast_metadata['damage_r2_score'] = scores['damage_regressor']['r2']
+    if 'response_regressor' in scores:
+        fast_metadata['response_r2_score'] = scores['response_regressor']['r2']
+    fast_metadata.update({
+        'tier': 'fast',
+        'training_date': pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'source_training_date': metadata.get('training_date'),
+        'compact_models': {'max_loss': max_loss, 'models': report},
+    })
+    artifacts['metadata'] = fast_metadata
+
+    os.makedirs(output_dir, exist_ok=True)
+    for name in SHARED_ARTIFACTS:
+        path = os.path.join(model_dir, MODEL_FILES[name])
+        if os.path.exists(path):
+            shutil.copy2(path, os.path.join(output_dir, MODEL_FILES[name]))
+    write_artifacts(artifacts, output_dir)
+
+    # Compiled evaluator (tree models only) and parameter table, so the tier is served like the full models
+    compiled_path, table_path = (os.path.join(output_dir, name) for name in (COMPILED_FILE, PARAMETER_TABLE_FILE))
+    for path in (compiled_path, table_path):
+        if os.path.exists(path):
+            os.remove(path)
+    engine = DisasterInferenceEngine(output_dir, backend='sklearn')
+    if all(isinstance(artifacts[name], COMPILABLE) for name in MODEL_SPECS):
+        save_compiled(compile_cascade(engine.artifacts, CASCADE_STAGES), compiled_path)
+    save_parameter_table(build_parameter_table(engine, data_path), table_path)
+    return fast_metadata
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model-dir', default=MODEL_DIR, help="Directory of the full models")
+    parser.add_argument('--output', default=None, help="Fast tier directory (default: MODEL_DIR/fast)")
+    parser.add_argument('--data', default=DATA_PATH)
+    parser.add_argument('--variants', nargs='+', choices=VARIANTS, default=list(VARIANTS))
+    parser.add_argument('--max-loss', type=float, default=DEFAULT_MAX_LOSS,
+                        help="Largest accepted drop in test accuracy / R² against the full model")
+    parser.add_argument('--models', nargs='+', choices=list(MODEL_SPECS), default=None,
+                        help="Compact only these models; the others are copied (default: all six)")
+    parser.add_argument('--test-size', type=float, default=None,
+                        help="Test fraction of the training split, for models whose metadata does not record it")
+    parser.add_argument('--random-state', type=int, default=None,
+                        help="Seed of the training split, for models whose metadata does not record it")
+    args = parser.parse_args(argv)
+
+    output_dir = args.output or os.path.join(args.model_dir, 'fast')
+    try:
+        metadata = build_fast_tier(args.model_dir, output_dir, args.data, args.variants, args.max_loss, args.models,
+                                   args.test_size, args.random_state)
+    except ValueError as e:
+        print(f"✗ {e}")
+        raise SystemExit(1)
+    models = metadata['compact_models']['models']
+    print(f"\n✓ Fast tier written to {output_dir} (* = chosen): "
+          + ", ".join(f"{name}={report['chosen']}" for name, report in models.items()))
+    if os.path.exists(os.path.join(output_dir, COMPILED_FILE)):
+        print("   Compiled evaluator and parameter table built")
+    else:
+        print("   Parameter table built. Some chosen models are not tree ensembles, so the fast tier runs "
+              "through sklearn (pass --variants shallow pruned for a compilable tier)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,416 @@
+"""
+Drift Monitor
+Watches live /api/predict traffic without slowing it down. Requests hand their
+scenario and response to a bounded queue with put_nowait (when the queue is
+full the observation is dropped and counted, never waited for); one background
+thread takes them in batches and
+
+- adds the features of each scenario (disaster type, location, coordinates,
+  date fields, and severity, affected population and economic loss when the
+  request gives them instead of leaving them to the parameter models) to
+  exponentially decayed histograms and scores each against the training
+  distribution with the Population Stability Index (PSI: < 0.1 stable,
+  0.1-0.25 moderate, > 0.25 drifted);
+- optionally scores the same scenarios with a shadow model set (e.g. a freshly
+  retrained saved_models/ copy) and accumulates its deltas and decision
+  agreement against the live responses.
+
+The reference histograms (decile bins of the numeric features, frequencies of
+the categorical ones) are stored in model_metadata.pkl under 'reference_stats';
+train_pipeline.py writes them, and `python drift_monitor.py reference` adds
+them to models trained elsewhere (model.ipynb, train_params_quick.py).
+
+Usage:
+    python drift_monitor.py reference [training CSV] [--model-dir saved_models]
+    python drift_monitor.py check incidents.csv [--model-dir saved_models]
+
+check scores a CSV in the preprocessed dataset's layout against the reference.
+The API serves the live figures at GET /api/drift.
+"""
+
+import argparse
+import os
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import joblib
+import numpy as np
+
+from inference_engine import DATA_PATH, MODEL_DIR, MODEL_FILES, PREDICTED_PARAMETERS, format_prediction
+
+REFERENCE_FORMAT_VERSION = 1
+NUMERIC_FEATURES = ('latitude', 'longitude', 'day_of_year', 'severity_level', 'affected_population', 'economic_loss')
+CATEGORICAL_FEATURES = ('disaster_type', 'location', 'month', 'week')
+FEATURES = CATEGORICAL_FEATURES + NUMERIC_FEATURES
+# Compared between live and shadow responses: numeric deltas, then agreement
+SHADOW_OUTPUTS = ('severity_level', 'affected_population', 'economic_loss', 'major_probability',
+                  'predicted_damage_index', 'predicted_response_time_hours')
+SHADOW_DECISIONS = ('is_major_disaster', 'priority')
+
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_BATCH_SIZE = 256
+# Observations after which an observation's weight in the histograms has halved
+DEFAULT_HALF_LIFE = 10000
+# Fewer (decayed) observations than this report 'insufficient data'
+MIN_OBSERVATIONS = 200
+PSI_MODERATE = 0.1
+PSI_DRIFTED = 0.25
+# Floor for bin proportions, so empty bins keep PSI finite
+PSI_EPSILON = 1e-4
+MAX_DISAGREEMENTS = 20
+
+_STOP = object()
+
+
+def reference_stats(scenarios, data_path=None):
+    """
+    Reference histograms of a DataFrame with the FEATURES columns (e.g.
+    historical_scenarios of the training CSV)
+    """
+    features = {}
+    for name in NUMERIC_FEATURES:
+        values = scenarios[name].to_numpy(dtype=float)
+        edges = np.unique(np.quantile(values, np.linspace(0.1, 0.9, 9)))
+        counts = np.bincount(np.searchsorted(edges, values, side='right'), minlength=len(edges) + 1)
+        features[name] = {'kind': 'numeric', 'edges': edges.tolist(), 'expected': (counts / len(values)).tolist()}
+    for name in CATEGORICAL_FEATURES:
+        frequencies = scenarios[name].value_counts(normalize=True).sort_index()
+        features[name] = {
+            'kind': 'categorical',
+            'categories': [value.item() if hasattr(value, 'item') else value for value in frequencies.index],
+            # The last bin holds values never seen in training
+            'expected': frequencies.tolist() + [0.0],
+        }
+    return {
+        'format_version': REFERENCE_FORMAT_VERSION,
+        'computed_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'data_path': data_path,
+        'rows': len(scenarios),
+        'features': features,
+    }
+
+
+def psi(expected, actual):
+    """Population Stability Index of two proportion vectors"""
+    expected = np.maximum(np.asarray(expected, dtype=float), PSI_EPSILON)
+    actual = np.maximum(np.asarray(actual, dtype=float), PSI_EPSILON)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+def drift_status(score, observations):
+    if observations < MIN_OBSERVATIONS:
+        return 'insufficient data'
+    return 'drifted' if score > PSI_DRIFTED else 'moderate' if score > PSI_MODERATE else 'stable'
+
+
+def _bin_labels(feature):
+    if feature['kind'] == 'categorical':
+        return [str(value) for value in feature['categories']] + ['other']
+    edges = feature['edges']
+    return ([f"<= {edges[0]:g}"] + ["(%g, %g]" % pair for pair in zip(edges, edges[1:])]
+            + [f"> {edges[-1]:g}"])
+
+
+class DriftMonitor:
+    """
+    Decayed live histograms per feature against a reference_stats dict, fed
+    through a bounded queue by observe() and, with a shadow engine, live vs
+    shadow prediction deltas
+    """
+
+    def __init__(self, engine, reference, shadow=None, max_queue=DEFAULT_QUEUE_SIZE, batch_size=DEFAULT_BATCH_SIZE,
+                 half_life=DEFAULT_HALF_LIFE):
+        self.engine = engine
+        self.reference = reference
+        self.shadow = shadow
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.half_life = half_life
+        self._decay = 0.5 ** (1 / half_life)
+        self._lookup = {
+            name: {value: code for code, value in enumerate(feature['categories'])}
+            for name, feature in reference['features'].items() if feature['kind'] == 'categorical'
+        }
+        self._counts = {name: np.zeros(len(feature['expected'])) for name, feature in reference['features'].items()}
+        self._weights = dict.fromkeys(self._counts, 0.0)
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.observed = 0
+        self.dropped = 0
+        self.failed = 0
+        self._shadow = {
+            'scored': 0,
+            'failed': 0,
+            'deltas': {name: {'sum': 0.0, 'abs_sum': 0.0, 'max_abs': 0.0} for name in SHADOW_OUTPUTS},
+            'agreements': dict.fromkeys(SHADOW_DECISIONS, 0),
+            'disagreements': deque(maxlen=MAX_DISAGREEMENTS),
+        }
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='drift-monitor', daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_env(cls, engine, shadow=None):
+        """
+        Monitor configured from DISASTER_DRIFT_QUEUE, DISASTER_DRIFT_BATCH and
+        DISASTER_DRIFT_HALF_LIFE; None when DISASTER_DRIFT=0 or the engine's
+        metadata has no reference statistics
+        """
+        reference = engine.metadata.get('reference_stats')
+        if os.environ.get('DISASTER_DRIFT', '1') == '0' or reference is None:
+            return None
+        return cls(
+            engine,
+            reference,
+            shadow,
+            max_queue=int(os.environ.get('DISASTER_DRIFT_QUEUE', DEFAULT_QUEUE_SIZE)),
+            batch_size=int(os.environ.get('DISASTER_DRIFT_BATCH', DEFAULT_BATCH_SIZE)),
+            half_life=float(os.environ.get('DISASTER_DRIFT_HALF_LIFE', DEFAULT_HALF_LIFE)),
+        )
+
+    def observe(self, data, result, now=None):
+        """
+        Queue a scored request (its scenario dict and /api/predict response)
+        without waiting; returns False when the queue was full and it was dropped
+        """
+        item = (data, result['input'], result['predictions'], result.get('emergency_response'),
+                now or datetime.now())
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+    def update(self, columns, observations=None):
+        """
+        Add observations given as {feature: sequence of values}; a feature may
+        have fewer values than there were observations (or be left out)
+        """
+        bins = {}
+        for name, values in columns.items():
+            feature = self.reference['features'][name]
+            if feature['kind'] == 'numeric':
+                bins[name] = np.searchsorted(feature['edges'], np.asarray(values, dtype=float), side='right')
+            else:
+                other = len(feature['categories'])
+                lookup = self._lookup[name]
+                bins[name] = np.fromiter((lookup.get(value, other) for value in values), dtype=np.int64,
+                                         count=len(values))
+        with self._lock:
+            for name, feature_bins in bins.items():
+                counts, n = self._counts[name], len(feature_bins)
+                decay = self._decay ** n
+                counts *= decay
+                counts += np.bincount(feature_bins, minlength=len(counts))
+                self._weights[name] = self._weights[name] * decay + n
+            self.observed += max(map(len, bins.values()), default=0) if observations is None else observations
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                break
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    self._queue.task_done()
+                    stop = True
+                    break
+                batch.append(item)
+            try:
+                self._process(batch)
+            except Exception:
+                with self._lock:
+                    self.failed += len(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _process(self, batch):
+        columns = {name: [] for name in FEATURES}
+        failed = 0
+        for data, _, _, _, now in batch:
+            try:
+                scenario = self.engine.parse_scenario(data, now)
+            except Exception:
+                failed += 1
+                continue
+            for name in FEATURES:
+                # Predicted parameters are compared with observed training values only when given
+                if name not in PREDICTED_PARAMETERS or data.get(name) is not None:
+                    columns[name].append(scenario[name])
+        self.update(columns, len(batch) - failed)
+        if failed:
+            with self._lock:
+                self.failed += failed
+        if self.shadow is not None:
+            self._score_shadow(batch)
+
+    def _score_shadow(self, batch):
+        parsed, rows, failed = [], [], 0
+        for item in batch:
+            try:
+                parsed.append(self.shadow.parse_scenario(item[0], item[4]))
+                rows.append(item)
+            except Exception:
+                failed += 1
+        records = self.shadow.predict_scenarios(parsed, batch[-1][4]) if parsed else []
+        results = [format_prediction(scenario, record) for scenario, record in zip(parsed, records)]
+
+        state = self._shadow
+        with self._lock:
+            state['failed'] += failed
+            for (_, live_input, live_predictions, live_response, _), result in zip(rows, results):
+                live = dict(live_input, **live_predictions, priority=(live_response or {}).get('priority'))
+                shadow = dict(result['input'], **result['predictions'],
+                              priority=result['emergency_response']['priority'])
+                for name in SHADOW_OUTPUTS:
+                    delta = shadow[name] - live[name]
+                    stats = state['deltas'][name]
+                    stats['sum'] += delta
+                    stats['abs_sum'] += abs(delta)
+                    stats['max_abs'] = max(stats['max_abs'], abs(delta))
+                differs = [name for name in SHADOW_DECISIONS if shadow[name] != live[name]]
+                for name in SHADOW_DECISIONS:
+                    state['agreements'][name] += name not in differs
+                if differs:
+                    state['disagreements'].append({
+                        'input': live_input,
+                        'live': {name: live[name] for name in SHADOW_DECISIONS + ('major_probability',)},
+                        'shadow': {name: shadow[name] for name in SHADOW_DECISIONS + ('major_probability',)},
+                    })
+                state['scored'] += 1
+
+    def flush(self):
+        """Block until every observation queued so far has been processed"""
+        self._queue.join()
+
+    def is_alive(self):
+        """False in a forked child process, where the worker thread does not exist"""
+        return self._thread.is_alive()
+
+    def close(self, timeout=5.0):
+        """Stop the worker after the observations already queued"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def feature_drift(self):
+        """{feature: {'psi', 'status', 'effective_observations', 'bins': {label: {'expected', 'actual'}}}}"""
+        with self._lock:
+            counts = {name: array.copy() for name, array in self._counts.items()}
+            weights = dict(self._weights)
+        report = {}
+        for name, feature in self.reference['features'].items():
+            weight = weights[name]
+            actual = counts[name] / weight if weight else np.zeros(len(counts[name]))
+            score = psi(feature['expected'], actual) if weight else 0.0
+            report[name] = {
+                'psi': round(score, 4),
+                'status': drift_status(score, weight),
+                'effective_observations': round(weight, 1),
+                'bins': {label: {'expected': round(expected, 4), 'actual': round(float(value), 4)}
+                         for label, expected, value in zip(_bin_labels(feature), feature['expected'], actual)},
+            }
+        return report
+
+    def shadow_report(self):
+        if self.shadow is None:
+            return None
+        with self._lock:
+            state = self._shadow
+            scored = state['scored']
+            return {
+                'model_dir': self.shadow.model_dir,
+                'training_date': self.shadow.metadata.get('training_date'),
+                'scored': scored,
+                'failed': state['failed'],
+                'deltas': {
+                    name: {
+                        'mean': round(stats['sum'] / scored, 4) if scored else None,
+                        'mean_abs': round(stats['abs_sum'] / scored, 4) if scored else None,
+                        'max_abs': round(stats['max_abs'], 4),
+                    } for name, stats in state['deltas'].items()
+                },
+                'agreement': {name: round(count / scored, 4) if scored else None
+                              for name, count in state['agreements'].items()},
+                'recent_disagreements': list(state['disagreements']),
+            }
+
+    def report(self):
+        features = self.feature_drift()
+        with self._lock:
+            stats = {
+                'observed': self.observed,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'queue_depth': self._queue.qsize(),
+                'max_queue': self.max_queue,
+                'half_life': self.half_life,
+            }
+        drifted = sorted((name for name, feature in features.items() if feature['status'] == 'drifted'),
+                         key=lambda name: -features[name]['psi'])
+        return {
+            'reference': {key: self.reference.get(key) for key in ('computed_at', 'data_path', 'rows')},
+            'monitor': stats,
+            'drifted_features': drifted,
+            'features': features,
+            'shadow': self.shadow_report(),
+        }
+
+
+def save_reference(model_dir, reference):
+    """Store reference in model_metadata.pkl, replacing the file atomically"""
+    path = os.path.join(model_dir, MODEL_FILES['metadata'])
+    metadata = joblib.load(path)
+    metadata['reference_stats'] = reference
+    tmp_path = path + '.tmp'
+    joblib.dump(metadata, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def main(argv=None):
+    from inference_engine import historical_scenarios
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['reference', 'check'])
+    parser.add_argument('data', nargs='?', default=DATA_PATH,
+                        help="Training CSV (reference) or CSV to compare with it (check)")
+    parser.add_argument('--model-dir', default=MODEL_DIR)
+    args = parser.parse_args(argv)
+
+    if args.command == 'reference':
+        reference = reference_stats(historical_scenarios(args.data), args.data)
+        save_reference(args.model_dir, reference)
+        print(f"✓ Reference statistics of {reference['rows']:,} events from {args.data} saved to "
+              f"{os.path.join(args.model_dir, MODEL_FILES['metadata'])}")
+        return
+
+    metadata = joblib.load(os.path.join(args.model_dir, MODEL_FILES['metadata']))
+    if 'reference_stats' not in metadata:
+        raise SystemExit(f"✗ No reference statistics in {args.model_dir}; run `python drift_monitor.py reference`")
+    scenarios = historical_scenarios(args.data)
+    # Every row weighs the same here, whatever the file's length
+    monitor = DriftMonitor(None, metadata['reference_stats'], half_life=float('inf'))
+    monitor.update({name: scenarios[name].tolist() for name in FEATURES})
+    monitor.close()
+    print(f"{len(scenarios):,} events of {args.data} against {metadata['reference_stats']['data_path']}:")
+    for name, feature in sorted(monitor.feature_drift().items(), key=lambda item: -item[1]['psi']):
+        mark = {'drifted': '✗', 'moderate': '⚠'}.get(feature['status'], '✓')
+        print(f"  {mark} {name:<22} PSI {feature['psi']:.4f}  {feature['status']}")
+
+
+if __name__ == '__main__':
+    main()
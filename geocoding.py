@@ -0,0 +1,313 @@
+"""
+Geocoding
+Fills missing latitude / longitude of event rows from their location text for
+data preprocessing. Location strings are normalized and deduplicated first, so
+every distinct place is resolved once, in this order:
+
+1. the on-disk cache (SQLite, reused across runs; places the backend could not
+   find are cached too);
+2. the local gazetteer: coordinates other rows of the sheet already have for
+   the same location, plus an optional name,latitude,longitude CSV (e.g. a
+   GeoNames cities export). A multi-place string such as "Jakarta, Bandung"
+   resolves to the centroid of its known parts;
+3. a pluggable backend for what is left, queried by at most `concurrency`
+   threads. NominatimBackend (needs geopy) also keeps to one request per
+   second; StubBackend answers from a dict, for tests and offline runs.
+
+Failed backend calls (timeouts, service errors) are not cached and are retried
+on the next run. Without a backend, misses simply stay missing.
+
+Usage:
+    python geocoding.py fill events.csv --output events_geocoded.csv
+                             [--gazetteer places.csv] [--cache geocode_cache.sqlite] [--offline]
+    python geocoding.py lookup "Jakarta" "Kathmandu, Lalitpur" [--offline]
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+try:
+    from geopy.exc import GeocoderServiceError, GeocoderTimedOut
+    from geopy.geocoders import Nominatim
+except ImportError:  # only the cache, gazetteer and StubBackend are available
+    Nominatim = None
+
+GEOCODE_CACHE = os.environ.get('DISASTER_GEOCODE_CACHE', 'geocode_cache.sqlite')
+DEFAULT_CONCURRENCY = 4
+PART_SEPARATORS = re.compile(r'[,;]|\band\b')
+
+
+def normalize(text):
+    """Cache / gazetteer key of a location string (None for blanks)"""
+    if text is None or (isinstance(text, float) and np.isnan(text)):
+        return None
+    key = ' '.join(str(text).replace('(', ' ').replace(')', ' ').split()).casefold()
+    return key or None
+
+
+class GeocodeCache:
+    """SQLite table of normalized location -> (latitude, longitude), NULL coordinates for places not found"""
+
+    def __init__(self, path=GEOCODE_CACHE):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS geocode (query TEXT PRIMARY KEY, latitude REAL, longitude REAL, "
+            "source TEXT NOT NULL, updated_at TEXT NOT NULL)")
+
+    def get_many(self, keys):
+        """{key: (latitude, longitude) or None} of the cached keys among keys"""
+        found = {}
+        keys = list(keys)
+        # SQLite limits the number of bound parameters per statement
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self.connection.execute(
+                f"SELECT query, latitude, longitude FROM geocode WHERE query IN ({','.join('?' * len(chunk))})",
+                chunk)
+            for key, latitude, longitude in rows:
+                found[key] = None if latitude is None else (latitude, longitude)
+        return found
+
+    def put_many(self, results, source):
+        """Store {key: (latitude, longitude) or None}"""
+        updated_at = time.strftime('%Y-%m-%d %H:%M:%S')
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?, ?)",
+                [(key, *(value if value else (None, None)), source, updated_at) for key, value in results.items()])
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM geocode").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+
+class Gazetteer:
+    """Local table of normalized place name -> (latitude, longitude)"""
+
+    def __init__(self, places=None):
+        self.places = dict(places or {})
+
+    @classmethod
+    def from_frame(cls, df, location='location', latitude='latitude', longitude='longitude'):
+        """Median coordinates of the rows that have them, per location"""
+        known = df[[location, latitude, longitude]].dropna()
+        known = known.assign(key=known[location].map(normalize)).dropna(subset=['key'])
+        medians = known.groupby('key')[[latitude, longitude]].median()
+        return cls(zip(medians.index, zip(medians[latitude].tolist(), medians[longitude].tolist())))
+
+    @classmethod
+    def from_csv(cls, path):
+        """name, latitude, longitude CSV (the first entry of a repeated name wins)"""
+        table = pd.read_csv(path, usecols=['name', 'latitude', 'longitude']).dropna()
+        gazetteer = cls()
+        for name, latitude, longitude in table.itertuples(index=False):
+            gazetteer.places.setdefault(normalize(name), (float(latitude), float(longitude)))
+        return gazetteer
+
+    def update(self, other):
+        """Add the places of another gazetteer that this one does not have"""
+        for key, value in other.places.items():
+            self.places.setdefault(key, value)
+        return self
+
+    def lookup(self, key):
+        """Coordinates of a normalized location, or the centroid of its known parts; None if unknown"""
+        if key in self.places:
+            return self.places[key]
+        parts = [self.places[part] for part in map(normalize, PART_SEPARATORS.split(key)) if part in self.places]
+        if not parts:
+            return None
+        latitude, longitude = np.mean(parts, axis=0)
+        return float(latitude), float(longitude)
+
+
+class NominatimBackend:
+    """OpenStreetMap Nominatim through geopy, at most one request per min_interval seconds"""
+
+    def __init__(self, user_agent='disaster_data_geocoder', timeout=10, min_interval=1.0):
+        if Nominatim is None:
+            raise ImportError("NominatimBackend needs the geopy package (pip install geopy)")
+        self.geolocator = Nominatim(user_agent=user_agent)
+        self.timeout = timeout
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next_call = 0.0
+
+    def geocode(self, query):
+        """(latitude, longitude) or None if not found; raises on timeouts and service errors"""
+        with self._lock:
+            delay = self._next_call - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._next_call = time.monotonic() + self.min_interval
+        try:
+            location = self.geolocator.geocode(query, timeout=self.timeout)
+        except (GeocoderTimedOut, GeocoderServiceError) as e:
+            raise RuntimeError(f"Nominatim failed for '{query}': {e}") from e
+        return (location.latitude, location.longitude) if location else None
+
+
+class StubBackend:
+    """Backend answering from a {location: (latitude, longitude)} dict; records its calls"""
+
+    def __init__(self, places=None, delay=0.0):
+        self.places = {normalize(name): value for name, value in (places or {}).items()}
+        self.delay = delay
+        self.calls = []
+        self.max_active = 0
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def geocode(self, query):
+        with self._lock:
+            self.calls.append(query)
+            self._active += 1
+            self.max_active = max(self.max_active, self._active)
+        try:
+            if self.delay:
+                time.sleep(self.delay)
+            return self.places.get(normalize(query))
+        finally:
+            with self._lock:
+                self._active -= 1
+
+
+class Geocoder:
+    """Cache -> gazetteer -> backend resolution of location strings"""
+
+    def __init__(self, cache_path=GEOCODE_CACHE, gazetteer=None, backend=None, concurrency=DEFAULT_CONCURRENCY,
+                 retry_misses=False):
+        self.cache = GeocodeCache(cache_path)
+        self.gazetteer = gazetteer or Gazetteer()
+        self.backend = backend
+        self.concurrency = max(1, concurrency)
+        self.retry_misses = retry_misses
+
+    def resolve(self, locations):
+        """
+        ({normalized location: (latitude, longitude) or None}, counts per
+        source) for the distinct non-blank strings among locations
+        """
+        keys = {key for key in map(normalize, locations) if key is not None}
+        counts = {'locations': len(keys), 'cache': 0, 'gazetteer': 0, 'backend': 0, 'unresolved': 0, 'failed': 0}
+
+        results = self.cache.get_many(keys)
+        if self.retry_misses:
+            results = {key: value for key, value in results.items() if value is not None}
+        counts['cache'] = sum(value is not None for value in results.values())
+
+        pending = [key for key in sorted(keys) if key not in results]
+        local = {key: self.gazetteer.lookup(key) for key in pending}
+        local = {key: value for key, value in local.items() if value is not None}
+        self.cache.put_many(local, 'gazetteer')
+        results.update(local)
+        counts['gazetteer'] = len(local)
+
+        pending = [key for key in pending if key not in local]
+        if pending and self.backend is not None:
+            found, failed = self._query_backend(pending)
+            self.cache.put_many(found, 'backend')
+            results.update(found)
+            counts['backend'] = sum(value is not None for value in found.values())
+            counts['failed'] = len(failed)
+        counts['unresolved'] = sum(results.get(key) is None for key in keys)
+        return results, counts
+
+    def _query_backend(self, keys):
+        def call(key):
+            try:
+                return key, self.backend.geocode(key), None
+            except Exception as e:
+                return key, None, e
+
+        found, failed = {}, {}
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for key, value, error in executor.map(call, keys):
+                if error is None:
+                    found[key] = value
+                else:
+                    failed[key] = error
+        return found, failed
+
+    def fill(self, df, location='location', latitude='latitude', longitude='longitude'):
+        """Fill the missing coordinates of df in place; returns the resolve() counts"""
+        missing = df[latitude].isna() | df[longitude].isna()
+        keys = df.loc[missing, location].map(normalize)
+        results, counts = self.resolve(keys.dropna().unique())
+        coordinates = keys.map(lambda key: results.get(key)).dropna()
+        if len(coordinates):
+            df.loc[coordinates.index, latitude] = [value[0] for value in coordinates]
+            df.loc[coordinates.index, longitude] = [value[1] for value in coordinates]
+        counts['rows_filled'] = len(coordinates)
+        counts['rows_missing'] = int(missing.sum()) - len(coordinates)
+        return counts
+
+    def close(self):
+        self.cache.close()
+
+
+def _read_table(path):
+    return pd.read_excel(path) if path.endswith(('.xlsx', '.xls')) else pd.read_csv(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['fill', 'lookup'])
+    parser.add_argument('inputs', nargs='+', help="Input CSV / Excel file (fill) or location strings (lookup)")
+    parser.add_argument('--output', default=None, help="CSV to write (fill)")
+    parser.add_argument('--cache', default=GEOCODE_CACHE)
+    parser.add_argument('--gazetteer', action='append', default=[], help="name,latitude,longitude CSV")
+    parser.add_argument('--location-column', default='location')
+    parser.add_argument('--offline', action='store_true', help="Use only the cache and gazetteer")
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help="Parallel backend requests (Nominatim allows one per second anyway)")
+    parser.add_argument('--retry-misses', action='store_true', help="Query the backend again for cached misses")
+    args = parser.parse_args(argv)
+
+    gazetteer = Gazetteer()
+    for path in args.gazetteer:
+        gazetteer.update(Gazetteer.from_csv(path))
+    backend = None if args.offline else NominatimBackend()
+    start = time.perf_counter()
+
+    if args.command == 'lookup':
+        geocoder = Geocoder(args.cache, gazetteer, backend, args.concurrency, args.retry_misses)
+        results, _ = geocoder.resolve(args.inputs)
+        for text in args.inputs:
+            value = results.get(normalize(text))
+            print(f"{text}: {'not found' if value is None else f'{value[0]:.4f}, {value[1]:.4f}'}")
+        geocoder.close()
+        return
+
+    if not args.output or len(args.inputs) != 1:
+        parser.error("fill takes one input file and --output")
+    df = _read_table(args.inputs[0])
+    gazetteer.update(Gazetteer.from_frame(df, args.location_column))
+    geocoder = Geocoder(args.cache, gazetteer, backend, args.concurrency, args.retry_misses)
+    counts = geocoder.fill(df, args.location_column)
+    geocoder.close()
+    tmp_path = args.output + '.tmp'
+    df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, args.output)
+    print(f"✓ {counts['rows_filled']:,} rows filled from {counts['locations']:,} distinct locations "
+          f"(cache {counts['cache']}, gazetteer {counts['gazetteer']}, backend {counts['backend']}) "
+          f"in {time.perf_counter() - start:.1f} s")
+    if counts['rows_missing']:
+        print(f"⚠ {counts['rows_missing']:,} rows still without coordinates "
+              f"({counts['unresolved']} locations unresolved, {counts['failed']} backend failures)")
+    print(f"   Written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,990 @@
+"""
+Disaster Inference Engine
+Holds the trained models and preprocessors and runs the full prediction cascade
+(parameters -> major disaster -> damage -> response time -> emergency response)
+for single scenarios, batches and streams, without going through HTTP
+"""
+
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from calibration import calibrate
+from category_encoder import DISASTER_ALIASES, LOCATION_ALIASES, CategoryEncoder
+from model_bundle import is_bundle, load_bundle
+from model_store import ModelStore
+from parameter_table import ParameterTable
+from spatial_index import EventIndex
+from tree_compiler import load_compiled
+
+MODEL_DIR = os.environ.get('DISASTER_MODEL_DIR', 'saved_models')
+DATA_PATH = 'Preprocessed data ENVISION ROUND 1.csv'
+
+# Columns of the per-row work matrix. Raw scenario inputs come first, followed by
+# values derived or predicted along the cascade. Every model input is a column
+# selection of this matrix, so stage inputs are filled with np.take into
+# preallocated buffers instead of being rebuilt from Python lists.
+SCENARIO_COLUMNS = [
+    'disaster_encoded', 'location_encoded', 'latitude', 'longitude',
+    'month', 'week', 'day_of_year',
+    'severity_level', 'affected_population', 'economic_loss',
+]
+WORK_COLUMNS = SCENARIO_COLUMNS + [
+    'quarter', 'is_summer', 'is_winter', 'damage_prior', 'predicted_damage',
+]
+_COL = {name: i for i, name in enumerate(WORK_COLUMNS)}
+
+PARAMETER_FEATURES = [
+    'disaster_encoded', 'location_encoded', 'latitude', 'longitude',
+    'month', 'week', 'quarter', 'is_summer', 'is_winter',
+]
+DISASTER_FEATURES = [
+    'disaster_encoded', 'location_encoded', 'latitude', 'longitude',
+    'severity_level', 'affected_population', 'damage_prior',
+    'month', 'quarter', 'day_of_year',
+]
+DAMAGE_FEATURES = [
+    'disaster_encoded', 'location_encoded', 'latitude', 'longitude',
+    'severity_level', 'affected_population', 'economic_loss',
+    'month', 'quarter',
+]
+RESPONSE_FEATURES = [
+    'disaster_encoded', 'location_encoded', 'latitude', 'longitude',
+    'severity_level', 'affected_population', 'predicted_damage', 'economic_loss',
+]
+# The classifier and the damage regressor both depend only on the parameter
+# stage, so they share one input: disaster features followed by damage features
+ASSESSMENT_FEATURES = DISASTER_FEATURES + DAMAGE_FEATURES
+
+# Models evaluated together per stage as (model, column offset of its features
+# inside the stage input, scaler applied to those features)
+CASCADE_STAGES = {
+    'parameters': [
+        ('severity_model', 0, 'scaler_parameters'),
+        ('population_model', 0, 'scaler_parameters'),
+        ('economic_loss_model', 0, 'scaler_parameters'),
+    ],
+    'assessment': [
+        ('disaster_classifier', 0, 'scaler_disaster'),
+        ('damage_regressor', len(DISASTER_FEATURES), 'scaler_damage'),
+    ],
+    'response': [
+        ('response_regressor', 0, 'scaler_response'),
+    ],
+}
+# Feature columns of each CASCADE_STAGES entry, in the same order
+STAGE_MODEL_FEATURES = {
+    'parameters': [PARAMETER_FEATURES] * 3,
+    'assessment': [DISASTER_FEATURES, DAMAGE_FEATURES],
+    'response': [RESPONSE_FEATURES],
+}
+
+# Largest batch scored with the compiled evaluator when the sklearn models are
+# also available. Its level-by-level traversal wins by far on small batches,
+# where sklearn's per-tree Python overhead dominates; sklearn's C traversal is
+# faster on large ones.
+COMPILED_MAX_BATCH = 256
+
+# Scenario fields the parameter stage predicts when its models are available
+PREDICTED_PARAMETERS = ('severity_level', 'affected_population', 'economic_loss')
+
+# Values used when a scenario leaves an optional field out
+SCENARIO_DEFAULTS = {
+    'week': 1,
+    'severity_level': 5,
+    'affected_population': 10000,
+    'economic_loss': 1000000,
+}
+# Valid values of the numeric scenario fields: (type, lowest, highest or None)
+SCENARIO_RANGES = {
+    'month': (int, 1, 12),
+    'week': (int, 1, 4),
+    'day_of_year': (int, 1, 366),
+    'latitude': (float, -90, 90),
+    'longitude': (float, -180, 180),
+    'severity_level': (int, 1, 10),
+    'affected_population': (int, 0, None),
+    'economic_loss': (float, 0, None),
+}
+
+# Damage index fed to the major disaster classifier, which was trained with the
+# observed infrastructure damage that is not known at prediction time
+DAMAGE_PRIOR = 0.5
+
+# Rule tables for the emergency response block, indexed by the tier that
+# np.select picks for each scenario (most severe tier first)
+PRIORITY_TIERS = [
+    ("CRITICAL", 5, "LEVEL 5 - MAXIMUM ALERT"),
+    ("HIGH", 4, "LEVEL 4 - HIGH ALERT"),
+    ("MEDIUM", 3, "LEVEL 3 - MODERATE ALERT"),
+    ("LOW", 2, "LEVEL 2 - LOW ALERT"),
+]
+RESOURCE_TIERS = [
+    ("500+ emergency responders", "20+ teams", "30+ units"),
+    ("200-500 emergency responders", "10-20 teams", "15-30 units"),
+    ("100-200 emergency responders", "5-10 teams", "10-15 units"),
+]
+SHELTER_TIERS = [
+    (0.6, "Heavy equipment: Bulldozers, cranes, excavators (HIGH PRIORITY)"),
+    (0.4, "Heavy equipment: Moderate deployment required"),
+    (0.2, "Heavy equipment: Standard deployment"),
+]
+_SHELTER_FACTORS = np.array([factor for factor, _ in SHELTER_TIERS])
+# Action items every response ends with, after the two timed ones
+STANDARD_ACTION_ITEMS = (
+    "Establish communication networks and evacuation routes",
+    "Coordinate with local hospitals and emergency services",
+    "Set up relief distribution centers",
+)
+
+# Structured output of predict_many, one record per scenario
+PREDICTION_DTYPE = np.dtype([
+    ('severity_level', 'i4'),
+    ('affected_population', 'i8'),
+    ('economic_loss', 'f8'),
+    ('is_major_disaster', '?'),
+    ('major_probability', 'f8'),
+    ('predicted_damage_index', 'f8'),
+    ('predicted_response_time_hours', 'f8'),
+    ('priority_tier', 'i1'),
+    ('resource_tier', 'i1'),
+    ('shelter_tier', 'i1'),
+    ('temporary_shelters', 'i8'),
+    ('evacuation_recommended', '?'),
+    ('people_to_evacuate', 'i8'),
+])
+
+# Artifact file names in the model directory
+MODEL_FILES = {
+    'disaster_classifier': 'disaster_classifier.pkl',
+    'damage_regressor': 'damage_regressor.pkl',
+    'response_regressor': 'response_time_regressor.pkl',
+    'severity_model': 'severity_model.pkl',
+    'population_model': 'population_model.pkl',
+    'economic_loss_model': 'economic_loss_model.pkl',
+    'scaler_parameters': 'scaler_parameters.pkl',
+    'scaler_disaster': 'scaler_disaster.pkl',
+    'scaler_damage': 'scaler_damage.pkl',
+    'scaler_response': 'scaler_response.pkl',
+    'le_disaster': 'label_encoder_disaster.pkl',
+    'le_location': 'label_encoder_location.pkl',
+    'le_aid': 'label_encoder_aid.pkl',
+    'metadata': 'model_metadata.pkl',
+    'compiled_models': 'compiled_models.pkl',
+    'parameter_table': 'parameter_table.pkl',
+    'event_index': 'event_index.pkl',
+}
+COMPILED_FILE = MODEL_FILES['compiled_models']
+PARAMETER_TABLE_FILE = MODEL_FILES['parameter_table']
+PARAMETER_ARTIFACTS = ('severity_model', 'population_model', 'economic_loss_model', 'scaler_parameters')
+OPTIONAL_ARTIFACTS = PARAMETER_ARTIFACTS + ('compiled_models', 'parameter_table', 'event_index')
+
+
+def load_artifacts(model_dir=MODEL_DIR, mmap_mode=None, lazy=True):
+    """
+    Open the artifacts in model_dir as a ModelStore.
+    Fails immediately if a required file is missing. The parameter prediction
+    models are optional; without them the cascade uses the severity, population
+    and economic loss given in each scenario. With lazy=True each model is only
+    deserialized when first used (see DisasterInferenceEngine.warm_up).
+    """
+    print("Loading models...")
+    store = ModelStore(model_dir, MODEL_FILES, mmap_mode=mmap_mode)
+    missing = [MODEL_FILES[name] for name in MODEL_FILES
+               if name not in OPTIONAL_ARTIFACTS and name not in store]
+    if missing:
+        print(f"Error loading models: missing {', '.join(missing)} in {model_dir}")
+        raise FileNotFoundError(f"Missing model files in {model_dir}: {', '.join(missing)}")
+
+    if all(name in store for name in PARAMETER_ARTIFACTS):
+        print("✓ Parameter prediction models found")
+    else:
+        print("⚠ Parameter prediction models not found - will require manual input")
+
+    if not lazy:
+        for name in MODEL_FILES:
+            store.get(name)
+        print("✓ All models loaded successfully!")
+    return store
+
+
+def _scale_inplace(scaler, buffer):
+    """Apply a fitted StandardScaler to buffer in place (same arithmetic as transform)"""
+    if scaler.with_mean:
+        np.subtract(buffer, scaler.mean_, out=buffer)
+    if scaler.with_std:
+        np.divide(buffer, scaler.scale_, out=buffer)
+    return buffer
+
+
+class _Buffers:
+    """Per-thread feature buffers, grown on demand and reused across calls"""
+
+    def __init__(self):
+        self.capacity = 0
+
+    def ensure(self, n):
+        if n > self.capacity:
+            capacity = max(n, 2 * self.capacity, 1)
+            self.work = np.empty((capacity, len(WORK_COLUMNS)))
+            self.parameters = np.empty((capacity, len(PARAMETER_FEATURES)))
+            self.assessment = np.empty((capacity, len(ASSESSMENT_FEATURES)))
+            self.response = np.empty((capacity, len(RESPONSE_FEATURES)))
+            self.capacity = capacity
+        return self
+
+
+class DisasterInferenceEngine:
+    """
+    Prediction cascade over a loaded set of artifacts.
+
+    predict_one    - one scenario dict -> API response dict
+    predict_many   - DataFrame / ndarray / list of scenarios -> PREDICTION_DTYPE array
+    predict_stream - iterable of scenario dicts -> iterator of response dicts
+
+    backend selects how the tree ensembles are evaluated: 'sklearn' calls the
+    pickled models, 'compiled' uses the flat-array evaluator from tree_compiler
+    (compiled_models.pkl, identical outputs), 'auto' uses it when it is present
+    and was compiled from the current models. Batches larger than
+    compiled_max_batch still go to the sklearn models. model_dir may also name
+    a single-file bundle (model_bundle.py), which only holds compiled models.
+
+    cache, an optional prediction_cache.PredictionCache, lets predict_one and
+    predict_stream answer repeated scenarios without running the models.
+    parameter_table.pkl, when present and built from the current models,
+    answers the parameter stage for scenarios at a location's canonical
+    coordinates (see parameter_table.py). event_index.pkl (spatial_index.py)
+    fills in the location of scenarios that only give coordinates.
+
+    The major disaster decision comes from one classifier pass: the more
+    probable class, or, when model_metadata.pkl holds a 'major_decision' rule
+    (calibration.py), the calibrated probability compared with its threshold.
+
+    stage_observer, if set, is called as stage_observer(stage, seconds) for
+    each stage of a prediction: 'parse', 'parameters', 'assessment',
+    'response', 'rules' and 'format' (see metrics.Metrics.observe_stage;
+    batch_scheduler adds 'queue' and 'batch', app.py 'json' and 'serialize').
+    """
+
+    def __init__(self, model_dir=MODEL_DIR, artifacts=None, mmap_mode=None, lazy=True, backend='auto',
+                 compiled_max_batch=COMPILED_MAX_BATCH, cache=None, stage_observer=None):
+        self.model_dir = model_dir
+        if artifacts is None and is_bundle(model_dir):
+            artifacts = load_bundle(model_dir, mmap_mode=mmap_mode)
+        elif artifacts is None:
+            artifacts = load_artifacts(model_dir, mmap_mode=mmap_mode, lazy=lazy)
+        self.artifacts = artifacts
+        # Model bundles hold the compiled ensembles only, not the sklearn models
+        self.compiled_only = getattr(artifacts, 'compiled_only', False)
+        self.metadata = artifacts.get('metadata') or {}
+        self.warmup_seconds = None
+        self.cache = cache
+        self.stage_observer = stage_observer
+        self.decision = self._load_decision()
+        if cache is not None:
+            cache.validate(self.model_version)
+
+        if self.compiled_only:
+            self.has_parameter_models = 'parameters' in artifacts['compiled_models']['groups']
+        else:
+            self.has_parameter_models = all(name in artifacts for name in PARAMETER_ARTIFACTS)
+        self.compiled = self._load_compiled(backend)
+        self.backend = 'compiled' if self.compiled else 'sklearn'
+        self.compiled_max_batch = float('inf') if self.compiled_only else compiled_max_batch
+        if self.compiled:
+            self._compiled_classes = np.asarray(
+                self.compiled['assessment'].member('disaster_classifier')['classes']
+            )
+        self.disaster_encoder = CategoryEncoder.from_label_encoder(self.le_disaster, DISASTER_ALIASES, 'disaster_type')
+        self.location_encoder = CategoryEncoder.from_label_encoder(self.le_location, LOCATION_ALIASES, 'location')
+        self.parameter_table = self._load_parameter_table()
+        self._event_index = None
+
+        self._parameter_idx = np.array([_COL[c] for c in PARAMETER_FEATURES])
+        self._assessment_idx = np.array([_COL[c] for c in ASSESSMENT_FEATURES])
+        self._response_idx = np.array([_COL[c] for c in RESPONSE_FEATURES])
+        self._stage_scalers = {
+            stage: sorted({(scaler, offset, offset + len(features))
+                           for (_, offset, scaler), features in zip(entries, STAGE_MODEL_FEATURES[stage])},
+                          key=lambda entry: entry[1])
+            for stage, entries in CASCADE_STAGES.items()
+        }
+        self._local = threading.local()
+
+    @classmethod
+    def from_models(cls, **artifacts):
+        """Build an engine from in-memory objects (e.g. freshly trained in a notebook)"""
+        return cls(model_dir=None, artifacts={
+            name: obj for name, obj in artifacts.items() if obj is not None
+        })
+
+    def _load_compiled(self, backend):
+        """Return {stage: CompiledEnsemble} for the compiled backend, or None for sklearn"""
+        if backend not in ('auto', 'compiled', 'sklearn'):
+            raise ValueError(f"Unknown backend '{backend}'")
+        if backend == 'sklearn' and self.compiled_only:
+            raise ValueError("A model bundle only holds compiled models; use backend 'compiled' or 'auto'")
+        if backend == 'sklearn':
+            return None
+        if 'compiled_models' not in self.artifacts:
+            if backend == 'compiled':
+                raise FileNotFoundError(f"{COMPILED_FILE} not found; run `python tree_compiler.py compile`")
+            return None
+
+        compiled = self.artifacts['compiled_models']
+        problem = None
+        if compiled.get('training_date') != self.metadata.get('training_date'):
+            problem = (f"{COMPILED_FILE} was compiled from models trained {compiled.get('training_date')}, "
+                       f"current models were trained {self.metadata.get('training_date')}")
+        elif self.has_parameter_models and 'parameters' not in compiled['groups']:
+            problem = f"{COMPILED_FILE} has no parameter stage"
+        if problem:
+            if backend == 'compiled':
+                raise ValueError(problem)
+            print(f"⚠ {problem} - using sklearn models")
+            return None
+        return load_compiled(compiled)
+
+    def _load_decision(self):
+        """The calibration.py decision rule of the metadata if it matches the current models, else None"""
+        decision = self.metadata.get('major_decision')
+        if decision is not None and decision.get('training_date') != self.metadata.get('training_date'):
+            print(f"⚠ The major disaster decision rule was fitted to models trained {decision.get('training_date')}"
+                  f" - ignoring it")
+            return None
+        return decision
+
+    @property
+    def model_version(self):
+        """Training date, plus the fit time of the decision rule (prediction cache version)"""
+        if self.decision is None:
+            return self.metadata.get('training_date')
+        return f"{self.metadata.get('training_date')} / decision {self.decision['fitted_at']}"
+
+    def _load_parameter_table(self):
+        """Return the ParameterTable if it matches the current models and encoders, else None"""
+        if not self.has_parameter_models or 'parameter_table' not in self.artifacts:
+            return None
+        table = ParameterTable(self.artifacts['parameter_table'])
+        if table.training_date != self.metadata.get('training_date'):
+            print(f"⚠ {PARAMETER_TABLE_FILE} was built from models trained {table.training_date} - ignoring it")
+            return None
+        if (table.disaster_classes != list(self.le_disaster.classes_)
+                or table.location_classes != list(self.le_location.classes_)):
+            print(f"⚠ {PARAMETER_TABLE_FILE} does not match the label encoders - ignoring it")
+            return None
+        return table
+
+    @property
+    def event_index(self):
+        """EventIndex over the historical events, or None without event_index.pkl (loaded on first use)"""
+        if self._event_index is None and 'event_index' in self.artifacts:
+            self._event_index = EventIndex(self.artifacts['event_index'])
+        return self._event_index
+
+    def warm_up(self):
+        """
+        Run a synthetic scenario through every model of the cascade, so that lazy
+        loading and first-call overheads happen before the first real request.
+        Returns the time taken in seconds.
+        """
+        start = time.perf_counter()
+        self.predict_many(np.array([[0, 0, 0.0, 0.0, 1, 1, 1]]))
+        self.warmup_seconds = round(time.perf_counter() - start, 4)
+        return self.warmup_seconds
+
+    def mark_stage(self, stage, start):
+        """Report the time since start to stage_observer and return the current time"""
+        now = time.perf_counter()
+        if self.stage_observer is not None:
+            self.stage_observer(stage, now - start)
+        return now
+
+    def limit_model_threads(self, n_jobs):
+        """Set n_jobs of the cascade's forests, e.g. to 1 per process when several processes share the CPUs"""
+        for entries in CASCADE_STAGES.values():
+            for name, _, _ in entries:
+                model = self.artifacts.get(name)
+                if model is not None and hasattr(model, 'n_jobs'):
+                    model.n_jobs = n_jobs
+
+    def load_report(self):
+        """Per-artifact load time and memory report (empty for in-memory engines)"""
+        if isinstance(self.artifacts, ModelStore) or self.compiled_only:
+            return self.artifacts.load_report()
+        return []
+
+    def _buffers(self, n):
+        buffers = getattr(self._local, 'buffers', None)
+        if buffers is None:
+            buffers = self._local.buffers = _Buffers()
+        return buffers.ensure(n)
+
+    # ------------------------------------------------------------------
+    # Input handling
+    # ------------------------------------------------------------------
+
+    def encode(self, disaster_type, location):
+        """Encode categorical inputs (case-insensitive, aliases accepted; unknown values raise UnknownCategoryError)"""
+        return self.disaster_encoder.encode(disaster_type), self.location_encoder.encode(location)
+
+    def parse_scenario(self, data, now=None):
+        """
+        Validate one scenario dict and return its raw model inputs.
+        latitude / longitude may be left out for a known location when the
+        parameter table is available; the location's canonical coordinates
+        are used then ('canonical': True). A missing or unknown location is
+        inferred from the coordinates when the event index is available
+        ('location_inferred': True).
+        Raises ValueError/TypeError when a required field is missing or invalid.
+        """
+        if not isinstance(data, dict):
+            raise ValueError("Scenario must be a JSON object")
+        now = now or datetime.now()
+
+        disaster_encoded = self.disaster_encoder.encode(data.get('disaster_type'))
+        location_encoded = self.location_encoder.get(data.get('location'))
+
+        canonical = data.get('latitude') is None and data.get('longitude') is None
+        if canonical:
+            if self.parameter_table is None or location_encoded is None:
+                # Reports the unknown location, or the missing coordinates
+                self.location_encoder.encode(data.get('location'))
+                raise ValueError("latitude and longitude are required")
+            latitude, longitude = self.parameter_table.canonical_coordinates(location_encoded)
+        else:
+            latitude = float(data.get('latitude'))
+            longitude = float(data.get('longitude'))
+            if not (np.isfinite(latitude) and np.isfinite(longitude)):
+                raise ValueError("latitude and longitude must be finite numbers")
+            # Before the coordinates are used to infer the location
+            check_range('latitude', latitude)
+            check_range('longitude', longitude)
+
+        location_inferred = location_encoded is None
+        if location_inferred:
+            inferred = self.event_index.infer_location(latitude, longitude) if self.event_index else None
+            if inferred is None and data.get('location') is None:
+                raise ValueError("location is required" + (
+                    " (no historical event near the given coordinates)" if self.event_index else ""))
+            # Unknown and not inferable: report the given value
+            location_encoded = self.location_encoder.encode(inferred if inferred is not None else data.get('location'))
+
+        scenario = {
+            'disaster_type': self.disaster_encoder.classes[disaster_encoded],
+            'location': self.location_encoder.classes[location_encoded],
+            'disaster_encoded': disaster_encoded,
+            'location_encoded': location_encoded,
+            'latitude': latitude,
+            'longitude': longitude,
+            'month': int(data.get('month', now.month)),
+            'week': int(data.get('week', SCENARIO_DEFAULTS['week'])),
+            'day_of_year': float(data.get('day_of_year', now.timetuple().tm_yday)),
+            'severity_level': int(data.get('severity_level', SCENARIO_DEFAULTS['severity_level'])),
+            'affected_population': int(data.get('affected_population', SCENARIO_DEFAULTS['affected_population'])),
+            'economic_loss': float(data.get('economic_loss', SCENARIO_DEFAULTS['economic_loss'])),
+            'canonical': canonical,
+            'location_inferred': location_inferred,
+        }
+        for name in SCENARIO_RANGES:
+            check_range(name, scenario[name])
+        return scenario
+
+    def _fill_row(self, row, scenario):
+        """Write one parsed scenario into a work matrix row"""
+        for i in range(len(SCENARIO_COLUMNS)):
+            row[i] = scenario[SCENARIO_COLUMNS[i]]
+
+    def _fill_work(self, work, data, now=None):
+        """
+        Write a batch of scenarios into the first len(data) rows of work.
+        Accepts a DataFrame, a structured ndarray, a 2-D ndarray with columns in
+        SCENARIO_COLUMNS order (categoricals already encoded), or a list of
+        parsed scenario dicts.
+        """
+        if isinstance(data, np.ndarray) and data.dtype.names is None:
+            data = np.atleast_2d(np.asarray(data, dtype=float))
+            width = data.shape[1]
+            if width < 4 or width > len(SCENARIO_COLUMNS):
+                raise ValueError(
+                    f"Expected 4 to {len(SCENARIO_COLUMNS)} columns in SCENARIO_COLUMNS order, got {width}"
+                )
+            data = pd.DataFrame(data, columns=SCENARIO_COLUMNS[:width])
+        elif isinstance(data, np.ndarray):
+            data = pd.DataFrame(data)
+        elif isinstance(data, list):
+            for i, scenario in enumerate(data):
+                self._fill_row(work[i], scenario)
+            return
+
+        now = now or datetime.now()
+        defaults = dict(SCENARIO_DEFAULTS, month=now.month, day_of_year=now.timetuple().tm_yday)
+        n = len(data)
+
+        if 'disaster_encoded' in data:
+            work[:n, 0] = data['disaster_encoded']
+        else:
+            work[:n, 0] = self.disaster_encoder.encode_many(data['disaster_type'])
+        if 'location_encoded' in data:
+            work[:n, 1] = data['location_encoded']
+        else:
+            work[:n, 1] = self.location_encoder.encode_many(data['location'])
+
+        for i in range(2, len(SCENARIO_COLUMNS)):
+            name = SCENARIO_COLUMNS[i]
+            if name in data:
+                work[:n, i] = data[name]
+            elif name in defaults:
+                work[:n, i] = defaults[name]
+            else:
+                raise ValueError(f"Missing required column '{name}'")
+
+    # ------------------------------------------------------------------
+    # Cascade
+    # ------------------------------------------------------------------
+
+    def _use_compiled(self, n):
+        return self.compiled is not None and n <= self.compiled_max_batch
+
+    def _compiled_stage(self, stage, features):
+        """
+        Evaluate a compiled stage on raw features (modified in place). Groups
+        compiled without folded scalers need the scaled input.
+        """
+        group = self.compiled[stage]
+        if not group.folded_scalers:
+            self.scale_stage_input(stage, features, copy=False)
+        return group.evaluate(features)
+
+    def scale_stage_input(self, stage, features, copy=True):
+        """Apply the stage's StandardScalers to its raw input (same arithmetic as transform)"""
+        if copy:
+            features = features.copy()
+        for scaler_name, start, stop in self._stage_scalers[stage]:
+            _scale_inplace(self.artifacts[scaler_name], features[:, start:stop])
+        return features
+
+    def _predict_parameters(self, features):
+        """Severity, affected population and economic loss predictions from raw parameter features"""
+        if self._use_compiled(len(features)):
+            outputs = self._compiled_stage('parameters', features)
+            return outputs['severity_model'], outputs['population_model'], outputs['economic_loss_model']
+        self.scale_stage_input('parameters', features, copy=False)
+        return (self.severity_model.predict(features),
+                self.population_model.predict(features),
+                self.economic_loss_model.predict(features))
+
+    def _major_classes(self):
+        if self.compiled:
+            return self._compiled_classes
+        return self.disaster_classifier.classes_
+
+    def _predict_assessment(self, features):
+        """Major disaster class probabilities and damage index from raw assessment features"""
+        if self._use_compiled(len(features)):
+            outputs = self._compiled_stage('assessment', features)
+            return outputs['disaster_classifier'], outputs['damage_regressor']
+        self.scale_stage_input('assessment', features, copy=False)
+        # A single forest pass gives both the label and the probability
+        return (self.disaster_classifier.predict_proba(features[:, :len(DISASTER_FEATURES)]),
+                self.damage_regressor.predict(features[:, len(DISASTER_FEATURES):]))
+
+    def _predict_response(self, features):
+        """Response time predictions from raw response features"""
+        if self._use_compiled(len(features)):
+            return self._compiled_stage('response', features)['response_regressor']
+        self.scale_stage_input('response', features, copy=False)
+        return self.response_regressor.predict(features)
+
+    def _run_cascade(self, buffers, n, capture=None, parameters=None, known=None, keep=()):
+        """
+        Run every stage over the first n rows of the work matrix.
+        If capture is a dict, a copy of each stage's raw (unscaled) input is stored in it.
+        parameters, if given, are already known (severity, population, economic loss)
+        arrays that replace the parameter stage, for the rows where the boolean
+        mask known is set (all rows when known is None).
+        keep names PREDICTED_PARAMETERS whose values in the work matrix are used
+        instead of the parameter stage's predictions.
+        """
+        start = time.perf_counter()
+        work = buffers.work[:n]
+        month = work[:, _COL['month']]
+        work[:, _COL['quarter']] = (month - 1) // 3 + 1
+        work[:, _COL['is_summer']] = (month >= 6) & (month <= 8)
+        work[:, _COL['is_winter']] = (month == 12) | (month <= 2)
+        work[:, _COL['damage_prior']] = DAMAGE_PRIOR
+
+        out = np.empty(n, dtype=PREDICTION_DTYPE)
+
+        # Predict missing parameters if models are available
+        if self.has_parameter_models and (parameters is None or known is not None):
+            features = np.take(work, self._parameter_idx, axis=1, out=buffers.parameters[:n])
+            if capture is not None:
+                capture['parameters'] = features.copy()
+            rows = slice(None) if parameters is None else ~known
+            severity, population, loss = self._predict_parameters(features[rows])
+            start = self.mark_stage('parameters', start)
+            predicted = np.clip(np.trunc(severity), 1, 10), np.maximum(np.trunc(population), 0), np.maximum(loss, 0)
+            if parameters is None:
+                parameters = predicted
+            else:
+                for column, values in zip(parameters, predicted):
+                    column[rows] = values
+            for name in keep:
+                parameters[PREDICTED_PARAMETERS.index(name)][:] = work[:, _COL[name]]
+        if parameters is not None:
+            out['severity_level'], out['affected_population'], out['economic_loss'] = parameters
+            work[:, _COL['severity_level']] = out['severity_level']
+            work[:, _COL['affected_population']] = out['affected_population']
+            work[:, _COL['economic_loss']] = out['economic_loss']
+        else:
+            out['severity_level'] = work[:, _COL['severity_level']]
+            out['affected_population'] = work[:, _COL['affected_population']]
+            out['economic_loss'] = work[:, _COL['economic_loss']]
+
+        # Major disaster prediction and damage assessment
+        features = np.take(work, self._assessment_idx, axis=1, out=buffers.assessment[:n])
+        if capture is not None:
+            capture['assessment'] = features.copy()
+        proba, damage = self._predict_assessment(features)
+        start = self.mark_stage('assessment', start)
+        probability = proba[:, 1]
+        if self.decision is None:
+            out['is_major_disaster'] = self._major_classes()[proba.argmax(axis=1)]
+        else:
+            probability = calibrate(probability, self.decision['calibration'])
+            out['is_major_disaster'] = probability >= self.decision['threshold']
+        out['major_probability'] = probability
+        out['predicted_damage_index'] = damage
+        work[:, _COL['predicted_damage']] = damage
+
+        # Response time prediction
+        features = np.take(work, self._response_idx, axis=1, out=buffers.response[:n])
+        if capture is not None:
+            capture['response'] = features.copy()
+        out['predicted_response_time_hours'] = self._predict_response(features)
+        start = self.mark_stage('response', start)
+
+        apply_response_rules(out)
+        self.mark_stage('rules', start)
+        return out
+
+    def predict_many(self, data, now=None, keep=()):
+        """
+        Run the cascade over a batch of scenarios and return a PREDICTION_DTYPE array.
+        keep names PREDICTED_PARAMETERS taken from the scenarios as given rather
+        than predicted by the parameter stage (e.g. to vary severity_level).
+        """
+        n = len(data)
+        if n == 0:
+            return np.empty(0, dtype=PREDICTION_DTYPE)
+        buffers = self._buffers(n)
+        self._fill_work(buffers.work, data, now)
+        return self._run_cascade(buffers, n, keep=keep)
+
+    def stage_inputs(self, data, now=None):
+        """Raw (unscaled) model inputs of every stage for a batch of scenarios: {stage: 2-D array}"""
+        buffers = self._buffers(len(data))
+        self._fill_work(buffers.work, data, now)
+        capture = {}
+        self._run_cascade(buffers, len(data), capture)
+        return capture
+
+    def _cache_keys(self, scenario):
+        """(parameter stage key, cascade key, latitude, longitude) of a parsed scenario for the cache"""
+        disaster, location = scenario['disaster_encoded'], scenario['location_encoded']
+        if scenario.get('canonical'):
+            latitude, longitude = scenario['latitude'], scenario['longitude']
+        else:
+            latitude, longitude = self.cache.canonical_coordinates(scenario['latitude'], scenario['longitude'])
+        parameter_key = (disaster, location, latitude, longitude, scenario['month'], scenario['week'])
+        cascade_key = parameter_key + (scenario['day_of_year'],)
+        if not self.has_parameter_models:
+            # Without the parameter models the given values are model inputs
+            cascade_key += (scenario['severity_level'], scenario['affected_population'], scenario['economic_loss'])
+        return parameter_key, cascade_key, latitude, longitude
+
+    def _table_parameters(self, scenario):
+        """Parameter table entry for a scenario at its location's canonical coordinates, or None"""
+        if self.parameter_table is None or not scenario.get('canonical'):
+            return None
+        return self.parameter_table.lookup(scenario['disaster_encoded'], scenario['location_encoded'],
+                                           scenario['month'], scenario['week'])
+
+    def predict_scenarios(self, scenarios, now=None):
+        """
+        predict_many for a list of parsed scenarios, answered from the prediction
+        cache and the parameter table where possible. Only cache misses go
+        through the models (at their canonical, rounded coordinates when the
+        cache is on), and the parameter stage only runs for misses that neither
+        the parameter table nor the parameter cache can answer.
+        """
+        cache = self.cache
+        if (cache is None and self.parameter_table is None) or not scenarios:
+            return self.predict_many(scenarios, now)
+
+        out = np.empty(len(scenarios), dtype=PREDICTION_DTYPE)
+        if cache is not None:
+            cache.validate(self.model_version)
+            keys = [self._cache_keys(scenario) for scenario in scenarios]
+            missing = []
+            for i, (_, cascade_key, _, _) in enumerate(keys):
+                record = cache.cascade.get(cascade_key)
+                if record is None:
+                    missing.append(i)
+                else:
+                    out[i] = record
+            if not missing:
+                return out
+        else:
+            missing = range(len(scenarios))
+
+        n = len(missing)
+        buffers = self._buffers(n)
+        parameters = (np.empty(n), np.empty(n), np.empty(n))
+        known = np.zeros(n, dtype=bool)
+        for row, i in enumerate(missing):
+            scenario = scenarios[i]
+            self._fill_row(buffers.work[row], scenario)
+            if cache is not None:
+                buffers.work[row, _COL['latitude']], buffers.work[row, _COL['longitude']] = keys[i][2:]
+            if self.has_parameter_models:
+                value = self._table_parameters(scenario)
+                if value is None and cache is not None:
+                    value = cache.parameters.get(keys[i][0])
+                if value is not None:
+                    known[row] = True
+                    for column, item in zip(parameters, value):
+                        column[row] = item
+
+        if known.all():
+            records = self._run_cascade(buffers, n, parameters=parameters)
+        elif known.any():
+            records = self._run_cascade(buffers, n, parameters=parameters, known=known)
+        else:
+            records = self._run_cascade(buffers, n)
+        if cache is None:
+            return records
+
+        for row, i in enumerate(missing):
+            record = records[row].copy()
+            out[i] = record
+            cache.cascade.put(keys[i][1], record)
+            if not known[row] and self.has_parameter_models:
+                cache.parameters.put(keys[i][0], (
+                    record['severity_level'], record['affected_population'], record['economic_loss']
+                ))
+        return out
+
+    def predict_one(self, data, now=None):
+        """Run the cascade for one scenario dict and return the API response dict"""
+        start = time.perf_counter()
+        scenario = self.parse_scenario(data, now)
+        self.mark_stage('parse', start)
+        record = self.predict_scenarios([scenario], now)[0]
+        start = time.perf_counter()
+        result = format_prediction(scenario, record)
+        self.mark_stage('format', start)
+        return result
+
+    def predict_stream(self, scenarios, batch_size=256):
+        """
+        Score an iterable of scenario dicts in batches of batch_size and yield
+        one response dict per scenario, in input order. A scenario that fails
+        validation yields {'success': False, 'error': ...} without affecting
+        the rest of its batch.
+        """
+        now = datetime.now()
+        pending = []
+
+        def flush():
+            valid = [scenario for scenario in pending if not isinstance(scenario, Exception)]
+            records = iter(self.predict_scenarios(valid, now))
+            for scenario in pending:
+                if isinstance(scenario, Exception):
+                    yield {'success': False, 'error': str(scenario)}
+                else:
+                    yield format_prediction(scenario, next(records))
+            pending.clear()
+
+        for data in scenarios:
+            try:
+                pending.append(self.parse_scenario(data, now))
+            except Exception as e:
+                pending.append(e)
+            if len(pending) >= batch_size:
+                yield from flush()
+        if pending:
+            yield from flush()
+
+
+def check_range(name, value):
+    """Raise ValueError unless value is a finite number within SCENARIO_RANGES[name]"""
+    _, low, high = SCENARIO_RANGES[name]
+    if not np.isfinite(value) or value < low or (high is not None and value > high):
+        bounds = f"between {low} and {high}" if high is not None else f"at least {low}"
+        raise ValueError(f"{name} must be {bounds}, got {value}")
+
+
+def historical_scenarios(path=DATA_PATH, rows=None, random_state=42):
+    """
+    Read the preprocessed dataset as scenarios accepted by predict_many, with the
+    observed severity, population and economic loss as scenario values.
+    rows, if given, draws a random sample of that many events.
+    """
+    df = pd.read_csv(path)
+    if rows is not None and rows < len(df):
+        df = df.sample(rows, random_state=random_state)
+    return pd.DataFrame({
+        'disaster_type': df['disaster_type'],
+        'location': df['location'],
+        'latitude': df['latitude'],
+        'longitude': df['longitude'],
+        **date_features(df['date']),
+        'severity_level': df['severity_level'],
+        'affected_population': df['affected_population'],
+        'economic_loss': df['estimated_economic_loss_usd'],
+    }).reset_index(drop=True)
+
+
+def date_features(dates):
+    """month, week (of the month, as in training) and day_of_year columns for a Series of dates"""
+    date = pd.to_datetime(dates)
+    return {
+        'month': date.dt.month,
+        'week': date.dt.isocalendar().week.astype(int) % 4 + 1,
+        'day_of_year': date.dt.dayofyear,
+    }
+
+
+def historical_stage_inputs(engine, path=DATA_PATH, rows=None):
+    """Raw stage inputs of the cascade over (a sample of) the preprocessed dataset"""
+    return engine.stage_inputs(historical_scenarios(path, rows))
+
+
+def _artifact(name):
+    return property(lambda self: self.artifacts.get(name), doc=f"'{name}' artifact, loaded on first access")
+
+
+for _name in MODEL_FILES:
+    if _name not in ('metadata', 'parameter_table', 'event_index'):
+        setattr(DisasterInferenceEngine, _name, _artifact(_name))
+
+
+def apply_response_rules(out):
+    """Fill the priority, resource, shelter and evacuation fields of a PREDICTION_DTYPE array"""
+    probability = out['major_probability']
+    severity = out['severity_level']
+    population = out['affected_population']
+    damage = out['predicted_damage_index']
+
+    # Determine priority and alert level
+    out['priority_tier'] = np.select([
+        (probability > 0.7) | (severity >= 8),
+        (probability > 0.5) | (severity >= 6),
+        (probability > 0.3) | (severity >= 4),
+    ], [0, 1, 2], default=3)
+
+    # Resource recommendations and shelter needs
+    out['resource_tier'] = np.select([population > 40000, population > 20000], [0, 1], default=2)
+    out['shelter_tier'] = np.select([damage > 0.7, damage > 0.4], [0, 1], default=2)
+    out['temporary_shelters'] = population * _SHELTER_FACTORS[out['shelter_tier']]
+
+    # Evacuation recommendation
+    out['evacuation_recommended'] = (probability > 0.6) | (damage > 0.6)
+    out['people_to_evacuate'] = population * 0.7
+    return out
+
+
+def prediction_frame(records):
+    """
+    Columnar form of a PREDICTION_DTYPE array: the /api/predict input parameters,
+    predictions and emergency response fields, rounded the same way, one row per record
+    """
+    evacuate = records['evacuation_recommended']
+    # Evacuation counts are null (not 0) when no evacuation is recommended
+    evacuees = pd.Series(records['people_to_evacuate'], dtype='Int64').where(evacuate)
+    priority = np.array(PRIORITY_TIERS, dtype=object)[records['priority_tier']]
+    resources = np.array(RESOURCE_TIERS, dtype=object)[records['resource_tier']]
+    return pd.DataFrame({
+        'severity_level': records['severity_level'],
+        'affected_population': records['affected_population'],
+        'economic_loss': records['economic_loss'],
+        'is_major_disaster': records['is_major_disaster'],
+        'major_probability': np.round(records['major_probability'] * 100, 2),
+        'predicted_damage_index': np.round(records['predicted_damage_index'], 3),
+        'predicted_response_time_hours': np.round(records['predicted_response_time_hours'], 1),
+        'priority': priority[:, 0].astype(str),
+        'priority_level': priority[:, 1].astype(np.int8),
+        'alert_level': priority[:, 2].astype(str),
+        'personnel': resources[:, 0].astype(str),
+        'medical_teams': resources[:, 1].astype(str),
+        'rescue_units': resources[:, 2].astype(str),
+        'temporary_shelters': records['temporary_shelters'],
+        'equipment': np.array([equipment for _, equipment in SHELTER_TIERS])[records['shelter_tier']],
+        'evacuation_recommended': evacuate,
+        'people_to_evacuate': evacuees,
+        'evacuation_centers': evacuees // 500,
+        'vehicles_needed': evacuees // 50,
+    })
+
+
+def _round(value, decimals):
+    """value rounded the way np.round does it (rint of value * 10**decimals), as prediction_frame rounds"""
+    scale = 10 ** decimals
+    return round(value * scale) / scale
+
+
+def format_prediction(scenario, record):
+    """Build the /api/predict response dict for one scenario and its PREDICTION_DTYPE record"""
+    (severity, population, loss, major, probability, damage, response_time,
+     p_tier, r_tier, s_tier, shelters, evacuate, evacuees) = record.tolist()
+    priority, priority_level, alert_level = PRIORITY_TIERS[p_tier]
+    personnel, medical_teams, rescue_units = RESOURCE_TIERS[r_tier]
+
+    return {
+        'success': True,
+        'input': {
+            'disaster_type': scenario['disaster_type'],
+            'location': scenario['location'],
+            'location_inferred': scenario.get('location_inferred', False),
+            'latitude': scenario['latitude'],
+            'longitude': scenario['longitude'],
+            'severity_level': severity,
+            'affected_population': population,
+            'economic_loss': loss
+        },
+        'predictions': {
+            'is_major_disaster': major,
+            'major_probability': _round(probability * 100, 2),
+            'predicted_damage_index': _round(damage, 3),
+            'predicted_response_time_hours': _round(response_time, 1)
+        },
+        'emergency_response': {
+            'priority': priority,
+            'priority_level': priority_level,
+            'alert_level': alert_level,
+            'resources': {
+                'personnel': personnel,
+                'medical_teams': medical_teams,
+                'rescue_units': rescue_units,
+                'temporary_shelters': shelters,
+                'equipment': SHELTER_TIERS[s_tier][1]
+            },
+            'evacuation': {
+                'recommended': evacuate,
+                'people_to_evacuate': evacuees if evacuate else None,
+                'evacuation_centers': evacuees // 500 if evacuate else None,
+                'vehicles_needed': evacuees // 50 if evacuate else None
+            },
+            'action_items': [
+                f"Activate Emergency Operations Center within {response_time/2:.1f} hours",
+                f"Deploy first responders within {response_time:.1f} hours",
+                *STANDARD_ACTION_ITEMS
+            ]
+        }
+    }
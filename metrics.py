@@ -0,0 +1,173 @@
+"""
+Metrics
+Per-stage latency histograms and request counters for the prediction hot path,
+rendered in the Prometheus text exposition format for /metrics.
+
+Recording a sample is a bucket search and a few additions under a lock;
+everything else (cache, micro-batch and model load figures) is only read when
+/metrics is scraped.
+"""
+
+import bisect
+import threading
+
+# Upper bounds in seconds, from 50 microseconds (a table lookup) to 5 s (a large batch)
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    """{name: value} -> '{name="value",...}' ('' without labels)"""
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _number(value):
+    if value is None:
+        return 'NaN'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_family(name, kind, help_text, samples):
+    """Text lines of one metric family; samples are (labels dict, value) pairs"""
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+    lines.extend(f'{name}{format_labels(labels)} {_number(value)}' for labels, value in samples)
+    return lines
+
+
+class Counter:
+    """Monotonic counter per combination of label values"""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        with self._lock:
+            samples = [(dict(zip(self.labelnames, labels)), value) for labels, value in sorted(self._values.items())]
+        return render_family(self.name, 'counter', self.help_text, samples)
+
+
+class Histogram:
+    """Cumulative-bucket histogram per combination of label values"""
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        # bisect_left: a value equal to a bound belongs to that bucket (le = less or equal)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][slot] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *labels):
+        series = self._series.get(labels)
+        return series[2] if series else 0
+
+    def totals(self):
+        """{label values: (sum, count)} of every series"""
+        with self._lock:
+            return {labels: (total, n) for labels, (_, total, n) in self._series.items()}
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((labels, (list(counts), total, n)) for labels, (counts, total, n) in self._series.items())
+        for labels, (counts, total, n) in series:
+            names = dict(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{format_labels(dict(names, le=_number(bound)))} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(names)} {_number(total)}')
+            lines.append(f'{self.name}_count{format_labels(names)} {n}')
+        return lines
+
+
+class Metrics:
+    """
+    The API's metrics: stage and request latency histograms, request counters,
+    and collectors - functions called at scrape time that return
+    (name, type, help, [(labels, value), ...]) families from live objects.
+
+    observe_stage is the DisasterInferenceEngine stage_observer. Between
+    begin_request and end_request, the stages observed on the calling thread
+    are also summed per request for the X-Timing header.
+    """
+
+    def __init__(self):
+        self.stage_seconds = Histogram(
+            'disaster_stage_seconds', 'Time spent in each prediction stage', ('stage',))
+        self.request_seconds = Histogram(
+            'disaster_request_seconds', 'Request handling time by endpoint', ('endpoint',))
+        self.requests = Counter(
+            'disaster_requests_total', 'Prediction requests by endpoint, disaster type and outcome',
+            ('endpoint', 'disaster_type', 'outcome'))
+        self.collectors = []
+        self._local = threading.local()
+
+    def observe_stage(self, stage, seconds):
+        self.stage_seconds.observe(seconds, stage)
+        timings = getattr(self._local, 'timings', None)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + seconds
+
+    def begin_request(self):
+        self._local.timings = {}
+
+    def end_request(self):
+        """Stage timings of the current request, {stage: seconds}"""
+        timings = getattr(self._local, 'timings', None) or {}
+        self._local.timings = None
+        return timings
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+        return collector
+
+    def render(self):
+        lines = self.stage_seconds.render() + self.request_seconds.render() + self.requests.render()
+        for collector in self.collectors:
+            for name, kind, help_text, samples in collector():
+                lines.extend(render_family(name, kind, help_text, samples))
+        return '\n'.join(lines) + '\n'
+
+
+def timing_header(timings):
+    """X-Timing header value: 'stage=1.234ms, ...' in the order the stages ran"""
+    return ', '.join(f'{stage}={seconds * 1000:.3f}ms' for stage, seconds in timings.items())
@@ -0,0 +1,430 @@
+"""
+Model Bundle
+Packs everything the prediction cascade needs into one versioned file: the
+compiled tree arrays (scalers folded in), scaler parameters, encoder
+vocabularies, parameter table, event index columns and metadata. A JSON
+manifest records the feature column order of every stage and a SHA-256
+checksum of every array.
+
+Loading is one read (or one mmap) plus JSON parsing; nothing is unpickled.
+Building checks every component against the others and refuses to write a
+bundle with a missing or mismatched one.
+
+Usage:
+    python model_bundle.py build  [--model-dir saved_models] [--output saved_models.bundle]
+    python model_bundle.py verify BUNDLE [--model-dir saved_models] [--data CSV] [--rows N]
+    python model_bundle.py info   BUNDLE
+
+Any DisasterInferenceEngine model_dir (DISASTER_MODEL_DIR, --model-dir) can
+name a bundle file instead of a directory.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import struct
+import time
+
+import numpy as np
+
+BUNDLE_FORMAT_VERSION = 1
+MAGIC = b'DISBNDL\0'
+# Magic, format version, manifest length
+HEADER = struct.Struct('<8sIQ')
+# Array data starts on multiples of this many bytes (cache line / SIMD alignment)
+ALIGNMENT = 64
+BUNDLE_EXTENSION = '.bundle'
+ENCODERS = ('le_disaster', 'le_location', 'le_aid')
+SCALERS = ('scaler_parameters', 'scaler_disaster', 'scaler_damage', 'scaler_response')
+
+
+class BundleError(ValueError):
+    """Raised for a corrupt or incompatible bundle, or when components do not fit together at build time"""
+
+
+def _json_value(value):
+    """json.dumps default: numpy scalars and arrays as Python values"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _checksum(array):
+    return hashlib.sha256(np.ascontiguousarray(array).view(np.uint8).reshape(-1)).hexdigest()
+
+
+class _ArrayWriter:
+    """Collects named arrays and their manifest entries (offsets relative to the data section)"""
+
+    def __init__(self):
+        self.arrays = []
+        self.entries = {}
+        self.size = 0
+
+    def add(self, key, array):
+        array = np.asarray(array)
+        if array.dtype.hasobject:
+            # Strings are stored fixed-width; anything else would need pickling
+            try:
+                array = array.astype(str)
+            except (TypeError, ValueError):
+                raise BundleError(f"{key}: arrays of Python objects cannot be bundled") from None
+        array = np.ascontiguousarray(array)
+        self.size += -self.size % ALIGNMENT
+        self.entries[key] = {
+            'offset': self.size,
+            'dtype': array.dtype.str,
+            'shape': list(array.shape),
+            'nbytes': array.nbytes,
+            'sha256': _checksum(array),
+        }
+        self.arrays.append((self.size, array))
+        self.size += array.nbytes
+        return key
+
+
+def check_components(engine):
+    """
+    (problems, warnings) of the artifacts loaded by engine: problems stop the
+    build, warnings are optional artifacts that are left out
+    """
+    from inference_engine import CASCADE_STAGES, STAGE_MODEL_FEATURES
+
+    problems, warnings = [], []
+    artifacts = engine.artifacts
+    for stage, entries in CASCADE_STAGES.items():
+        if stage == 'parameters' and not engine.has_parameter_models:
+            warnings.append("parameter models not found; the bundle requires severity, population and loss inputs")
+            continue
+        for (name, _, scaler_name), features in zip(entries, STAGE_MODEL_FEATURES[stage]):
+            model, scaler = artifacts.get(name), artifacts.get(scaler_name)
+            if model is None or scaler is None:
+                problems.append(f"{name if model is None else scaler_name} is missing")
+                continue
+            if getattr(model, 'n_features_in_', len(features)) != len(features):
+                problems.append(f"{name} takes {model.n_features_in_} features, the cascade gives it {len(features)}")
+            if getattr(scaler, 'n_features_in_', len(features)) != len(features):
+                problems.append(f"{scaler_name} was fitted on {scaler.n_features_in_} features, "
+                                f"{name} takes {len(features)}")
+    classifier = artifacts.get('disaster_classifier')
+    if classifier is not None and len(getattr(classifier, 'classes_', [])) != 2:
+        problems.append("disaster_classifier is not a binary classifier")
+
+    expected = {'disaster_prediction': 'assessment', 'damage_assessment': 'assessment',
+                'response_optimization': 'response', 'parameter_prediction': 'parameters'}
+    for key, columns in engine.metadata.get('feature_columns', {}).items():
+        stage = expected.get(key)
+        if stage is not None and len(columns) not in {len(features) for features in STAGE_MODEL_FEATURES[stage]}:
+            problems.append(f"metadata feature_columns['{key}'] has {len(columns)} columns, "
+                            f"no {stage} model takes that many")
+    for name in ENCODERS:
+        if artifacts.get(name) is None:
+            problems.append(f"{name} is missing")
+
+    if 'parameter_table' in artifacts and engine.parameter_table is None:
+        warnings.append("parameter_table.pkl does not match the current models; rebuild it to bundle it")
+    elif engine.has_parameter_models and engine.parameter_table is None:
+        warnings.append("no parameter table; build one with `python parameter_table.py build` to bundle it")
+    if engine.metadata.get('major_decision') is not None and engine.decision is None:
+        warnings.append("the major disaster decision rule was fitted to other models and is left out")
+    if engine.event_index is None:
+        warnings.append("no event index; location inference and /api/nearest-events will be unavailable")
+    return problems, warnings
+
+
+def build_bundle(engine):
+    """(manifest, [(offset, array), ...], data size) for the models of a directory engine"""
+    from inference_engine import ASSESSMENT_FEATURES, CASCADE_STAGES, PARAMETER_FEATURES, RESPONSE_FEATURES
+    from tree_compiler import compile_cascade
+
+    problems, warnings = check_components(engine)
+    if problems:
+        raise BundleError("Cannot build the bundle:\n  " + "\n  ".join(problems))
+    for warning in warnings:
+        print(f"⚠ {warning}")
+
+    artifacts = engine.artifacts
+    stages = {stage: entries for stage, entries in CASCADE_STAGES.items()
+              if stage != 'parameters' or engine.has_parameter_models}
+    try:
+        compiled = compile_cascade(artifacts, stages, fold=True)
+    except (TypeError, NotImplementedError) as e:
+        raise BundleError(f"Cannot build the bundle: {e}") from None
+
+    writer = _ArrayWriter()
+    stage_columns = {'parameters': PARAMETER_FEATURES, 'assessment': ASSESSMENT_FEATURES,
+                     'response': RESPONSE_FEATURES}
+    groups = {
+        stage: {
+            'input_columns': stage_columns[stage],
+            'members': group['members'],
+            'arrays': {key: writer.add(f'compiled/{stage}/{key}', array) for key, array in group['arrays'].items()},
+        }
+        for stage, group in compiled['groups'].items()
+    }
+    scalers = {}
+    for name in SCALERS:
+        scaler = artifacts.get(name)
+        if scaler is not None:
+            scalers[name] = {
+                'with_mean': scaler.with_mean,
+                'with_std': scaler.with_std,
+                'arrays': {key: writer.add(f'{name}/{key}', getattr(scaler, key))
+                           for key in ('mean_', 'scale_', 'var_') if getattr(scaler, key, None) is not None},
+            }
+
+    table = None
+    if engine.parameter_table is not None:
+        source = artifacts['parameter_table']
+        table = {key: source[key] for key in ('format_version', 'training_date', 'disaster_classes',
+                                              'location_classes')}
+        table['arrays'] = {key: writer.add(f'parameter_table/{key}', source[key])
+                           for key in ('latitude', 'longitude', 'severity_level', 'affected_population',
+                                       'economic_loss')}
+    events = None
+    if engine.event_index is not None:
+        index = artifacts['event_index']
+        events = {
+            'format_version': index['format_version'],
+            'sources': index['sources'],
+            'object_columns': [name for name, values in index['columns'].items() if values.dtype.hasobject],
+            'columns': {name: writer.add(f'event_index/{name}', values) for name, values in index['columns'].items()},
+        }
+
+    metadata = {key: value for key, value in engine.metadata.items() if key != 'major_decision'}
+    if engine.decision is not None:
+        metadata['major_decision'] = engine.decision
+    manifest = {
+        'format_version': BUNDLE_FORMAT_VERSION,
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'training_date': engine.metadata.get('training_date'),
+        'metadata': metadata,
+        'encoders': {name: artifacts[name].classes_.tolist() for name in ENCODERS},
+        'scalers': scalers,
+        'compiled': {'format_version': compiled['format_version'], 'groups': groups},
+        'parameter_table': table,
+        'event_index': events,
+        'arrays': writer.entries,
+    }
+    return manifest, writer.arrays, writer.size
+
+
+def write_bundle(engine, path):
+    """Build the bundle of engine's models and write it atomically to path; returns the manifest"""
+    manifest, arrays, _ = build_bundle(engine)
+    encoded = json.dumps(manifest, default=_json_value, separators=(',', ':')).encode('utf-8')
+    data_start = HEADER.size + len(encoded)
+    data_start += -data_start % ALIGNMENT
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, BUNDLE_FORMAT_VERSION, len(encoded)))
+        f.write(encoded)
+        for offset, array in arrays:
+            f.seek(data_start + offset)
+            f.write(array.tobytes())
+    os.replace(tmp_path, path)
+    return manifest
+
+
+def read_manifest(path):
+    """(manifest, offset of the data section) of a bundle file"""
+    with open(path, 'rb') as f:
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise BundleError(f"{path} is not a model bundle (too short)")
+        magic, version, length = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise BundleError(f"{path} is not a model bundle")
+        if version != BUNDLE_FORMAT_VERSION:
+            raise BundleError(f"{path} has bundle format {version}; this version reads {BUNDLE_FORMAT_VERSION}")
+        try:
+            manifest = json.loads(f.read(length).decode('utf-8'))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise BundleError(f"{path} has a corrupt manifest: {e}") from None
+    data_start = HEADER.size + length
+    return manifest, data_start + -data_start % ALIGNMENT
+
+
+class BundleStore:
+    """
+    Artifact mapping of a model bundle, with the interface of model_store.ModelStore
+    that DisasterInferenceEngine uses. The bundle only holds compiled models, so
+    the engine evaluates every batch with the compiled evaluator.
+    """
+
+    compiled_only = True
+
+    def __init__(self, path, mmap_mode=None, verify=True):
+        from sklearn.preprocessing import LabelEncoder, StandardScaler
+
+        from inference_engine import ASSESSMENT_FEATURES, PARAMETER_FEATURES, RESPONSE_FEATURES
+
+        start = time.perf_counter()
+        self.path = path
+        self.mmap_mode = mmap_mode
+        manifest, data_start = read_manifest(path)
+        self.manifest = manifest
+        if mmap_mode:
+            buffer = np.memmap(path, dtype=np.uint8, mode='r')
+        else:
+            with open(path, 'rb') as f:
+                buffer = np.frombuffer(f.read(), dtype=np.uint8)
+        self.size_bytes = len(buffer)
+
+        arrays = {}
+        for key, entry in manifest['arrays'].items():
+            offset = data_start + entry['offset']
+            if offset + entry['nbytes'] > len(buffer):
+                raise BundleError(f"{path} is truncated: {key} ends past the end of the file")
+            array = buffer[offset:offset + entry['nbytes']].view(np.dtype(entry['dtype'])).reshape(entry['shape'])
+            if verify and _checksum(array) != entry['sha256']:
+                raise BundleError(f"{path} is corrupt: checksum mismatch in {key}")
+            arrays[key] = array
+
+        stage_columns = {'parameters': PARAMETER_FEATURES, 'assessment': ASSESSMENT_FEATURES,
+                         'response': RESPONSE_FEATURES}
+        groups = {}
+        for stage, group in manifest['compiled']['groups'].items():
+            if group['input_columns'] != stage_columns.get(stage):
+                raise BundleError(f"{path}: the {stage} stage was bundled with input columns "
+                                  f"{group['input_columns']}, this engine builds {stage_columns.get(stage)}")
+            groups[stage] = {'arrays': {name: arrays[key] for name, key in group['arrays'].items()},
+                             'members': group['members']}
+
+        self._artifacts = {
+            'metadata': manifest['metadata'],
+            'compiled_models': {'format_version': manifest['compiled']['format_version'],
+                                'training_date': manifest['training_date'], 'groups': groups},
+        }
+        for name, classes in manifest['encoders'].items():
+            encoder = LabelEncoder()
+            encoder.classes_ = np.array(classes, dtype=object)
+            self._artifacts[name] = encoder
+        for name, scaler_entry in manifest['scalers'].items():
+            scaler = StandardScaler(with_mean=scaler_entry['with_mean'], with_std=scaler_entry['with_std'])
+            for attribute, key in scaler_entry['arrays'].items():
+                setattr(scaler, attribute, arrays[key])
+            scaler.n_features_in_ = len(scaler.scale_)
+            self._artifacts[name] = scaler
+        table = manifest['parameter_table']
+        if table is not None:
+            self._artifacts['parameter_table'] = dict(
+                {key: value for key, value in table.items() if key != 'arrays'},
+                **{name: arrays[key] for name, key in table['arrays'].items()})
+        self._events = manifest['event_index']
+        self._arrays = arrays
+        self.load_seconds = round(time.perf_counter() - start, 4)
+
+    def _event_index(self):
+        """Event index dict rebuilt from the bundled columns (the BallTrees are not stored)"""
+        from spatial_index import index_from_columns
+
+        columns = {name: self._arrays[key] for name, key in self._events['columns'].items()}
+        for name in self._events['object_columns']:
+            columns[name] = columns[name].astype(object)
+        index = index_from_columns(columns, self._events['sources'])
+        if index['format_version'] != self._events['format_version']:
+            raise BundleError(f"{self.path} has event index format {self._events['format_version']}")
+        return index
+
+    def __contains__(self, name):
+        return name in self._artifacts or (name == 'event_index' and self._events is not None)
+
+    def __getitem__(self, name):
+        if name == 'event_index' and name not in self._artifacts and self._events is not None:
+            self._artifacts[name] = self._event_index()
+        return self._artifacts[name]
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+    def load_report(self):
+        return [{
+            'artifact': 'bundle',
+            'file': os.path.basename(self.path),
+            'size_bytes': self.size_bytes,
+            'load_seconds': self.load_seconds,
+            'mmap_mode': self.mmap_mode,
+        }]
+
+    def print_report(self):
+        from model_store import current_rss
+
+        print(f"\n  Bundle {self.path}: {self.size_bytes / 2**20:.1f} MB, {len(self._arrays)} arrays, "
+              f"loaded in {self.load_seconds * 1000:.1f} ms{' (memory-mapped)' if self.mmap_mode else ''}")
+        print(f"  Process RSS: {current_rss() / 2**20:.1f} MB\n")
+
+
+def load_bundle(path, mmap_mode=None, verify=True):
+    """
+    Open a bundle file as a BundleStore. Raises BundleError if the file is
+    corrupt (checksums are verified unless verify=False) or incompatible.
+    """
+    print(f"Loading model bundle {path}...")
+    return BundleStore(path, mmap_mode=mmap_mode, verify=verify)
+
+
+def is_bundle(path):
+    return path is not None and os.path.isfile(path)
+
+
+def compare_with_directory(bundle_path, model_dir, data_path, rows=1000):
+    """True if the bundle's predictions equal the compiled models of model_dir on rows of the dataset"""
+    from inference_engine import DisasterInferenceEngine, historical_scenarios
+
+    scenarios = historical_scenarios(data_path, rows)
+    bundled = DisasterInferenceEngine(bundle_path)
+    directory = DisasterInferenceEngine(model_dir, backend='compiled', compiled_max_batch=len(scenarios))
+    return np.array_equal(bundled.predict_many(scenarios), directory.predict_many(scenarios))
+
+
+def main(argv=None):
+    from inference_engine import DATA_PATH, MODEL_DIR, DisasterInferenceEngine
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['build', 'verify', 'info'])
+    parser.add_argument('bundle', nargs='?', default=None,
+                        help=f"Bundle file (build default: MODEL_DIR{BUNDLE_EXTENSION})")
+    parser.add_argument('--model-dir', default=MODEL_DIR)
+    parser.add_argument('--output', default=None, help="Same as the bundle argument, for build")
+    parser.add_argument('--data', default=DATA_PATH, help="Dataset rows compared by verify")
+    parser.add_argument('--rows', type=int, default=1000)
+    args = parser.parse_args(argv)
+    path = args.output or args.bundle or args.model_dir.rstrip('/\\') + BUNDLE_EXTENSION
+
+    try:
+        if args.command == 'build':
+            engine = DisasterInferenceEngine(args.model_dir, backend='sklearn', lazy=False)
+            manifest = write_bundle(engine, path)
+            print(f"✓ Bundle of models trained {manifest['training_date']} written to {path} "
+                  f"({os.path.getsize(path) / 2**20:.1f} MB, {len(manifest['arrays'])} arrays)")
+        elif args.command == 'verify':
+            load_bundle(path)
+            print("✓ Checksums verified")
+            if compare_with_directory(path, args.model_dir, args.data, args.rows):
+                print(f"✓ Predictions on {args.rows:,} dataset rows are identical to the models in {args.model_dir}")
+            else:
+                print(f"✗ Predictions differ from the models in {args.model_dir}")
+                raise SystemExit(1)
+        else:
+            manifest, _ = read_manifest(path)
+            print(f"Bundle format {manifest['format_version']}, built {manifest['created']} from models trained "
+                  f"{manifest['training_date']}")
+            for stage, group in manifest['compiled']['groups'].items():
+                print(f"  {stage:<12}" + ", ".join(member['name'] for member in group['members']))
+            print(f"  Parameter table: {'yes' if manifest['parameter_table'] else 'no'}, "
+                  f"event index: {'yes' if manifest['event_index'] else 'no'}, "
+                  f"decision rule: {'yes' if manifest['metadata'].get('major_decision') else 'no'}")
+            print(f"  {len(manifest['arrays'])} arrays, "
+                  f"{sum(entry['nbytes'] for entry in manifest['arrays'].values()) / 2**20:.1f} MB")
+    except BundleError as e:
+        print(f"✗ {e}")
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
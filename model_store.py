@@ -0,0 +1,217 @@
+"""
+Model Store
+Lazy, optionally memory-mapped loading of the saved_models artifacts with a
+per-artifact load time and memory report
+
+Usage:
+    python model_store.py report [--model-dir saved_models] [--mmap-mode r]
+    python model_store.py resave [--model-dir saved_models]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import joblib
+
+
+def current_rss():
+    """Resident set size of this process in bytes (peak RSS where /proc is unavailable)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:  # Windows
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class ModelStore:
+    """
+    Mapping of artifact name -> loaded object, backed by files in model_dir.
+
+    Artifacts are loaded on first access (or all at once with lazy=False).
+    With mmap_mode='r' the numpy arrays inside each joblib file are memory-mapped
+    instead of copied, so processes forked from the same parent share them
+    through the page cache. The files must be uncompressed joblib dumps for this
+    to work (see resave_for_mmap).
+    """
+
+    def __init__(self, model_dir, files, mmap_mode=None, lazy=True):
+        self.model_dir = model_dir
+        self.files = dict(files)
+        self.mmap_mode = mmap_mode
+        self._loaded = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        if not lazy:
+            for name in self.files:
+                if name in self:
+                    self[name]
+
+    def path(self, name):
+        return os.path.join(self.model_dir, self.files[name])
+
+    def __contains__(self, name):
+        return name in self.files and os.path.exists(self.path(name))
+
+    def __getitem__(self, name):
+        try:
+            return self._loaded[name]
+        except KeyError:
+            pass
+        with self._lock:
+            if name not in self._loaded:
+                self._loaded[name] = self._load(name)
+        return self._loaded[name]
+
+    def get(self, name, default=None):
+        try:
+            return self._loaded[name]
+        except KeyError:
+            return self[name] if name in self else default
+
+    def _load(self, name):
+        path = self.path(name)
+        rss_before = current_rss()
+        start = time.perf_counter()
+        obj = joblib.load(path, mmap_mode=self.mmap_mode)
+        self._stats[name] = {
+            'artifact': name,
+            'file': self.files[name],
+            'size_bytes': os.path.getsize(path),
+            'load_seconds': round(time.perf_counter() - start, 4),
+            'rss_delta_bytes': current_rss() - rss_before,
+            'mmap_mode': self.mmap_mode,
+        }
+        return obj
+
+    def is_loaded(self, name):
+        return name in self._loaded
+
+    def load_report(self):
+        """One entry per artifact: load time and RSS growth, or 'not loaded' / 'missing'"""
+        report = []
+        for name, filename in self.files.items():
+            if name in self._stats:
+                report.append(self._stats[name])
+            else:
+                report.append({
+                    'artifact': name,
+                    'file': filename,
+                    'status': 'not loaded' if name in self else 'missing',
+                })
+        return report
+
+    def print_report(self):
+        print(f"\n  {'Artifact':<24}{'Size':>10}{'Load (ms)':>12}{'RSS +MB':>10}")
+        for entry in self.load_report():
+            if 'load_seconds' in entry:
+                print(f"  {entry['artifact']:<24}{entry['size_bytes'] / 1024:>8.0f}KB"
+                      f"{entry['load_seconds'] * 1000:>12.1f}{entry['rss_delta_bytes'] / 2**20:>10.1f}")
+            else:
+                print(f"  {entry['artifact']:<24}{entry['status']:>10}")
+        print(f"  Process RSS: {current_rss() / 2**20:.1f} MB\n")
+
+
+def artifact_signature(model_dir, files):
+    """(file name, mtime in ns, size) of every artifact present in model_dir, to detect new files"""
+    signature = []
+    for filename in sorted(files.values()):
+        try:
+            stat = os.stat(os.path.join(model_dir, filename))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        signature.append((filename, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+class ModelWatcher:
+    """
+    Daemon thread that polls model_dir every interval seconds and calls
+    callback() once new artifacts have landed. A change is only acted on after
+    two polls in a row see the same files, so a retraining run that is still
+    writing them does not trigger a reload halfway through.
+    """
+
+    def __init__(self, model_dir, files, callback, interval=5.0, signature=None):
+        self.model_dir = model_dir
+        self.files = dict(files)
+        self.callback = callback
+        self.interval = interval
+        self.signature = signature if signature is not None else artifact_signature(model_dir, self.files)
+        self.reloads = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='model-watcher', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        pending = None
+        while not self._stop.wait(self.interval):
+            current = artifact_signature(self.model_dir, self.files)
+            if current == self.signature:
+                pending = None
+            elif current != pending:
+                pending = current
+            else:
+                # Unchanged for one interval: the new artifacts are complete
+                self.signature, pending = current, None
+                try:
+                    self.callback()
+                    self.reloads += 1
+                except Exception as e:
+                    print(f"⚠ Reloading models from {self.model_dir} failed, keeping the current ones: {e}")
+
+    def stop(self):
+        self._stop.set()
+
+
+def resave_for_mmap(model_dir, files):
+    """
+    Rewrite every artifact as an uncompressed joblib dump so it can be loaded
+    with mmap_mode='r'. Each file is replaced atomically.
+    """
+    for filename in files.values():
+        path = os.path.join(model_dir, filename)
+        if not os.path.exists(path):
+            print(f"⚠ Skipping missing {filename}")
+            continue
+        obj = joblib.load(path)
+        fd, tmp_path = tempfile.mkstemp(dir=model_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            joblib.dump(obj, tmp_path, compress=0)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        print(f"✓ Resaved {filename}")
+
+
+def main():
+    from inference_engine import MODEL_DIR, MODEL_FILES
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['report', 'resave'])
+    parser.add_argument('--model-dir', default=MODEL_DIR)
+    parser.add_argument('--mmap-mode', default=None, choices=['r', 'c'])
+    args = parser.parse_args()
+
+    if args.command == 'resave':
+        resave_for_mmap(args.model_dir, MODEL_FILES)
+        return
+
+    store = ModelStore(args.model_dir, MODEL_FILES, mmap_mode=args.mmap_mode, lazy=False)
+    store.print_report()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+Parameter Table
+Precomputed severity, affected population and economic loss predictions over
+every (disaster type, location, month, week) at each location's canonical
+coordinates, so the common /api/predict request (known location, no custom
+coordinates) skips the parameter models
+
+Usage:
+    python parameter_table.py build [--model-dir saved_models] [--data CSV]
+"""
+
+import argparse
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+
+PARAMETER_TABLE_FORMAT_VERSION = 1
+MONTHS = 12
+# Week of the month as used in training (ISO week % 4 + 1)
+WEEKS = 4
+# Canonical coordinates are rounded to this many decimals (about 11 m)
+COORDINATE_DECIMALS = 4
+
+
+class ParameterTable:
+    """
+    Dense (disaster, location, month, week) grid of parameter predictions.
+
+    Arrays, indexed [disaster_encoded, location_encoded, month - 1, week - 1]:
+        severity_level       int32
+        affected_population  int64
+        economic_loss        float64
+    Per location (location_encoded):
+        latitude, longitude  canonical coordinates the grid was evaluated at
+    """
+
+    def __init__(self, table):
+        if table.get('format_version') != PARAMETER_TABLE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported parameter table format {table.get('format_version')}")
+        self.training_date = table['training_date']
+        self.disaster_classes = list(table['disaster_classes'])
+        self.location_classes = list(table['location_classes'])
+        self.latitude = table['latitude']
+        self.longitude = table['longitude']
+        self.severity_level = table['severity_level']
+        self.affected_population = table['affected_population']
+        self.economic_loss = table['economic_loss']
+
+    def canonical_coordinates(self, location_encoded):
+        return float(self.latitude[location_encoded]), float(self.longitude[location_encoded])
+
+    def covers(self, month, week):
+        return 1 <= month <= MONTHS and 1 <= week <= WEEKS
+
+    def lookup(self, disaster_encoded, location_encoded, month, week):
+        """(severity, population, economic loss) for one grid cell, or None outside the grid"""
+        if not self.covers(month, week):
+            return None
+        index = (disaster_encoded, location_encoded, month - 1, week - 1)
+        return self.severity_level[index], self.affected_population[index], self.economic_loss[index]
+
+
+def canonical_locations(data_path, location_classes):
+    """Median latitude / longitude of every location in the preprocessed dataset"""
+    df = pd.read_csv(data_path, usecols=['location', 'latitude', 'longitude'])
+    medians = df.groupby('location')[['latitude', 'longitude']].median().round(COORDINATE_DECIMALS)
+    missing = [location for location in location_classes if location not in medians.index]
+    if missing:
+        raise ValueError(f"No events for {', '.join(missing)} in {data_path}")
+    medians = medians.loc[list(location_classes)]
+    return medians['latitude'].to_numpy(), medians['longitude'].to_numpy()
+
+
+def build_parameter_table(engine, data_path):
+    """Evaluate the parameter models of engine over the full grid and return the table dict"""
+    if not engine.has_parameter_models:
+        raise FileNotFoundError("Parameter prediction models are missing")
+    disasters = list(engine.le_disaster.classes_)
+    locations = list(engine.le_location.classes_)
+    latitude, longitude = canonical_locations(data_path, locations)
+
+    shape = (len(disasters), len(locations), MONTHS, WEEKS)
+    disaster, location, month, week = (axis.ravel() for axis in np.indices(shape))
+    grid = pd.DataFrame({
+        'disaster_encoded': disaster,
+        'location_encoded': location,
+        'latitude': latitude[location],
+        'longitude': longitude[location],
+        'month': month + 1,
+        'week': week + 1,
+    })
+    records = engine.predict_many(grid)
+
+    return {
+        'format_version': PARAMETER_TABLE_FORMAT_VERSION,
+        'training_date': engine.metadata.get('training_date'),
+        'disaster_classes': disasters,
+        'location_classes': locations,
+        'latitude': latitude,
+        'longitude': longitude,
+        'severity_level': records['severity_level'].reshape(shape),
+        'affected_population': records['affected_population'].reshape(shape),
+        'economic_loss': records['economic_loss'].reshape(shape),
+    }
+
+
+def save_parameter_table(table, path):
+    """Write the table as an uncompressed joblib file (memory-mappable)"""
+    tmp_path = path + '.tmp'
+    joblib.dump(table, tmp_path, compress=0)
+    os.replace(tmp_path, path)
+
+
+def main():
+    from inference_engine import DATA_PATH, MODEL_DIR, MODEL_FILES, DisasterInferenceEngine
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['build'])
+    parser.add_argument('--model-dir', default=MODEL_DIR)
+    parser.add_argument('--data', default=DATA_PATH, help="Preprocessed dataset (canonical coordinates)")
+    args = parser.parse_args()
+
+    engine = DisasterInferenceEngine(args.model_dir)
+    table = build_parameter_table(engine, args.data)
+    path = os.path.join(args.model_dir, MODEL_FILES['parameter_table'])
+    save_parameter_table(table, path)
+    print(f"✓ Parameter table with {table['severity_level'].size:,} cells written to {path} "
+          f"({os.path.getsize(path) / 1024:.0f} KB)")
+
+
+if __name__ == '__main__':
+    main()
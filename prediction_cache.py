@@ -0,0 +1,144 @@
+"""
+Prediction Cache
+Size- and TTL-bounded LRU caches in front of the parameter stage and the full
+prediction cascade, keyed on the canonicalized scenario tuple
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_CACHE_SIZE = 4096
+DEFAULT_CACHE_TTL = 3600
+# Decimal places kept from latitude / longitude (4 places is about 11 m)
+DEFAULT_COORDINATE_PRECISION = 4
+
+
+class LRUCache:
+    """Thread-safe least-recently-used mapping with an optional per-entry time to live"""
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'ttl_seconds': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+class PredictionCache:
+    """
+    Caches used by DisasterInferenceEngine:
+        parameters - (severity, population, economic loss) per
+                     (disaster, location, lat, lon, month, week)
+        cascade    - full PREDICTION_DTYPE record per canonical scenario
+
+    Coordinates are rounded to `precision` decimals before they are used as a
+    key and before the models see them, so a cached answer is exactly what the
+    models return for the canonical scenario. Entries belong to one model
+    version (the training_date in model_metadata.pkl); validate() drops them
+    all when the engine using the cache reports a different version.
+    """
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL,
+                 precision=DEFAULT_COORDINATE_PRECISION):
+        self.precision = precision
+        self.cascade = LRUCache(maxsize, ttl)
+        self.parameters = LRUCache(maxsize, ttl)
+        self.version = None
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """
+        Build the cache from DISASTER_CACHE_SIZE, DISASTER_CACHE_TTL (seconds,
+        0 for no expiry) and DISASTER_CACHE_PRECISION. Returns None when the
+        size is 0 (caching disabled).
+        """
+        maxsize = int(os.environ.get('DISASTER_CACHE_SIZE', DEFAULT_CACHE_SIZE))
+        if maxsize <= 0:
+            return None
+        return cls(
+            maxsize=maxsize,
+            ttl=float(os.environ.get('DISASTER_CACHE_TTL', DEFAULT_CACHE_TTL)) or None,
+            precision=int(os.environ.get('DISASTER_CACHE_PRECISION', DEFAULT_COORDINATE_PRECISION)),
+        )
+
+    def canonical_coordinates(self, latitude, longitude):
+        return round(latitude, self.precision), round(longitude, self.precision)
+
+    def validate(self, version):
+        """Drop every entry if the models changed since the cache was filled"""
+        if version == self.version:
+            return
+        with self._lock:
+            if version != self.version:
+                if len(self.cascade) or len(self.parameters):
+                    self.invalidations += 1
+                self.cascade.clear()
+                self.parameters.clear()
+                self.version = version
+
+    def clear(self):
+        self.cascade.clear()
+        self.parameters.clear()
+
+    def stats(self):
+        return {
+            'training_date': self.version,
+            'coordinate_precision': self.precision,
+            'invalidations': self.invalidations,
+            'cascade': self.cascade.stats(),
+            'parameters': self.parameters.stats(),
+        }
@@ -0,0 +1,222 @@
+"""
+Response Formats
+Encodings of batch results chosen per request: the nested JSON of
+/api/predict (the default), columnar JSON, MessagePack and Arrow IPC, plus
+gzip / brotli compression of large responses.
+
+Columnar encodings hold one list per field instead of one object per scenario.
+The emergency response texts (priority and alert labels, resource and
+equipment recommendations, standard action items) only come from a handful of
+rule tiers, so they are sent once in the precomputed TIERS fragment, and each
+row carries its tier codes. detail='predictions' leaves the emergency response
+fields out altogether.
+
+A request picks its format with ?format= (or "format" in the JSON body):
+json, columnar, msgpack or arrow; otherwise the Accept header decides
+(application/msgpack, application/vnd.apache.arrow.stream). MessagePack needs
+the msgpack package, Arrow needs pyarrow and brotli needs brotli. orjson, when
+installed, serializes every JSON response.
+"""
+
+import gzip
+import json
+from datetime import datetime
+
+import pandas as pd
+from flask.json.provider import DefaultJSONProvider
+
+from inference_engine import PRIORITY_TIERS, RESOURCE_TIERS, SHELTER_TIERS, STANDARD_ACTION_ITEMS, prediction_frame
+
+try:
+    import orjson
+except ImportError:  # the standard json module is used
+    orjson = None
+try:
+    import msgpack
+except ImportError:  # format=msgpack answers 406
+    msgpack = None
+try:
+    import pyarrow as pa
+except ImportError:  # format=arrow answers 406
+    pa = None
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+FORMATS = {
+    'json': 'application/json',
+    'columnar': 'application/json',
+    'msgpack': 'application/msgpack',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+# Accept header media types, in order of preference on equal quality
+ACCEPT_TYPES = {
+    'application/json': 'json',
+    'application/msgpack': 'msgpack',
+    'application/x-msgpack': 'msgpack',
+    'application/vnd.apache.arrow.stream': 'arrow',
+}
+DETAILS = ('full', 'predictions')
+
+# Text of every rule tier, indexed by the *_tier codes of columnar rows
+TIERS = {
+    'priority_tier': [{'priority': priority, 'priority_level': level, 'alert_level': alert}
+                      for priority, level, alert in PRIORITY_TIERS],
+    'resource_tier': [{'personnel': personnel, 'medical_teams': medical, 'rescue_units': rescue}
+                      for personnel, medical, rescue in RESOURCE_TIERS],
+    'shelter_tier': [{'equipment': equipment} for _, equipment in SHELTER_TIERS],
+    'standard_action_items': list(STANDARD_ACTION_ITEMS),
+}
+INPUT_COLUMNS = ['disaster_type', 'location', 'location_inferred', 'latitude', 'longitude']
+PREDICTION_COLUMNS = ['severity_level', 'affected_population', 'economic_loss', 'is_major_disaster',
+                      'major_probability', 'predicted_damage_index', 'predicted_response_time_hours']
+TIER_COLUMNS = ['priority_tier', 'resource_tier', 'shelter_tier']
+RESPONSE_COLUMNS = ['temporary_shelters', 'evacuation_recommended', 'people_to_evacuate',
+                    'evacuation_centers', 'vehicles_needed']
+
+
+class NotAcceptableError(ValueError):
+    """Raised when the requested format needs a package that is not installed"""
+
+
+def negotiate(requested, accept):
+    """
+    Format name for a request: requested (the format parameter) if given,
+    otherwise the best match of accept (werkzeug MIMEAccept), 'json' by default
+    """
+    if requested is None:
+        requested = ACCEPT_TYPES.get(accept.best_match(list(ACCEPT_TYPES)), 'json') if accept else 'json'
+    if requested not in FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(FORMATS)}")
+    if requested == 'msgpack' and msgpack is None:
+        raise NotAcceptableError("MessagePack responses need the msgpack package")
+    if requested == 'arrow' and pa is None:
+        raise NotAcceptableError("Arrow responses need the pyarrow package")
+    return requested
+
+
+def check_detail(detail):
+    if detail not in DETAILS:
+        raise ValueError(f"detail must be one of: {', '.join(DETAILS)}")
+    return detail
+
+
+def prediction_columns(records, detail='full'):
+    """Columnar rows of a PREDICTION_DTYPE array: predictions, then tier codes and counts for detail='full'"""
+    frame = prediction_frame(records)
+    if detail == 'predictions':
+        return frame[PREDICTION_COLUMNS]
+    tiers = pd.DataFrame({name: records[name] for name in TIER_COLUMNS})
+    return pd.concat([frame[PREDICTION_COLUMNS], tiers, frame[RESPONSE_COLUMNS]], axis=1)
+
+
+def batch_frame(engine, scenarios, detail='full', now=None):
+    """
+    One row per scenario dict: scenario_id, success, error, the parsed inputs
+    and prediction_columns. A scenario that fails validation only gets its
+    error; the others are scored together through predict_scenarios.
+    """
+    now = now or datetime.now()
+    rows, parsed, errors = [], [], [None] * len(scenarios)
+    for i, data in enumerate(scenarios):
+        try:
+            parsed.append(engine.parse_scenario(data, now))
+            rows.append(i)
+        except Exception as e:
+            errors[i] = str(e)
+
+    values = pd.concat([
+        pd.DataFrame({name: [scenario[name] for scenario in parsed] for name in INPUT_COLUMNS}),
+        prediction_columns(engine.predict_scenarios(parsed, now), detail),
+    ], axis=1)
+    if len(rows) < len(scenarios):
+        # Nullable integer / boolean columns keep their type around the failed rows
+        nullable = {name: 'boolean' if dtype.kind == 'b' else 'Int64'
+                    for name, dtype in values.dtypes.items() if dtype.kind in 'iub'}
+        values = values.astype(nullable).set_axis(rows).reindex(range(len(scenarios)))
+    return pd.concat([
+        pd.DataFrame({
+            'scenario_id': [data.get('id') if isinstance(data, dict) else None for data in scenarios],
+            'success': [error is None for error in errors],
+            'error': errors,
+        }),
+        values,
+    ], axis=1)
+
+
+def json_columns(frame):
+    """{column: list of JSON values} of a frame (missing values as None)"""
+    return {name: frame[name].astype(object).where(frame[name].notna(), None).tolist() for name in frame.columns}
+
+
+def dumps(obj):
+    """Compact JSON bytes of obj"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def _arrow_table(frame, metadata):
+    columns = {}
+    for name in frame.columns:
+        column = frame[name]
+        try:
+            array = pa.array(column, from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Mixed-type values (e.g. scenario ids) are sent as text
+            array = pa.array(column.map(lambda value: None if value is None else str(value)))
+        if pa.types.is_string(array.type) or pa.types.is_large_string(array.type):
+            array = array.dictionary_encode()
+        columns[name] = array
+    table = pa.table(columns)
+    return table.replace_schema_metadata({'disaster': json.dumps(metadata)})
+
+
+def encode(fmt, frame, header):
+    """
+    (body bytes, content type) of a columnar format: header fields plus
+    'columns' (and 'tiers' when frame has tier codes). Arrow carries the header
+    as JSON in the schema metadata key 'disaster'.
+    """
+    metadata = dict(header)
+    if 'priority_tier' in frame:
+        metadata['tiers'] = TIERS
+    if fmt == 'arrow':
+        sink = pa.BufferOutputStream()
+        table = _arrow_table(frame, metadata)
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes(), FORMATS['arrow']
+    metadata['columns'] = json_columns(frame)
+    if fmt == 'msgpack':
+        return msgpack.packb(metadata), FORMATS['msgpack']
+    return dumps(metadata), FORMATS['columnar']
+
+
+def choose_encoding(accept_encodings):
+    """'br' or 'gzip' if the client accepts it (werkzeug Accept of Accept-Encoding), else None"""
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(body, encoding, level=6):
+    if encoding == 'br':
+        return brotli.compress(body, quality=min(level, 11))
+    return gzip.compress(body, compresslevel=level)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that serializes with orjson (same output as the default, keys sorted)"""
+
+    def dumps(self, obj, **kwargs):
+        if 'indent' in kwargs:
+            # Pretty-printed (debug) output
+            return super().dumps(obj, **kwargs)
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
@@ -0,0 +1,210 @@
+"""
+Scenario Sweep
+Scores one base scenario over the Cartesian product of a few input axes (month,
+week, severity, affected population, a latitude / longitude grid, ...), e.g.
+"a Flood in India in every month at every severity" in one call instead
+of 120. Each chunk of grid cells is written straight into one scenario matrix
+and run through the cascade vectorized; outputs come back columnar, one value
+per cell, with the last axis varying fastest.
+
+Severity, affected population and economic loss are normally predicted by the
+parameter stage. Sweeping one of them keeps the given values instead, so the
+assessment and response models see the swept values.
+
+An axis is a list of values or a range: {"start": 1, "stop": 10} (step 1, stop
+included), {"start": 1, "stop": 10, "step": 3} or {"start": 20, "stop": 25,
+"num": 11} (evenly spaced).
+
+Usage:
+    python scenario_sweep.py '{"disaster_type": "Flood", "location": "India"}'
+                             --axis month=1:12 --axis severity_level=1:10
+                             [--outputs predicted_response_time_hours ...] [--output sweep.csv]
+
+The API serves the same sweeps at POST /api/sweep.
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from inference_engine import (PREDICTED_PARAMETERS, PREDICTION_DTYPE, SCENARIO_COLUMNS, SCENARIO_RANGES,
+                              prediction_frame)
+
+# Sweepable scenario fields: (type, lowest, highest allowed value), the ranges parse_scenario enforces
+AXES = dict(SCENARIO_RANGES)
+OUTPUTS = list(prediction_frame(np.empty(0, dtype=PREDICTION_DTYPE)).columns)
+DEFAULT_OUTPUTS = [
+    'severity_level', 'affected_population', 'economic_loss', 'is_major_disaster', 'major_probability',
+    'predicted_damage_index', 'predicted_response_time_hours', 'priority_level', 'evacuation_recommended',
+]
+# Base scenario fields echoed in the response
+SCENARIO_FIELDS = ('disaster_type', 'location', 'location_inferred', 'latitude', 'longitude',
+                   'month', 'week', 'day_of_year')
+DEFAULT_MAX_CELLS = 100000
+DEFAULT_CHUNK_SIZE = 10000
+MAX_AXIS_VALUES = 10000
+
+
+def axis_values(name, spec):
+    """Validated values of one axis from a list or a {start, stop, step | num} range"""
+    if name not in AXES:
+        raise ValueError(f"Cannot sweep '{name}'; axes are: {', '.join(AXES)}")
+    kind, low, high = AXES[name]
+    if isinstance(spec, dict):
+        if 'start' not in spec or 'stop' not in spec:
+            raise ValueError(f"Axis '{name}' range needs 'start' and 'stop'")
+        start, stop = float(spec['start']), float(spec['stop'])
+        if 'num' in spec:
+            num = int(spec['num'])
+            if not 1 <= num <= MAX_AXIS_VALUES:
+                raise ValueError(f"Axis '{name}' num must be between 1 and {MAX_AXIS_VALUES}")
+            values = np.linspace(start, stop, num)
+        else:
+            step = float(spec.get('step', 1))
+            if step <= 0 or (stop - start) / step >= MAX_AXIS_VALUES:
+                raise ValueError(f"Axis '{name}' step must be positive and give at most {MAX_AXIS_VALUES} values")
+            values = start + step * np.arange(int(np.floor((stop - start) / step + 1e-9)) + 1)
+    elif isinstance(spec, list):
+        values = np.asarray(spec, dtype=float)
+    else:
+        raise ValueError(f"Axis '{name}' must be a list of values or a {{start, stop}} range")
+
+    if not 1 <= len(values) <= MAX_AXIS_VALUES:
+        raise ValueError(f"Axis '{name}' must have between 1 and {MAX_AXIS_VALUES} values")
+    if not np.isfinite(values).all():
+        raise ValueError(f"Axis '{name}' values must be finite numbers")
+    if kind is int:
+        if not np.array_equal(values, np.round(values)):
+            raise ValueError(f"Axis '{name}' values must be whole numbers")
+        values = values.astype(np.int64)
+    if values.min() < low or (high is not None and values.max() > high):
+        raise ValueError(f"Axis '{name}' values must be between {low} and {high if high is not None else 'inf'}")
+    return values
+
+
+def plan_sweep(engine, scenario, axes, outputs=None, max_cells=DEFAULT_MAX_CELLS):
+    """
+    Validate a sweep request against engine and return its plan: the parsed
+    base scenario, {axis: values} in request order, the grid shape and cell
+    count, and the output columns. Raises ValueError for an invalid request or
+    a grid of more than max_cells cells. Without a parameter table the base
+    scenario, or a latitude and a longitude axis, must give coordinates:
+    parse_scenario has no canonical coordinates to fall back to.
+    """
+    if not isinstance(scenario, dict):
+        raise ValueError("'scenario' must be a JSON object")
+    if not isinstance(axes, dict) or not axes:
+        raise ValueError("'axes' must be a non-empty object of axis name -> values")
+    axes = {name: axis_values(name, spec) for name, spec in axes.items()}
+    shape = tuple(len(values) for values in axes.values())
+    cells = int(np.prod(shape, dtype=np.int64))
+    if cells > max_cells:
+        raise ValueError(f"The sweep has {cells:,} cells; at most {max_cells:,} are allowed")
+
+    outputs = DEFAULT_OUTPUTS if outputs is None else outputs
+    if not isinstance(outputs, list) or not outputs:
+        raise ValueError("'outputs' must be a non-empty list")
+    unknown = [name for name in outputs if name not in OUTPUTS]
+    if unknown:
+        raise ValueError(f"Unknown outputs {', '.join(map(str, unknown))}; choose from: {', '.join(OUTPUTS)}")
+
+    # A swept coordinate pair stands in for missing base coordinates
+    base = dict(scenario)
+    if 'latitude' in axes and 'longitude' in axes and base.get('latitude') is None and base.get('longitude') is None:
+        base['latitude'], base['longitude'] = float(axes['latitude'][0]), float(axes['longitude'][0])
+    return {
+        'scenario': engine.parse_scenario(base),
+        'axes': axes,
+        'shape': shape,
+        'cells': cells,
+        'outputs': list(outputs),
+    }
+
+
+def grid_matrix(plan, start, stop):
+    """Scenario matrix (SCENARIO_COLUMNS order) of grid cells start..stop-1"""
+    scenario = plan['scenario']
+    matrix = np.empty((stop - start, len(SCENARIO_COLUMNS)))
+    matrix[:] = [scenario[name] for name in SCENARIO_COLUMNS]
+    cell_index = np.unravel_index(np.arange(start, stop), plan['shape'])
+    for (name, values), index in zip(plan['axes'].items(), cell_index):
+        matrix[:, SCENARIO_COLUMNS.index(name)] = values[index]
+    return matrix
+
+
+def run_sweep(engine, plan, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield (offset, output DataFrame) for consecutive chunks of the grid"""
+    keep = tuple(name for name in PREDICTED_PARAMETERS if name in plan['axes'])
+    for start in range(0, plan['cells'], chunk_size):
+        stop = min(start + chunk_size, plan['cells'])
+        records = engine.predict_many(grid_matrix(plan, start, stop), keep=keep)
+        yield start, prediction_frame(records)[plan['outputs']]
+
+
+def sweep_outputs(engine, plan, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Output columns of every grid cell as one DataFrame"""
+    return pd.concat([frame for _, frame in run_sweep(engine, plan, chunk_size)], ignore_index=True)
+
+
+def describe(plan):
+    """JSON-ready description of a plan: base scenario, axes, shape and cell count"""
+    scenario = plan['scenario']
+    return {
+        'scenario': {name: scenario[name] for name in SCENARIO_FIELDS if name not in plan['axes']},
+        'axes': {name: values.tolist() for name, values in plan['axes'].items()},
+        'shape': list(plan['shape']),
+        'cells': plan['cells'],
+    }
+
+
+def sweep_frame(engine, plan, chunk_size=DEFAULT_CHUNK_SIZE):
+    """The whole sweep as one DataFrame: a column per axis followed by the outputs"""
+    grid = pd.MultiIndex.from_product(list(plan['axes'].values()), names=list(plan['axes'])).to_frame(index=False)
+    outputs = sweep_outputs(engine, plan, chunk_size)
+    # A swept parameter is output unchanged; keep only its axis column
+    return pd.concat([grid, outputs.drop(columns=[name for name in plan['axes'] if name in outputs])], axis=1)
+
+
+def _parse_axis(text):
+    """'name=1:12', 'name=1:10:3' or 'name=1,5,10' -> (name, spec)"""
+    name, _, values = text.partition('=')
+    if ':' in values:
+        parts = [float(part) for part in values.split(':')]
+        spec = {'start': parts[0], 'stop': parts[1]}
+        if len(parts) > 2:
+            spec['step'] = parts[2]
+        return name, spec
+    return name, [float(value) for value in values.split(',')]
+
+
+def main(argv=None):
+    from inference_engine import MODEL_DIR, DisasterInferenceEngine
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scenario', help="Base scenario as a JSON object")
+    parser.add_argument('--axis', action='append', required=True, metavar='NAME=START:STOP[:STEP] | NAME=V1,V2,...')
+    parser.add_argument('--outputs', nargs='+', default=None,
+                        help=f"Output columns (default: {' '.join(DEFAULT_OUTPUTS)})")
+    parser.add_argument('--output', default=None, help="CSV file to write (default: print the grid)")
+    parser.add_argument('--model-dir', default=MODEL_DIR)
+    parser.add_argument('--max-cells', type=int, default=DEFAULT_MAX_CELLS)
+    args = parser.parse_args(argv)
+
+    engine = DisasterInferenceEngine(args.model_dir)
+    plan = plan_sweep(engine, json.loads(args.scenario), dict(map(_parse_axis, args.axis)), args.outputs,
+                      args.max_cells)
+    frame = sweep_frame(engine, plan)
+    if args.output:
+        tmp_path = args.output + '.tmp'
+        frame.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, args.output)
+        print(f"✓ {plan['cells']:,} cells written to {args.output}")
+    else:
+        print(frame.to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+"""
+Bulk Scoring
+Streams a CSV or Parquet file of scenarios through the prediction cascade in
+fixed-size chunks and writes each chunk's predictions and emergency response
+fields to a CSV or Parquet file as it goes, so memory stays bounded by the
+chunk size however large the input is
+
+Input columns are the /api/predict scenario fields (disaster_type, location,
+latitude, longitude, month, week, day_of_year); a 'date' column can stand in
+for month / week / day_of_year, so the preprocessed dataset scores as is.
+Rows with an unknown disaster type or location, or invalid coordinates or
+month, are skipped and counted.
+
+Usage:
+    python score.py INPUT OUTPUT [--model-dir saved_models] [--chunk-size 50000]
+                    [--workers N] [--mmap-mode r] [--keep-columns COLUMN ...]
+"""
+
+import argparse
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from inference_engine import MODEL_DIR, SCENARIO_DEFAULTS, DisasterInferenceEngine, date_features, prediction_frame
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # CSV input and output still work
+    pa = pq = None
+
+DEFAULT_CHUNK_SIZE = 50000
+# Input columns copied to the output when present (override with --keep-columns)
+ID_COLUMNS = ['event_id', 'scenario_id', 'id']
+# Scenario fields written in front of the predictions
+OUTPUT_SCENARIO_COLUMNS = ['disaster_type', 'location', 'latitude', 'longitude', 'month', 'week', 'day_of_year']
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+
+
+def _is_parquet(path):
+    return path.lower().endswith(PARQUET_EXTENSIONS)
+
+
+def _require_pyarrow(path):
+    if pq is None:
+        raise ImportError(f"pyarrow is required for Parquet files ({path}); pip install pyarrow")
+
+
+def read_chunks(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the rows of a CSV or Parquet file as DataFrames of at most chunk_size rows"""
+    if _is_parquet(path):
+        _require_pyarrow(path)
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size)
+
+
+def _encode_column(encoder, values):
+    """Codes of values (-1 for missing / unknown), looking up each distinct value once"""
+    codes, uniques = pd.factorize(values, use_na_sentinel=True)
+    mapped = np.array([encoder.get(value, -1) for value in uniques] + [-1], dtype=np.int64)
+    return mapped[codes]
+
+
+def to_scenarios(engine, chunk, now=None):
+    """
+    Scenario frame for predict_many (categories already encoded) from one input
+    chunk, and the boolean mask of rows that can be scored.
+    Missing coordinates of a known location are filled with its canonical
+    coordinates when the parameter table is available, and a missing or
+    unknown location is inferred from the coordinates when the event index is.
+    """
+    now = now or datetime.now()
+    n = len(chunk)
+
+    def column(name, default=np.nan):
+        if name in chunk:
+            return np.array(pd.to_numeric(chunk[name], errors='coerce'), dtype=float)
+        return np.full(n, default, dtype=float)
+
+    disaster = _encode_column(engine.disaster_encoder, chunk['disaster_type']) if 'disaster_type' in chunk \
+        else np.full(n, -1)
+    location = _encode_column(engine.location_encoder, chunk['location']) if 'location' in chunk \
+        else np.full(n, -1)
+    latitude, longitude = column('latitude'), column('longitude')
+
+    table = engine.parameter_table
+    if table is not None:
+        fill = np.isnan(latitude) & np.isnan(longitude) & (location >= 0)
+        latitude[fill] = table.latitude[location[fill]]
+        longitude[fill] = table.longitude[location[fill]]
+    coordinates = np.isfinite(latitude) & np.isfinite(longitude)
+
+    index = engine.event_index
+    if index is not None:
+        for row in np.flatnonzero((location < 0) & coordinates):
+            inferred = index.infer_location(latitude[row], longitude[row])
+            if inferred is not None:
+                location[row] = engine.location_encoder.get(inferred, -1)
+
+    if 'month' not in chunk and 'date' in chunk:
+        date = pd.to_datetime(chunk['date'], errors='coerce')
+        dated = date.notna().to_numpy()
+        features = date_features(date.fillna(pd.Timestamp(now)))
+        month, week, day_of_year = (np.where(dated, features[name].to_numpy(dtype=float), np.nan)
+                                    for name in ('month', 'week', 'day_of_year'))
+    else:
+        month = column('month', now.month)
+        week = column('week', SCENARIO_DEFAULTS['week'])
+        day_of_year = column('day_of_year', now.timetuple().tm_yday)
+
+    valid = (disaster >= 0) & (location >= 0) & coordinates & (month >= 1) & (month <= 12)
+    valid &= np.isfinite(week) & np.isfinite(day_of_year)
+    scenarios = pd.DataFrame({
+        'disaster_encoded': disaster,
+        'location_encoded': location,
+        'latitude': latitude,
+        'longitude': longitude,
+        'month': month,
+        'week': week,
+        'day_of_year': day_of_year,
+    })
+    for name in ('severity_level', 'affected_population', 'economic_loss'):
+        scenarios[name] = column(name, SCENARIO_DEFAULTS[name])
+    return scenarios[valid].reset_index(drop=True), valid
+
+
+def score_chunk(engine, chunk, keep_columns=(), now=None):
+    """(output frame of the scored rows, number of skipped rows) for one input chunk"""
+    scenarios, valid = to_scenarios(engine, chunk, now)
+    records = engine.predict_many(scenarios, now)
+    output = chunk.loc[valid, list(keep_columns)].reset_index(drop=True)
+    output['disaster_type'] = np.array(engine.disaster_encoder.classes)[scenarios['disaster_encoded']]
+    output['location'] = np.array(engine.location_encoder.classes)[scenarios['location_encoded']]
+    for name in OUTPUT_SCENARIO_COLUMNS[2:]:
+        output[name] = scenarios[name]
+    for name in ('month', 'week', 'day_of_year'):
+        output[name] = output[name].astype(np.int64)
+    output = pd.concat([output, prediction_frame(records)], axis=1)
+    return output, int(len(chunk) - valid.sum())
+
+
+class CsvWriter:
+    """Appends chunks to a CSV file, writing the header with the first one"""
+
+    def __init__(self, path):
+        self.path = path
+        self.header = True
+        self.handle = open(path, 'w', newline='')
+
+    def write(self, frame):
+        frame.to_csv(self.handle, header=self.header, index=False)
+        self.header = False
+
+    def close(self):
+        self.handle.close()
+
+
+class ParquetChunkWriter:
+    """Appends chunks to a Parquet file as row groups, with the first chunk's schema"""
+
+    def __init__(self, path):
+        _require_pyarrow(path)
+        self.path = path
+        self.writer = None
+
+    def write(self, frame):
+        if self.writer is None:
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            self.writer = pq.ParquetWriter(self.path, table.schema)
+        else:
+            table = pa.Table.from_pandas(frame, schema=self.writer.schema, preserve_index=False)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def open_writer(path):
+    return ParquetChunkWriter(path) if _is_parquet(path) else CsvWriter(path)
+
+
+# Worker processes each hold their own engine, created once by _init_worker
+_worker_engine = None
+
+
+def _init_worker(model_dir, mmap_mode, n_jobs):
+    global _worker_engine
+    _worker_engine = DisasterInferenceEngine(model_dir, mmap_mode=mmap_mode)
+    _worker_engine.limit_model_threads(n_jobs)
+
+
+def _score_in_worker(chunk, keep_columns, now):
+    return score_chunk(_worker_engine, chunk, keep_columns, now)
+
+
+def score_file(input_path, output_path, model_dir=MODEL_DIR, chunk_size=DEFAULT_CHUNK_SIZE, workers=1,
+               mmap_mode=None, keep_columns=None, now=None):
+    """
+    Score input_path into output_path chunk by chunk and return
+    (rows scored, rows skipped, seconds). With workers > 1, chunks are scored
+    in a process pool with at most 2 * workers chunks in flight and written in
+    input order.
+    """
+    now = now or datetime.now()
+    start = time.perf_counter()
+    scored = skipped = 0
+    chunks = read_chunks(input_path, chunk_size)
+    writer = open_writer(output_path)
+
+    def keep_for(chunk):
+        if keep_columns is not None:
+            missing = [name for name in keep_columns if name not in chunk]
+            if missing:
+                raise ValueError(f"--keep-columns not in {input_path}: {', '.join(missing)}")
+            return list(keep_columns)
+        return [name for name in ID_COLUMNS if name in chunk]
+
+    def emit(result):
+        nonlocal scored, skipped
+        output, rejected = result
+        writer.write(output)
+        scored += len(output)
+        skipped += rejected
+        elapsed = time.perf_counter() - start
+        print(f"  {scored + skipped:>12,} rows read, {scored:,} scored ({scored / elapsed:,.0f} rows/s)")
+
+    try:
+        if workers <= 1:
+            engine = DisasterInferenceEngine(model_dir, mmap_mode=mmap_mode)
+            for chunk in chunks:
+                emit(score_chunk(engine, chunk, keep_for(chunk), now))
+        else:
+            n_jobs = max(1, (os.cpu_count() or 1) // workers)
+            with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                     initargs=(model_dir, mmap_mode, n_jobs)) as pool:
+                pending = deque()
+                for chunk in chunks:
+                    pending.append(pool.submit(_score_in_worker, chunk, keep_for(chunk), now))
+                    if len(pending) >= 2 * workers:
+                        emit(pending.popleft().result())
+                while pending:
+                    emit(pending.popleft().result())
+    finally:
+        writer.close()
+    return scored, skipped, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help="CSV or Parquet (.parquet / .pq) file of scenarios")
+    parser.add_argument('output', help="CSV or Parquet file to write; the format follows the extension")
+    parser.add_argument('--model-dir', default=MODEL_DIR)
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="Rows per chunk")
+    parser.add_argument('--workers', type=int, default=1, help="Scoring processes (default: 1, in-process)")
+    parser.add_argument('--mmap-mode', default=None, choices=['r'],
+                        help="Memory-map the model arrays (shared between worker processes)")
+    parser.add_argument('--keep-columns', nargs='+', default=None,
+                        help=f"Input columns to copy to the output (default: any of {', '.join(ID_COLUMNS)})")
+    args = parser.parse_args(argv)
+    if args.chunk_size < 1:
+        parser.error("--chunk-size must be positive")
+
+    scored, skipped, elapsed = score_file(args.input, args.output, args.model_dir, args.chunk_size,
+                                          args.workers, args.mmap_mode, args.keep_columns)
+    if skipped:
+        print(f"⚠ Skipped {skipped:,} rows with unknown categories or invalid coordinates / dates / months")
+    print(f"✓ Scored {scored:,} rows in {elapsed:.1f}s ({scored / max(elapsed, 1e-9):,.0f} rows/s) -> {args.output}")
+
+
+if __name__ == '__main__':
+    main()
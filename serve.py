@@ -0,0 +1,140 @@
+"""
+Production Server
+Serves app.py with gunicorn: the models are loaded once in the master process
+before the workers are forked, so the tree arrays are shared copy-on-write.
+Numeric thread pools are pinned per worker, and each worker reloads the models
+without dropping requests when new artifacts land in the model directory.
+Falls back to a single waitress process where gunicorn is unavailable (Windows).
+
+Usage:
+    python serve.py [--bind 0.0.0.0:5000] [--workers N] [--threads M]
+                    [--server auto|gunicorn|waitress] [--watch-interval 5]
+
+Reloads:
+    New artifacts (e.g. from train_pipeline.py) are picked up by every worker
+    within two --watch-interval periods. `kill -HUP <master pid>` reloads the
+    models in the master and then replaces the workers gracefully (in-flight
+    requests finish first), so the new workers share the new models copy-on-write.
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+
+# Environment variables read by the numeric libraries when they are first imported
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                   'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+
+def default_workers():
+    return max(1, os.cpu_count() or 1)
+
+
+def pin_threads(blas_threads, model_threads):
+    """
+    Limit BLAS / OpenMP pools and forest n_jobs for the current process. Must run
+    before numpy is imported to take full effect; threadpoolctl (a scikit-learn
+    dependency) also caps pools that are already running.
+    """
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(blas_threads)
+    os.environ['DISASTER_MODEL_THREADS'] = str(model_threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(blas_threads)
+
+
+def run_gunicorn(args):
+    from gunicorn.app.base import BaseApplication
+
+    class PreloadedApplication(BaseApplication):
+        """gunicorn application that imports app.py in the master (preload_app)"""
+
+        def load_config(self):
+            options = {
+                'bind': args.bind,
+                'workers': args.workers,
+                'threads': args.threads,
+                'worker_class': 'gthread',
+                'preload_app': True,
+                'timeout': args.timeout,
+                'graceful_timeout': args.timeout,
+                'keepalive': 5,
+                'post_fork': post_fork,
+                'on_reload': on_reload,
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            import app
+            return app.app
+
+    def post_fork(server, worker):
+        import app
+        pin_threads(args.blas_threads, args.model_threads)
+        app.start_worker(args.watch_interval)
+
+    def on_reload(server):
+        # Runs in the master on HUP, before the new workers are forked from it
+        import app
+        try:
+            app.reload_models()
+            app.reload_fast_models()
+        except Exception as e:
+            print(f"⚠ Could not reload the models in the master ({e}); new workers start with the current ones")
+
+    PreloadedApplication().run()
+
+
+def run_waitress(args):
+    from waitress import serve
+
+    import app
+    if args.workers > 1:
+        print(f"⚠ waitress runs a single process; serving with {args.threads} threads instead of "
+              f"{args.workers} workers")
+    app.start_worker(args.watch_interval)
+    host, _, port = args.bind.rpartition(':')
+    serve(app.app, host=host or '0.0.0.0', port=int(port), threads=args.threads)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bind', default='0.0.0.0:5000', help="HOST:PORT (default: 0.0.0.0:5000)")
+    parser.add_argument('--workers', type=int, default=default_workers(),
+                        help="Worker processes (default: one per CPU)")
+    parser.add_argument('--threads', type=int, default=4, help="Request threads per worker")
+    parser.add_argument('--server', choices=['auto', 'gunicorn', 'waitress'], default='auto')
+    parser.add_argument('--blas-threads', type=int, default=1, help="BLAS / OpenMP threads per worker")
+    parser.add_argument('--model-threads', type=int, default=1, help="n_jobs of the forests per worker")
+    parser.add_argument('--watch-interval', type=float, default=5.0,
+                        help="Seconds between checks for new artifacts (0 disables reloading)")
+    parser.add_argument('--timeout', type=int, default=60, help="Worker timeout and graceful shutdown seconds")
+    args = parser.parse_args(argv)
+
+    # Pinned before app.py (and with it numpy) is imported in this process
+    pin_threads(args.blas_threads, args.model_threads)
+    # Load every artifact up front so the forked workers share them
+    os.environ.setdefault('DISASTER_LAZY_LOAD', '0')
+
+    server = args.server
+    if server == 'auto':
+        server = 'gunicorn' if sys.platform != 'win32' and importlib.util.find_spec('gunicorn') else 'waitress'
+    if importlib.util.find_spec(server) is None:
+        print(f"✗ {server} is not installed: pip install gunicorn (Linux / macOS) or waitress (any platform)")
+        sys.exit(1)
+
+    if server == 'gunicorn':
+        print(f"✓ gunicorn: {args.workers} workers x {args.threads} threads on {args.bind}")
+        run_gunicorn(args)
+    else:
+        print(f"✓ waitress: {args.threads} threads on {args.bind}")
+        run_waitress(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+"""
+Spatial Index
+Haversine BallTrees over the historical events, used to find the nearest past
+disasters of a type and to infer a scenario's location from its coordinates
+
+Usage:
+    python spatial_index.py build [--model-dir saved_models] [--data CSV [CSV ...]]
+    python spatial_index.py query LAT LON [--disaster-type Flood] [--k 5]
+"""
+
+import argparse
+import os
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+
+EVENT_INDEX_FORMAT_VERSION = 1
+EARTH_RADIUS_KM = 6371.0088
+LEAF_SIZE = 40
+
+# Event columns kept in the index: output name -> column of the preprocessed dataset
+EVENT_COLUMNS = {
+    'event_id': 'event_id',
+    'disaster_type': 'disaster_type',
+    'location': 'location',
+    'date': 'date',
+    'latitude': 'latitude',
+    'longitude': 'longitude',
+    'severity_level': 'severity_level',
+    'affected_population': 'affected_population',
+    'economic_loss': 'estimated_economic_loss_usd',
+    'response_time_hours': 'response_time_hours',
+    'infrastructure_damage_index': 'infrastructure_damage_index',
+    'is_major_disaster': 'is_major_disaster',
+    'aid_provided': 'aid_provided',
+}
+
+# Neighbours that vote on an inferred location, and the farthest a voting
+# event may be before the coordinates count as outside every known location
+LOCATION_VOTES = 5
+LOCATION_MAX_KM = 750.0
+
+
+class EventIndex:
+    """
+    Historical events sorted by disaster type, with one BallTree per type and
+    one over all events. Trees store (latitude, longitude) in radians and use
+    the haversine metric, so queries are O(log n) in the number of events.
+    """
+
+    def __init__(self, index):
+        if index.get('format_version') != EVENT_INDEX_FORMAT_VERSION:
+            raise ValueError(f"Unsupported event index format {index.get('format_version')}")
+        self.columns = index['columns']
+        self.trees = index['trees']
+        self.offsets = index['offsets']
+        self.all_events = index['all_events']
+        self.sources = index['sources']
+        self.size = len(self.columns['event_id'])
+
+    @property
+    def disaster_types(self):
+        return list(self.offsets)
+
+    def _event(self, row, distance_km):
+        event = {name: values[row].item() if hasattr(values[row], 'item') else values[row]
+                 for name, values in self.columns.items()}
+        event['distance_km'] = round(float(distance_km), 3)
+        return event
+
+    def query(self, latitude, longitude, k=5, disaster_type=None):
+        """(distances in km, row indices) of the k nearest events, nearest first"""
+        point = np.radians([[latitude, longitude]])
+        if disaster_type is None:
+            tree, start = self.all_events, 0
+        else:
+            tree, start = self.trees[disaster_type], self.offsets[disaster_type][0]
+        k = min(k, tree.data.shape[0])
+        distance, rows = tree.query(point, k=k)
+        return distance[0] * EARTH_RADIUS_KM, rows[0] + start
+
+    def nearest(self, latitude, longitude, k=5, disaster_type=None):
+        """The k nearest historical events as dicts (EVENT_COLUMNS plus distance_km)"""
+        if disaster_type is not None and disaster_type not in self.trees:
+            return []
+        distances, rows = self.query(latitude, longitude, k, disaster_type)
+        return [self._event(row, distance) for row, distance in zip(rows, distances)]
+
+    def infer_location(self, latitude, longitude, votes=LOCATION_VOTES, max_km=LOCATION_MAX_KM):
+        """
+        Most common location among the nearest events within max_km (ties go to
+        the nearer event), or None when no event is that close
+        """
+        distances, rows = self.query(latitude, longitude, votes)
+        locations = [self.columns['location'][row] for row, distance in zip(rows, distances) if distance <= max_km]
+        if not locations:
+            return None
+        return max(dict.fromkeys(locations), key=locations.count)
+
+
+def build_event_index(frames, sources=()):
+    """Build the index dict from one or more event DataFrames with EVENT_COLUMNS"""
+    df = pd.concat(frames, ignore_index=True)
+    df = df.dropna(subset=['latitude', 'longitude']).sort_values('disaster_type', kind='stable')
+    columns = {name: df[column].to_numpy() for name, column in EVENT_COLUMNS.items()}
+    return index_from_columns(columns, sources)
+
+
+def index_from_columns(columns, sources=()):
+    """Build the index dict from event columns already sorted by disaster type"""
+    points = np.radians(np.column_stack([columns['latitude'], columns['longitude']]).astype(np.float64))
+
+    trees, offsets = {}, {}
+    types = columns['disaster_type']
+    for disaster_type in pd.unique(types):
+        start = int(np.searchsorted(types, disaster_type, side='left'))
+        stop = int(np.searchsorted(types, disaster_type, side='right'))
+        offsets[disaster_type] = (start, stop)
+        trees[disaster_type] = BallTree(points[start:stop], leaf_size=LEAF_SIZE, metric='haversine')
+
+    return {
+        'format_version': EVENT_INDEX_FORMAT_VERSION,
+        'sources': list(sources),
+        'columns': columns,
+        'offsets': offsets,
+        'trees': trees,
+        'all_events': BallTree(points, leaf_size=LEAF_SIZE, metric='haversine'),
+    }
+
+
+def save_event_index(index, path):
+    tmp_path = path + '.tmp'
+    joblib.dump(index, tmp_path, compress=0)
+    os.replace(tmp_path, path)
+
+
+def main():
+    from inference_engine import DATA_PATH, MODEL_DIR, MODEL_FILES
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['build', 'query'])
+    parser.add_argument('latitude', type=float, nargs='?')
+    parser.add_argument('longitude', type=float, nargs='?')
+    parser.add_argument('--model-dir', default=MODEL_DIR)
+    parser.add_argument('--data', nargs='+', default=[DATA_PATH],
+                        help="Event CSVs (the preprocessed dataset plus any later incident history)")
+    parser.add_argument('--disaster-type', default=None)
+    parser.add_argument('--k', type=int, default=5)
+    args = parser.parse_args()
+    path = os.path.join(args.model_dir, MODEL_FILES['event_index'])
+
+    if args.command == 'build':
+        start = time.perf_counter()
+        index = build_event_index([pd.read_csv(source) for source in args.data], args.data)
+        save_event_index(index, path)
+        print(f"✓ Indexed {len(index['columns']['event_id']):,} events ({len(index['trees'])} disaster types) "
+              f"in {time.perf_counter() - start:.1f}s -> {path}")
+        return
+
+    if args.latitude is None or args.longitude is None:
+        parser.error("query needs LAT and LON")
+    index = EventIndex(joblib.load(path))
+    start = time.perf_counter()
+    events = index.nearest(args.latitude, args.longitude, args.k, args.disaster_type)
+    elapsed = time.perf_counter() - start
+    print(f"\n  Inferred location: {index.infer_location(args.latitude, args.longitude)}")
+    for event in events:
+        print(f"  {event['distance_km']:>9.1f} km  {event['date']}  {event['disaster_type']:<18}{event['location']:<12}"
+              f"damage {event['infrastructure_damage_index']:.2f}  response {event['response_time_hours']:.1f} h")
+    print(f"\n  Query time: {elapsed * 1000:.3f} ms\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 // API Configuration
 const API_BASE_URL = 'http://localhost:5000';
+const MONTH_NAMES = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'];
 
 // Initialize app
 document.addEventListener('DOMContentLoaded', async () => {
@@ -81,7 +82,9 @@ async function handleFormSubmit(e) {
         latitude: parseFloat(document.getElementById('latitude').value),
         longitude: parseFloat(document.getElementById('longitude').value),
         month: parseInt(document.getElementById('month').value),
-        week: parseInt(document.getElementById('week').value)
+        week: parseInt(document.getElementById('week').value),
+        // Interactive predictions use the compact models when the server has them
+        tier: 'fast'
     };
     
     try {
@@ -117,6 +120,7 @@ async function handleFormSubmit(e) {
         
         // Show results
         displayResults(result);
+        loadSeasonalOutlook(formData);
         
     } catch (error) {
         console.error('Error making prediction:', error);
@@ -203,6 +207,50 @@ function displayResults(result) {
     });
 }
 
+// Response time of the same scenario in every month, from one sweep request
+async function loadSeasonalOutlook(formData) {
+    const outlookCard = document.getElementById('outlookCard');
+    try {
+        const { month, ...scenario } = formData;
+        const response = await fetch(`${API_BASE_URL}/api/sweep`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({
+                scenario: scenario,
+                axes: { month: { start: 1, stop: 12 } },
+                outputs: ['predicted_response_time_hours', 'is_major_disaster'],
+                tier: formData.tier
+            })
+        });
+        if (!response.ok) {
+            throw new Error('Sweep request failed');
+        }
+        const sweep = await response.json();
+
+        const grid = document.getElementById('outlookGrid');
+        grid.innerHTML = '';
+        sweep.axes.month.forEach((m, i) => {
+            const item = document.createElement('div');
+            item.className = 'outlook-item';
+            if (m === month) item.classList.add('selected');
+            if (sweep.columns.is_major_disaster[i]) item.classList.add('major');
+            const label = document.createElement('div');
+            label.className = 'param-label';
+            label.textContent = MONTH_NAMES[m - 1];
+            const value = document.createElement('div');
+            value.textContent = `${sweep.columns.predicted_response_time_hours[i]} h`;
+            item.append(label, value);
+            grid.appendChild(item);
+        });
+        outlookCard.style.display = 'block';
+    } catch (error) {
+        console.error('Error loading seasonal outlook:', error);
+        outlookCard.style.display = 'none';
+    }
+}
+
 // Get priority emoji
 function getPriorityEmoji(priority) {
     switch (priority) {
@@ -0,0 +1,386 @@
+"""
+Statistics Cube
+Historical aggregates by disaster type x location x month, built once from the
+preprocessed dataset and stored next to the models (saved_models/stats_cube.npz,
+plain arrays plus a JSON header, no pickles). Every cell holds the event count,
+the major disaster count and, for response time, infrastructure damage and
+economic loss, the sum, sum of squares, min, max and a fixed-bin histogram.
+Those all add up, so any slice or roll-up is answered from the cube, and
+appended incident rows are folded in without rescanning what is already counted.
+
+Percentiles are interpolated from the histograms: 0.5 h bins up to 168 h for
+response time, 0.01 for the damage index and 20 log-spaced bins per decade for
+economic loss (values outside a range fall in its end bins and are clamped to
+the cell's min / max).
+
+Usage:
+    python stats_cube.py build  [--data CSV [CSV ...]] [--output saved_models/stats_cube.npz]
+    python stats_cube.py update [--data CSV [CSV ...]]
+    python stats_cube.py query  [--disaster-type Flood] [--location India] [--month 7]
+                                [--group-by disaster_type month] [--percentiles 50 90]
+    python stats_cube.py info
+
+update reads only the rows appended to each source file since it was last
+read (the cube remembers the byte offset), and new files in full.
+"""
+
+import argparse
+import io
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+STATS_CUBE_FORMAT_VERSION = 1
+STATS_CUBE_FILE = 'stats_cube.npz'
+DIMENSIONS = ('disaster_type', 'location', 'month')
+# Output name -> (column of the preprocessed dataset, histogram bin edges)
+METRICS = {
+    'response_time_hours': ('response_time_hours', np.linspace(0, 168, 337)),
+    'infrastructure_damage_index': ('infrastructure_damage_index', np.linspace(0, 1, 101)),
+    'economic_loss': ('estimated_economic_loss_usd', np.geomspace(1e3, 1e10, 141)),
+}
+REQUIRED_COLUMNS = ['disaster_type', 'location', 'date', 'is_major_disaster'] + [
+    column for column, _ in METRICS.values()]
+DEFAULT_PERCENTILES = (50, 90)
+
+
+class StatsCube:
+    """
+    Aggregate arrays indexed [disaster type, location, month - 1] (histograms
+    have a trailing bin axis), the category values of the first two axes, and
+    the byte offsets read so far of every source file
+    """
+
+    def __init__(self, disaster_types, locations, arrays=None, sources=None, rows=0, updated_at=None):
+        self.disaster_types = list(disaster_types)
+        self.locations = list(locations)
+        self.sources = dict(sources or {})
+        self.rows = rows
+        self.updated_at = updated_at
+        shape = (len(self.disaster_types), len(self.locations), 12)
+        if arrays is None:
+            arrays = {'count': np.zeros(shape, dtype=np.int64), 'major': np.zeros(shape, dtype=np.int64)}
+            for name, (_, edges) in METRICS.items():
+                arrays[f'{name}_sum'] = np.zeros(shape)
+                arrays[f'{name}_sumsq'] = np.zeros(shape)
+                arrays[f'{name}_min'] = np.full(shape, np.inf)
+                arrays[f'{name}_max'] = np.full(shape, -np.inf)
+                arrays[f'{name}_hist'] = np.zeros(shape + (len(edges) - 1,), dtype=np.uint32)
+        self.arrays = arrays
+
+    # ------------------------------------------------------------------
+    # Building and updating
+    # ------------------------------------------------------------------
+
+    def _codes(self, categories, values):
+        """Category codes of values, adding (and padding the arrays for) new categories"""
+        new = [value for value in pd.unique(values) if value not in categories]
+        if new:
+            axis = 0 if categories is self.disaster_types else 1
+            categories.extend(new)
+            for name, array in self.arrays.items():
+                padding = [(0, 0)] * array.ndim
+                padding[axis] = (0, len(new))
+                fill = np.inf if name.endswith('_min') else -np.inf if name.endswith('_max') else 0
+                self.arrays[name] = np.pad(array, padding, constant_values=fill)
+        lookup = {value: code for code, value in enumerate(categories)}
+        return np.array([lookup[value] for value in values], dtype=np.int64)
+
+    def add(self, df):
+        """Fold the rows of a DataFrame with REQUIRED_COLUMNS into the cube; returns the rows counted"""
+        missing = [column for column in REQUIRED_COLUMNS if column not in df]
+        if missing:
+            raise ValueError(f"Missing columns: {', '.join(missing)}")
+        month = pd.to_datetime(df['date'], errors='coerce').dt.month
+        df = df.assign(month=month).dropna(subset=['disaster_type', 'location', 'month'])
+        if df.empty:
+            return 0
+
+        disaster = self._codes(self.disaster_types, df['disaster_type'].to_numpy())
+        location = self._codes(self.locations, df['location'].to_numpy())
+        shape = self.arrays['count'].shape
+        cells = np.ravel_multi_index((disaster, location, df['month'].to_numpy().astype(np.int64) - 1), shape)
+        size = int(np.prod(shape))
+
+        def add_to(name, values):
+            self.arrays[name] += values.reshape(self.arrays[name].shape).astype(self.arrays[name].dtype)
+
+        add_to('count', np.bincount(cells, minlength=size))
+        add_to('major', np.bincount(cells, weights=df['is_major_disaster'].to_numpy(dtype=float), minlength=size))
+        for name, (column, edges) in METRICS.items():
+            values = df[column].to_numpy(dtype=float)
+            known = ~np.isnan(values)
+            # A missing metric value only leaves that metric's aggregates out
+            cell, values = cells[known], values[known]
+            add_to(f'{name}_sum', np.bincount(cell, weights=values, minlength=size))
+            add_to(f'{name}_sumsq', np.bincount(cell, weights=values * values, minlength=size))
+            np.minimum.at(self.arrays[f'{name}_min'].reshape(-1), cell, values)
+            np.maximum.at(self.arrays[f'{name}_max'].reshape(-1), cell, values)
+            bins = np.clip(np.searchsorted(edges, values, side='right') - 1, 0, len(edges) - 2)
+            add_to(f'{name}_hist', np.bincount(cell * (len(edges) - 1) + bins, minlength=size * (len(edges) - 1)))
+
+        self.rows += len(df)
+        self.updated_at = time.strftime('%Y-%m-%d %H:%M:%S')
+        return len(df)
+
+    def add_source(self, path):
+        """
+        Fold the complete lines of a CSV that were not read before (all of them
+        for a new file) into the cube; returns the rows counted
+        """
+        key = os.path.abspath(path)
+        source = self.sources.get(key)
+        with open(path, 'rb') as f:
+            if source is None:
+                header = f.readline()
+                offset = len(header)
+                names = pd.read_csv(io.BytesIO(header)).columns.tolist()
+            else:
+                offset, names = source['offset'], source['columns']
+                if os.path.getsize(path) < offset:
+                    raise ValueError(f"{path} is shorter than when it was last read; rebuild the cube")
+                f.seek(offset)
+            data = f.read()
+        # A partly written last line is left for the next update
+        end = data.rfind(b'\n') + 1
+        rows = 0
+        if end:
+            rows = self.add(pd.read_csv(io.BytesIO(data[:end]), header=None, names=names))
+        self.sources[key] = {
+            'offset': offset + end,
+            'columns': names,
+            'rows': (source['rows'] if source else 0) + rows,
+        }
+        return rows
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def _select(self, dimension, values):
+        """Indices along a dimension for a list of requested values (all when values is empty)"""
+        if dimension == 'month':
+            if not values:
+                return np.arange(12)
+            months = [int(value) for value in values]
+            if not all(1 <= month <= 12 for month in months):
+                raise ValueError("month must be between 1 and 12")
+            return np.array(months) - 1
+        categories = self.disaster_types if dimension == 'disaster_type' else self.locations
+        if not values:
+            return np.arange(len(categories))
+        lookup = {str(category).casefold(): code for code, category in enumerate(categories)}
+        codes = []
+        for value in values:
+            code = lookup.get(str(value).strip().casefold())
+            if code is None:
+                raise ValueError(f"Unknown {dimension} '{value}'; expected one of: {', '.join(map(str, categories))}")
+            codes.append(code)
+        return np.array(codes)
+
+    def query(self, filters=None, group_by=(), percentiles=DEFAULT_PERCENTILES):
+        """
+        Statistics of the events matching filters ({dimension: [values]}; a
+        missing or empty dimension matches everything), one dict per group of
+        the group_by dimensions that has events (a single roll-up without
+        group_by). Each dict has the group's dimension values, count,
+        major_disaster_rate and per metric mean, std, min, max and p<q>.
+        """
+        filters = filters or {}
+        unknown = [name for name in list(filters) + list(group_by) if name not in DIMENSIONS]
+        if unknown:
+            raise ValueError(f"Unknown dimension {', '.join(unknown)}; dimensions are: {', '.join(DIMENSIONS)}")
+        percentiles = np.asarray(percentiles, dtype=float)
+        if ((percentiles < 0) | (percentiles > 100)).any():
+            raise ValueError("percentiles must be between 0 and 100")
+
+        index = np.ix_(*[self._select(name, filters.get(name)) for name in DIMENSIONS])
+        grouped = [axis for axis, name in enumerate(DIMENSIONS) if name in group_by]
+        summed = tuple(axis for axis in range(3) if axis not in grouped)
+
+        def reduce(name, how=np.sum):
+            values = self.arrays[name][index]
+            values = how(values, axis=summed) if summed else values
+            return values.reshape((-1,) + values.shape[len(grouped):])
+
+        count = reduce('count')
+        groups = np.flatnonzero(count)
+        labels = np.unravel_index(groups, [index[axis].size for axis in grouped]) if grouped else ()
+        results = []
+        for position, group in enumerate(groups):
+            result = {}
+            for axis, label in zip(grouped, labels):
+                code = int(index[axis].reshape(-1)[label[position]])
+                name = DIMENSIONS[axis]
+                result[name] = code + 1 if name == 'month' else (
+                    self.disaster_types if name == 'disaster_type' else self.locations)[code]
+            result['count'] = int(count[group])
+            results.append(result)
+
+        major = reduce('major')[groups]
+        for result, rate in zip(results, major / np.maximum(count[groups], 1)):
+            result['major_disaster_rate'] = round(float(rate), 4)
+
+        for name, (_, edges) in METRICS.items():
+            hist = reduce(f'{name}_hist')[groups].astype(np.int64)
+            n = hist.sum(axis=1)
+            total, squares = reduce(f'{name}_sum')[groups], reduce(f'{name}_sumsq')[groups]
+            low, high = reduce(f'{name}_min', np.min)[groups], reduce(f'{name}_max', np.max)[groups]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = total / n
+                std = np.sqrt(np.maximum(squares / n - mean * mean, 0))
+            quantiles = _histogram_percentiles(hist, edges, percentiles, low, high)
+            keys = ['mean', 'std', 'min', 'max'] + [f'p{q:g}' for q in percentiles]
+            values = np.round(np.column_stack([mean, std, low, high, quantiles]), 4).tolist()
+            for result, known, row in zip(results, n > 0, values):
+                result[name] = dict(zip(keys, row)) if known else None
+        return results
+
+    def info(self):
+        return {
+            'rows': self.rows,
+            'updated_at': self.updated_at,
+            'disaster_types': self.disaster_types,
+            'locations': self.locations,
+            'sources': {path: source['rows'] for path, source in self.sources.items()},
+        }
+
+    # ------------------------------------------------------------------
+    # Storage
+    # ------------------------------------------------------------------
+
+    def save(self, path):
+        header = {
+            'format_version': STATS_CUBE_FORMAT_VERSION,
+            'disaster_types': self.disaster_types,
+            'locations': self.locations,
+            'sources': self.sources,
+            'rows': self.rows,
+            'updated_at': self.updated_at,
+            'bins': {name: edges.tolist() for name, (_, edges) in METRICS.items()},
+        }
+        # np.savez adds '.npz' to names without it
+        tmp_path = path + '.tmp.npz'
+        np.savez_compressed(tmp_path, header=np.array(json.dumps(header)), **self.arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            header = json.loads(str(data['header']))
+            if header.get('format_version') != STATS_CUBE_FORMAT_VERSION:
+                raise ValueError(f"Unsupported stats cube format {header.get('format_version')}")
+            for name, (_, edges) in METRICS.items():
+                if not np.array_equal(header['bins'][name], edges):
+                    raise ValueError(f"{path} was built with other {name} bins; rebuild it")
+            arrays = {name: data[name] for name in data.files if name != 'header'}
+        return cls(header['disaster_types'], header['locations'], arrays, header['sources'], header['rows'],
+                   header['updated_at'])
+
+
+def _histogram_percentiles(hist, edges, percentiles, low, high):
+    """(groups, percentiles) values interpolated linearly inside the bin each percentile falls in"""
+    if not len(hist):
+        return np.empty((0, len(percentiles)))
+    cumulative = hist.cumsum(axis=1)
+    target = cumulative[:, -1:] * (percentiles / 100)
+    bins = np.minimum((cumulative[:, None, :] < target[:, :, None]).sum(axis=2), hist.shape[1] - 1)
+    rows = np.arange(len(hist))[:, None]
+    before = np.where(bins > 0, cumulative[rows, bins - 1], 0)
+    inside = np.maximum(hist[rows, bins], 1)
+    fraction = np.clip((target - before) / inside, 0, 1)
+    values = edges[bins] + fraction * (edges[bins + 1] - edges[bins])
+    return np.clip(values, low[:, None], high[:, None])
+
+
+def build_cube(paths):
+    """Cube of every row of the given CSVs"""
+    cube = StatsCube([], [])
+    for path in paths:
+        cube.add_source(path)
+    return cube
+
+
+def cube_signature(path):
+    try:
+        stat = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class CubeFile:
+    """The cube stored at path, reloaded on access when the file has changed (None while it does not exist)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.signature = None
+        self.cube = None
+
+    def get(self):
+        signature = cube_signature(self.path)
+        if signature != self.signature:
+            self.cube = StatsCube.load(self.path) if signature else None
+            self.signature = signature
+        return self.cube
+
+
+def _print_results(results):
+    for result in results:
+        keys = ', '.join(str(result[name]) for name in DIMENSIONS if name in result) or 'all events'
+        print(f"{keys}: {result['count']:,} events, major disaster rate {result['major_disaster_rate']:.1%}")
+        for name in METRICS:
+            stats = result[name]
+            if stats:
+                print(f"   {name:<30}" + ", ".join(f"{key}={value:,.4g}" for key, value in stats.items()))
+
+
+def main(argv=None):
+    from inference_engine import DATA_PATH, MODEL_DIR
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['build', 'update', 'query', 'info'])
+    parser.add_argument('--data', nargs='+', default=[DATA_PATH],
+                        help="Event CSVs (the preprocessed dataset plus any later incident history)")
+    parser.add_argument('--output', default=os.path.join(MODEL_DIR, STATS_CUBE_FILE))
+    parser.add_argument('--disaster-type', nargs='+', default=None)
+    parser.add_argument('--location', nargs='+', default=None)
+    parser.add_argument('--month', nargs='+', type=int, default=None)
+    parser.add_argument('--group-by', nargs='+', choices=DIMENSIONS, default=())
+    parser.add_argument('--percentiles', nargs='+', type=float, default=DEFAULT_PERCENTILES)
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        start = time.perf_counter()
+        cube = build_cube(args.data)
+        cube.save(args.output)
+        print(f"✓ Cube of {cube.rows:,} events ({len(cube.disaster_types)} disaster types x "
+              f"{len(cube.locations)} locations x 12 months) written to {args.output} "
+              f"({os.path.getsize(args.output) / 1024:.0f} KB) in {time.perf_counter() - start:.2f} s")
+        return
+
+    cube = StatsCube.load(args.output)
+    if args.command == 'update':
+        start = time.perf_counter()
+        added = sum(cube.add_source(path) for path in args.data)
+        cube.save(args.output)
+        print(f"✓ {added:,} new events added in {time.perf_counter() - start:.2f} s; "
+              f"the cube now holds {cube.rows:,}")
+    elif args.command == 'info':
+        info = cube.info()
+        print(f"{info['rows']:,} events, updated {info['updated_at']}")
+        print(f"  Disaster types: {', '.join(info['disaster_types'])}")
+        print(f"  Locations: {', '.join(info['locations'])}")
+        for path, rows in info['sources'].items():
+            print(f"  {path}: {rows:,} rows")
+    else:
+        filters = {'disaster_type': args.disaster_type, 'location': args.location, 'month': args.month}
+        _print_results(cube.query({name: values for name, values in filters.items() if values},
+                                  args.group_by, args.percentiles))
+
+
+if __name__ == '__main__':
+    main()
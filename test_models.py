@@ -1,137 +1,479 @@
-import joblib
 import numpy as np
-import os
 
-MODEL_DIR = 'saved_models'
+from inference_engine import DATA_PATH, DisasterInferenceEngine, MODEL_DIR
 
 print("Testing all models...\n")
 
 # Test loading all models
-print("1. Loading parameter prediction models...")
+print("1. Loading models through the inference engine...")
 try:
-    severity_model = joblib.load(os.path.join(MODEL_DIR, 'severity_model.pkl'))
-    population_model = joblib.load(os.path.join(MODEL_DIR, 'population_model.pkl'))
-    economic_loss_model = joblib.load(os.path.join(MODEL_DIR, 'economic_loss_model.pkl'))
-    scaler_parameters = joblib.load(os.path.join(MODEL_DIR, 'scaler_parameters.pkl'))
-    print("   ✓ Parameter models loaded")
+    engine = DisasterInferenceEngine(MODEL_DIR)
+    if not engine.has_parameter_models:
+        raise RuntimeError("Parameter prediction models are missing")
+    print("   ✓ Parameter models, main models and scalers loaded")
 except Exception as e:
     print(f"   ✗ Error: {e}")
     exit(1)
 
-print("\n2. Loading main prediction models...")
+print("\n2. Checking encoders...")
+le_disaster = engine.le_disaster
+le_location = engine.le_location
+print("   ✓ Encoders loaded")
+print(f"   Disaster types: {le_disaster.classes_[:5]}... (total: {len(le_disaster.classes_)})")
+print(f"   Locations: {le_location.classes_[:5]}... (total: {len(le_location.classes_)})")
 try:
-    disaster_classifier = joblib.load(os.path.join(MODEL_DIR, 'disaster_classifier.pkl'))
-    damage_regressor = joblib.load(os.path.join(MODEL_DIR, 'damage_regressor.pkl'))
-    response_regressor = joblib.load(os.path.join(MODEL_DIR, 'response_time_regressor.pkl'))
-    print("   ✓ Main models loaded")
+    from category_encoder import UnknownCategoryError
+    assert engine.encode(' FLOOD ', 'india') == tuple(
+        int(code) for code in (le_disaster.transform(['Flood'])[0], le_location.transform(['India'])[0])
+    ), "Normalized values encode differently from LabelEncoder.transform"
+    assert engine.encode('typhoon', 'United States') == engine.encode('Hurricane', 'USA'), "Aliases not applied"
+    codes = engine.location_encoder.encode_many(['japan', 'Japan', 'ITALY', 'Japan'])
+    assert codes.tolist() == le_location.transform(['Japan', 'Japan', 'Italy', 'Japan']).tolist()
+    try:
+        engine.encode('Flood', 'pakistan')
+        raise AssertionError("Unknown location was encoded")
+    except UnknownCategoryError as e:
+        assert e.values == ['pakistan']
+    print("   ✓ Case, whitespace and aliases are normalized; unknown values are reported")
 except Exception as e:
     print(f"   ✗ Error: {e}")
     exit(1)
 
-print("\n3. Loading scalers...")
+print("\n3. Testing prediction pipeline...")
 try:
-    scaler_disaster = joblib.load(os.path.join(MODEL_DIR, 'scaler_disaster.pkl'))
-    scaler_damage = joblib.load(os.path.join(MODEL_DIR, 'scaler_damage.pkl'))
-    scaler_response = joblib.load(os.path.join(MODEL_DIR, 'scaler_response.pkl'))
-    print("   ✓ Scalers loaded")
+    # Simulate form inputs
+    scenario = {
+        'disaster_type': "Earthquake",
+        'location': "Japan",
+        'latitude': 35.6762,
+        'longitude': 139.6503,
+        'month': 7,
+        'week': 2,
+        'day_of_year': 182,  # approximate
+    }
+
+    print(f"\n   Input: {scenario['disaster_type']} in {scenario['location']}")
+    print(f"   Coordinates: ({scenario['latitude']}, {scenario['longitude']})")
+    print(f"   Time: Month {scenario['month']}, Week {scenario['week']}")
+
+    result = engine.predict_one(scenario)
+    params = result['input']
+    predictions = result['predictions']
+
+    print("\n   Predicted Parameters:")
+    print(f"   - Severity: {params['severity_level']}/10")
+    print(f"   - Population: {params['affected_population']:,}")
+    print(f"   - Economic Loss: ${params['economic_loss']:,.2f}")
+
+    print("\n   Major Disaster Prediction:")
+    print(f"   - Is Major: {predictions['is_major_disaster']}")
+    print(f"   - Probability: {predictions['major_probability']:.2f}%")
+    print(f"   - Damage Index: {predictions['predicted_damage_index']:.3f}")
+    print(f"   - Response Time: {predictions['predicted_response_time_hours']:.1f} hours")
+
+    print("\n✓ All models working correctly!")
+
+except Exception as e:
+    print(f"\n✗ Error during prediction: {e}")
+    import traceback
+    traceback.print_exc()
+    exit(1)
+
+print("\n4. Testing batch and stream paths against the single prediction...")
+try:
+    records = engine.predict_many([engine.parse_scenario(scenario)] * 3)
+    assert np.all(records == records[0]), "Batch rows for identical scenarios differ"
+    streamed = list(engine.predict_stream([scenario, {'latitude': 'bad'}, scenario], batch_size=2))
+    assert streamed[0] == result and streamed[2] == result, "Stream result differs from predict_one"
+    assert not streamed[1]['success'], "Invalid scenario was not reported"
+    print("   ✓ predict_many and predict_stream match predict_one")
 except Exception as e:
     print(f"   ✗ Error: {e}")
     exit(1)
 
-print("\n4. Loading encoders...")
+print("\n5. Testing the prediction cache...")
 try:
-    le_disaster = joblib.load(os.path.join(MODEL_DIR, 'label_encoder_disaster.pkl'))
-    le_location = joblib.load(os.path.join(MODEL_DIR, 'label_encoder_location.pkl'))
-    print("   ✓ Encoders loaded")
-    print(f"   Disaster types: {le_disaster.classes_[:5]}... (total: {len(le_disaster.classes_)})")
-    print(f"   Locations: {le_location.classes_[:5]}... (total: {len(le_location.classes_)})")
+    from prediction_cache import PredictionCache
+    cache = PredictionCache(maxsize=2, ttl=60, precision=4)
+    cached_engine = DisasterInferenceEngine(MODEL_DIR, artifacts=engine.artifacts, cache=cache)
+    first = cached_engine.predict_one(scenario)
+    assert cached_engine.predict_one(scenario) == first, "Cached result differs from the first prediction"
+    assert first == result, "Cached engine differs from the uncached engine at 4-decimal coordinates"
+    assert cache.cascade.hits == 1 and cache.cascade.misses == 1, cache.stats()
+
+    # Another day of the year reuses the parameter stage
+    cached_engine.predict_one(dict(scenario, day_of_year=183))
+    assert cache.parameters.hits == 1, cache.stats()
+    cached_engine.predict_one(dict(scenario, month=1))
+    assert cache.cascade.evictions == 1, cache.stats()
+
+    # A different training date empties the cache
+    cache.validate('retrained')
+    assert len(cache.cascade) == 0 and cache.invalidations == 1, cache.stats()
+    print("   ✓ Hits, parameter reuse, eviction and invalidation behave as expected")
 except Exception as e:
     print(f"   ✗ Error: {e}")
     exit(1)
 
-print("\n5. Testing prediction pipeline...")
+print("\n6. Testing the major disaster decision rule...")
 try:
-    # Simulate form inputs
-    disaster_type = "Earthquake"
-    location = "Japan"
-    latitude = 35.6762
-    longitude = 139.6503
-    month = 7
-    week = 2
-    
-    # Encode
-    disaster_encoded = le_disaster.transform([disaster_type])[0]
-    location_encoded = le_location.transform([location])[0]
-    
-    # Calculate temporal features
-    quarter = (month - 1) // 3 + 1
-    is_summer = 1 if month in [6, 7, 8] else 0
-    is_winter = 1 if month in [12, 1, 2] else 0
-    
-    print(f"\n   Input: {disaster_type} in {location}")
-    print(f"   Coordinates: ({latitude}, {longitude})")
-    print(f"   Time: Month {month}, Week {week}")
-    
-    # Step 1: Predict parameters
-    param_features = np.array([[
-        disaster_encoded, location_encoded,
-        latitude, longitude,
-        month, week, quarter, is_summer, is_winter
-    ]])
-    param_features_scaled = scaler_parameters.transform(param_features)
-    
-    severity_level = max(1, min(10, int(severity_model.predict(param_features_scaled)[0])))
-    affected_population = max(0, int(population_model.predict(param_features_scaled)[0]))
-    economic_loss = max(0, float(economic_loss_model.predict(param_features_scaled)[0]))
-    
-    print(f"\n   Predicted Parameters:")
-    print(f"   - Severity: {severity_level}/10")
-    print(f"   - Population: {affected_population:,}")
-    print(f"   - Economic Loss: ${economic_loss:,.2f}")
-    
-    # Step 2: Major disaster prediction
-    day_of_year = 182  # approximate
-    disaster_input = np.array([[
-        disaster_encoded, location_encoded, latitude, longitude,
-        severity_level, affected_population, 0.5,
-        month, quarter, day_of_year
-    ]])
-    disaster_input_scaled = scaler_disaster.transform(disaster_input)
-    
-    is_major = bool(disaster_classifier.predict(disaster_input_scaled)[0])
-    major_probability = float(disaster_classifier.predict_proba(disaster_input_scaled)[0][1])
-    
-    print(f"\n   Major Disaster Prediction:")
-    print(f"   - Is Major: {is_major}")
-    print(f"   - Probability: {major_probability*100:.2f}%")
-    
-    # Step 3: Damage prediction
-    damage_input = np.array([[
-        disaster_encoded, location_encoded, latitude, longitude,
-        severity_level, affected_population, economic_loss,
-        month, quarter
-    ]])
-    damage_input_scaled = scaler_damage.transform(damage_input)
-    predicted_damage = float(damage_regressor.predict(damage_input_scaled)[0])
-    
-    print(f"   - Damage Index: {predicted_damage:.3f}")
-    
-    # Step 4: Response time prediction
-    response_input = np.array([[
-        disaster_encoded, location_encoded, latitude, longitude,
-        severity_level, affected_population, predicted_damage, economic_loss
-    ]])
-    response_input_scaled = scaler_response.transform(response_input)
-    predicted_response_time = float(response_regressor.predict(response_input_scaled)[0])
-    
-    print(f"   - Response Time: {predicted_response_time:.1f} hours")
-    
-    print("\n✓ All models working correctly!")
-    
+    from calibration import calibrate, fit_calibration
+    from inference_engine import historical_scenarios
+    history = historical_scenarios(DATA_PATH, rows=300)
+    raw = engine.predict_many(history)['major_probability']
+    labels = (np.random.default_rng(0).random(len(raw)) < raw).astype(int)
+    calibration = fit_calibration(raw, labels, 'isotonic')
+    threshold = float(np.median(calibrate(raw, calibration)))
+    decided = DisasterInferenceEngine(MODEL_DIR, artifacts=engine.artifacts)
+    decided.decision = {'threshold': threshold, 'calibration': calibration, 'fitted_at': 'test'}
+
+    # Batches of more than 256 rows use the sklearn models, smaller ones the compiled evaluator
+    for rows in (history, history[:200]):
+        records = decided.predict_many(rows)
+        assert np.allclose(records['major_probability'], calibrate(raw[:len(rows)], calibration)), \
+            "Probabilities are not calibrated"
+        assert np.array_equal(records['is_major_disaster'], records['major_probability'] >= threshold), \
+            "Decisions do not follow the threshold"
+    single = decided.predict_one(scenario)['predictions']
+    batch = decided.predict_many([decided.parse_scenario(scenario)])[0]
+    assert single['major_probability'] == round(batch['major_probability'] * 100, 2)
+    assert single['is_major_disaster'] == bool(batch['is_major_disaster'])
+    assert decided.model_version != engine.model_version, "Cache version ignores the decision rule"
+    print(f"   ✓ Calibrated probabilities and threshold {threshold:.3f} applied by the single and batch paths")
 except Exception as e:
-    print(f"\n✗ Error during prediction: {e}")
-    import traceback
-    traceback.print_exc()
+    print(f"   ✗ Error: {e}")
+    exit(1)
+
+print("\n7. Testing the micro-batch scheduler...")
+try:
+    from concurrent.futures import ThreadPoolExecutor
+    from batch_scheduler import MicroBatchScheduler
+    scheduler = MicroBatchScheduler(engine, max_batch_size=8, max_wait_ms=20)
+    requests = [dict(scenario, month=month) for month in range(1, 13)] * 2
+    with ThreadPoolExecutor(8) as pool:
+        batched = list(pool.map(scheduler.predict_one, requests))
+    assert batched == [engine.predict_one(request) for request in requests], "Micro-batched results differ"
+    stats = scheduler.stats()
+    scheduler.close()
+    assert stats['completed'] == len(requests) and stats['batches'] < len(requests), stats
+    print(f"   ✓ {len(requests)} concurrent requests answered in {stats['batches']} batches, "
+          f"identical to predict_one")
+except Exception as e:
+    print(f"   ✗ Error: {e}")
+    exit(1)
+
+print("\n8. Testing stage timing metrics...")
+try:
+    from metrics import Metrics
+    metrics = Metrics()
+    timed_engine = DisasterInferenceEngine(MODEL_DIR, artifacts=engine.artifacts, stage_observer=metrics.observe_stage)
+    metrics.begin_request()
+    assert timed_engine.predict_one(scenario) == result, "Timed prediction differs"
+    timings = metrics.end_request()
+    assert list(timings) == ['parse', 'parameters', 'assessment', 'response', 'rules', 'format'], list(timings)
+    text = metrics.render()
+    assert 'disaster_stage_seconds_bucket{stage="parse",le="+Inf"} 1' in text
+    assert 'disaster_stage_seconds_count{stage="assessment"} 1' in text
+    print(f"   ✓ {len(timings)} stages timed ({sum(timings.values()) * 1000:.2f} ms) and rendered for /metrics")
+except Exception as e:
+    print(f"   ✗ Error: {e}")
+    exit(1)
+
+print("\n9. Testing the parameter lookup table...")
+if engine.parameter_table is None:
+    print("   ⚠ parameter_table.pkl missing or stale - run `python parameter_table.py build`")
+else:
+    try:
+        latitude, longitude = engine.parameter_table.canonical_coordinates(engine.location_encoder.encode('Japan'))
+        live_engine = DisasterInferenceEngine(MODEL_DIR, artifacts=engine.artifacts)
+        live_engine.parameter_table = None
+        request = {'disaster_type': 'Earthquake', 'location': 'Japan', 'month': 7, 'week': 2, 'day_of_year': 182}
+        from_table = engine.predict_one(request)
+        live = live_engine.predict_one(dict(request, latitude=latitude, longitude=longitude))
+        assert from_table == live, "Table answer differs from the live parameter models"
+        print(f"   ✓ Canonical coordinates ({latitude}, {longitude}) answered from the table match the live models")
+    except Exception as e:
+        print(f"   ✗ Error: {e}")
+        exit(1)
+
+print("\n10. Testing the spatial event index...")
+if engine.event_index is None:
+    print("   ⚠ event_index.pkl missing - run `python spatial_index.py build`")
+else:
+    try:
+        index = engine.event_index
+        events = index.nearest(35.6762, 139.6503, k=5, disaster_type='Earthquake')
+        assert [event['disaster_type'] for event in events] == ['Earthquake'] * 5, "Wrong disaster type returned"
+
+        # Brute-force haversine distances over the same events
+        start, stop = index.offsets['Earthquake']
+        lat = np.radians(index.columns['latitude'][start:stop].astype(float))
+        lon = np.radians(index.columns['longitude'][start:stop].astype(float))
+        a = (np.sin((lat - np.radians(35.6762)) / 2) ** 2
+             + np.cos(lat) * np.cos(np.radians(35.6762)) * np.sin((lon - np.radians(139.6503)) / 2) ** 2)
+        expected = np.sort(2 * 6371.0088 * np.arcsin(np.sqrt(a)))[:5]
+        assert np.allclose([event['distance_km'] for event in events], expected, atol=1e-3), "Not the nearest events"
+
+        inferred = engine.predict_one({k: v for k, v in scenario.items() if k != 'location'})
+        assert inferred['input']['location'] == 'Japan' and inferred['input']['location_inferred']
+        assert inferred['predictions'] == result['predictions'], "Inferred location predicts differently"
+        print(f"   ✓ Nearest event {events[0]['distance_km']} km away; location inferred as Japan")
+    except Exception as e:
+        print(f"   ✗ Error: {e}")
+        exit(1)
+
+print("\n11. Testing bulk scoring...")
+try:
+    import os
+    import tempfile
+    import pandas as pd
+    from inference_engine import historical_scenarios, prediction_frame
+    from score import score_file
+
+    sample = pd.read_csv(DATA_PATH, nrows=600)
+    sample.loc[5, 'disaster_type'] = 'Meteor strike'
+    with tempfile.TemporaryDirectory() as tmp:
+        sample.to_csv(os.path.join(tmp, 'events.csv'), index=False)
+        scored, skipped, _ = score_file(os.path.join(tmp, 'events.csv'), os.path.join(tmp, 'scored.csv'),
+                                        MODEL_DIR, chunk_size=250)
+        output = pd.read_csv(os.path.join(tmp, 'scored.csv'))
+    assert (scored, skipped) == (599, 1), (scored, skipped)
+    expected = prediction_frame(engine.predict_many(historical_scenarios(DATA_PATH).iloc[:600].drop(index=5)))
+    assert output['event_id'].tolist() == sample['event_id'].drop(index=5).tolist(), "Rows out of order"
+    for column in ('severity_level', 'major_probability', 'predicted_damage_index', 'predicted_response_time_hours',
+                   'priority', 'temporary_shelters'):
+        assert output[column].tolist() == expected[column].tolist(), f"{column} differs from predict_many"
+    print(f"   ✓ {scored} rows scored in chunks of 250 match predict_many; the unknown disaster type was skipped")
+except Exception as e:
+    print(f"   ✗ Error: {e}")
+    exit(1)
+
+print("\n12. Testing scenario sweeps...")
+try:
+    from scenario_sweep import plan_sweep, run_sweep
+    # Explicit coordinates: without parameter_table.pkl a scenario has no canonical ones
+    base = {'disaster_type': 'Flood', 'location': 'India', 'latitude': 19.07, 'longitude': 72.88}
+    plan = plan_sweep(engine, base, {'month': {'start': 1, 'stop': 12}, 'week': [1, 4]})
+    cells = [row for _, frame in run_sweep(engine, plan, chunk_size=5) for row in frame.to_dict('records')]
+    assert len(cells) == 24, f"Expected 24 cells, got {len(cells)}"
+    for cell, (month, week) in zip(cells, [(m, w) for m in range(1, 13) for w in (1, 4)]):
+        expected = engine.predict_one(dict(base, month=month, week=week))['predictions']
+        for key, value in expected.items():
+            assert cell[key] == value, f"{key} of month {month}, week {week} differs from predict_one"
+    plan = plan_sweep(engine, base, {'severity_level': [1, 10]}, ['severity_level', 'major_probability'])
+    _, frame = next(run_sweep(engine, plan))
+    assert frame['severity_level'].tolist() == [1, 10], "Swept severity was replaced by the parameter stage"
+    try:
+        plan_sweep(engine, base, {'latitude': {'start': 0, 'stop': 1, 'num': 1000},
+                                  'longitude': {'start': 0, 'stop': 1, 'num': 1000}}, max_cells=10000)
+        raise AssertionError("The cell limit was not enforced")
+    except ValueError:
+        pass
+    print("   ✓ 24 month x week cells match predict_one; swept severity is kept; the cell limit is enforced")
+except Exception as e:
+    print(f"   ✗ Error: {e}")
+    exit(1)
+
+print("\n13. Testing columnar response formats...")
+try:
+    from response_formats import TIERS, batch_frame, json_columns
+    scenarios = [{'id': i, 'disaster_type': row.disaster_type, 'location': row.location, 'latitude': row.latitude,
+                  'longitude': row.longitude, 'month': int(row.month), 'week': int(row.week)}
+                 for i, row in enumerate(historical_scenarios(DATA_PATH, 200).itertuples())]
+    scenarios[7] = dict(scenarios[7], disaster_type='Meteor')
+    columns = json_columns(batch_frame(engine, scenarios))
+    for i, result in enumerate(engine.predict_stream(scenarios)):
+        assert columns['success'][i] == result['success'], f"Row {i} success differs"
+        if not result['success']:
+            assert columns['error'][i] == result['error'] and columns['severity_level'][i] is None
+            continue
+        for key, value in dict(result['input'], **result['predictions']).items():
+            assert columns[key][i] == value, f"{key} of row {i} differs from the nested response"
+        response = result['emergency_response']
+        assert TIERS['priority_tier'][columns['priority_tier'][i]]['alert_level'] == response['alert_level']
+        assert TIERS['resource_tier'][columns['resource_tier'][i]]['personnel'] == response['resources']['personnel']
+        assert TIERS['shelter_tier'][columns['shelter_tier'][i]]['equipment'] == response['resources']['equipment']
+        assert columns['people_to_evacuate'][i] == response['evacuation']['people_to_evacuate']
+        assert response['action_items'][2:] == TIERS['standard_action_items']
+    print("   ✓ Columnar rows and tier codes match the nested responses; the invalid scenario keeps its error")
+except Exception as e:
+    print(f"   ✗ Error: {e}")
+    exit(1)
+
+print("\n14. Testing the statistics cube...")
+try:
+    from stats_cube import StatsCube, build_cube
+    events = pd.read_csv(DATA_PATH)
+    events['month'] = pd.to_datetime(events['date']).dt.month
+    with open(DATA_PATH, 'rb') as f:
+        lines = f.read().splitlines(keepends=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'events.csv')
+        # A first load ending in a partly written line, then the rest appended
+        with open(path, 'wb') as f:
+            f.writelines(lines[:15001])
+            f.write(lines[15001][:20])
+        cube = build_cube([path])
+        cube.save(os.path.join(tmp, 'cube.npz'))
+        with open(path, 'ab') as f:
+            f.write(lines[15001][20:])
+            f.writelines(lines[15002:])
+        cube = StatsCube.load(os.path.join(tmp, 'cube.npz'))
+        added = cube.add_source(path)
+        full = build_cube([path])
+    assert added == len(lines) - 15001, f"{added} rows added by the update"
+    for name, array in full.arrays.items():
+        assert np.allclose(cube.arrays[name], array), f"{name} of the updated cube differs from a full build"
+
+    groups = cube.query({'location': ['India', 'japan']}, ['location', 'month'], [50, 90])
+    expected = events[events['location'].isin(['India', 'Japan'])].groupby(['location', 'month'])
+    assert [(group['location'], group['month']) for group in groups] == list(expected.groups), "Wrong groups"
+    assert [group['count'] for group in groups] == expected.size().tolist(), "Counts differ"
+    assert np.allclose([group['major_disaster_rate'] for group in groups],
+                       expected['is_major_disaster'].mean(), atol=1e-4), "Major disaster rates differ"
+    assert np.allclose([group['response_time_hours']['mean'] for group in groups],
+                       expected['response_time_hours'].mean(), atol=1e-4), "Mean response times differ"
+    # Percentiles come from 0.01-wide damage index bins and 0.5 h response time bins
+    assert np.allclose([group['infrastructure_damage_index']['p90'] for group in groups],
+                       expected['infrastructure_damage_index'].quantile(0.9), atol=0.02), "Damage p90 differs"
+    assert np.allclose([group['response_time_hours']['p50'] for group in groups],
+                       expected['response_time_hours'].median(), atol=0.5), "Median response times differ"
+    total = cube.query()
+    assert total[0]['count'] == len(events) and total[0]['economic_loss']['max'] == events[
+        'estimated_economic_loss_usd'].max()
+    print(f"   ✓ An appended update equals a full build; {len(groups)} location x month groups match pandas")
+except Exception as e:
+    print(f"   ✗ Error: {e}")
+    exit(1)
+
+print("\n15. Testing the geocoding stage...")
+try:
+    from geocoding import Gazetteer, Geocoder, StubBackend
+    rows = pd.DataFrame({
+        'location': ['Jakarta', 'jakarta ', 'Bandung', 'Kathmandu, Lalitpur', 'Atlantis', 'Lalitpur', 'Bandung', None],
+        'latitude': [np.nan, np.nan, -6.92, np.nan, np.nan, np.nan, np.nan, np.nan],
+        'longitude': [np.nan, np.nan, 107.61, np.nan, np.nan, np.nan, np.nan, np.nan],
+    })
+    backend = StubBackend({'Jakarta': (-6.2, 106.85), 'Kathmandu, Lalitpur': (27.7, 85.3), 'Lalitpur': (27.67, 85.32)},
+                          delay=0.02)
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_path = os.path.join(tmp, 'geocode.sqlite')
+        geocoder = Geocoder(cache_path, Gazetteer.from_frame(rows), backend, concurrency=2)
+        counts = geocoder.fill(rows)
+        geocoder.close()
+        assert sorted(backend.calls) == ['atlantis', 'jakarta', 'kathmandu, lalitpur', 'lalitpur'], backend.calls
+        assert backend.max_active <= 2, "Concurrency limit exceeded"
+        assert (counts['gazetteer'], counts['rows_filled'], counts['rows_missing']) == (1, 5, 2), counts
+        assert rows.loc[1, 'latitude'] == -6.2 and rows.loc[5, 'longitude'] == 85.32
+        assert rows.loc[6, 'latitude'] == -6.92, "Bandung not taken from the other rows of the sheet"
+
+        # A second run is answered from the cache, misses included
+        offline = Geocoder(cache_path, backend=StubBackend())
+        results, counts = offline.resolve(['JAKARTA', 'Atlantis', 'Bandung'])
+        offline.close()
+        assert offline.backend.calls == [] and counts['cache'] == 2 and counts['unresolved'] == 1, counts
+        assert results['jakarta'] == (-6.2, 106.85)
+    # Multi-place strings fall back to the centroid of their known parts
+    gazetteer = Gazetteer({'kathmandu': (27.7, 85.3), 'lalitpur': (27.5, 85.5)})
+    assert gazetteer.lookup('kathmandu, lalitpur') == (27.6, 85.4)
+    print("   ✓ Each distinct location was looked up once, 2 at a time; the second run came from the cache")
+except Exception as e:
+    print(f"   ✗ Error: {e}")
+    exit(1)
+
+print("\n16. Testing the drift monitor...")
+try:
+    from drift_monitor import DriftMonitor, reference_stats
+    history = historical_scenarios(DATA_PATH)
+    reference = reference_stats(history, DATA_PATH)
+    monitor = DriftMonitor(engine, reference, shadow=engine)
+    live = history.sample(400, random_state=1)[['disaster_type', 'location', 'latitude', 'longitude', 'month',
+                                                  'week', 'day_of_year']]
+    for data in live.to_dict('records'):
+        data = {key: value.item() if hasattr(value, 'item') else value for key, value in data.items()}
+        monitor.observe(data, engine.predict_one(data))
+    monitor.flush()
+    report = monitor.report()
+    assert report['monitor']['observed'] == 400 and not report['drifted_features'], report['drifted_features']
+    assert report['features']['severity_level']['effective_observations'] == 0, "Predicted severity was compared"
+    shadow = report['shadow']
+    assert shadow['scored'] == 400 and shadow['agreement'] == {'is_major_disaster': 1.0, 'priority': 1.0}
+    assert all(delta['max_abs'] == 0 for delta in shadow['deltas'].values()), "Identical models disagree"
+
+    # Traffic from two locations only
+    shifted = history[history['location'].isin(['Japan', 'Chile'])].head(1000)
+    monitor.update({name: shifted[name].tolist() for name in ('location', 'latitude')})
+    report = monitor.report()
+    assert {'location', 'latitude'} <= set(report['drifted_features']), report['drifted_features']
+    monitor.close()
+
+    # A full queue drops observations instead of blocking the request
+    stopped = DriftMonitor(engine, reference, max_queue=5)
+    stopped.close()
+    accepted = [stopped.observe(data, result) for _ in range(8)]
+    assert accepted == [True] * 5 + [False] * 3 and stopped.report()['monitor']['dropped'] == 3
+    print("   ✓ Training-like traffic is stable, location drift is flagged; the shadow copy agrees; "
+          "a full queue drops")
+except Exception as e:
+    print(f"   ✗ Error: {e}")
+    exit(1)
+
+print("\n17. Testing compact model variants...")
+try:
+    from compact_models import prune
+    from inference_engine import historical_stage_inputs
+    X = engine.scale_stage_input('parameters', historical_stage_inputs(engine, DATA_PATH, rows=200)['parameters'])
+    boosting, forest = engine.severity_model, engine.population_model
+    n_stages, n_trees = len(boosting.estimators_), len(forest.estimators_)
+    staged = list(boosting.staged_predict(X))[19]
+    assert np.allclose(prune(boosting, 20).predict(X), staged), "Pruned boosting differs from its first 20 stages"
+    averaged = np.mean([tree.predict(X) for tree in forest.estimators_[:10]], axis=0)
+    assert np.allclose(prune(forest, 10).predict(X), averaged), "Pruned forest differs from its first 10 trees"
+    assert len(boosting.estimators_) == n_stages and len(forest.estimators_) == n_trees, "Full models were modified"
+    print("   ✓ Pruned boosting and forest variants match the full models' first stages / trees")
+except Exception as e:
+    print(f"   ✗ Error: {e}")
+    exit(1)
+
+print("\n18. Testing the model bundle...")
+try:
+    import os
+    import tempfile
+    from inference_engine import historical_scenarios
+    from model_bundle import BundleError, load_bundle, write_bundle
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'models.bundle')
+        write_bundle(DisasterInferenceEngine(MODEL_DIR, backend='sklearn', lazy=False), path)
+        bundled = DisasterInferenceEngine(path)
+        scenarios = historical_scenarios(DATA_PATH, 300)
+        directory = DisasterInferenceEngine(MODEL_DIR, backend='compiled', compiled_max_batch=len(scenarios))
+        assert np.array_equal(bundled.predict_many(scenarios), directory.predict_many(scenarios)), \
+            "Bundle predictions differ from the compiled models"
+        scenario = {'disaster_type': 'Flood', 'location': 'India', 'severity_level': 7}
+        assert bundled.predict_one(scenario) == directory.predict_one(scenario), "predict_one differs"
+        with open(path, 'r+b') as f:
+            f.seek(-100, os.SEEK_END)
+            byte = f.read(1)
+            f.seek(-100, os.SEEK_END)
+            f.write(bytes([byte[0] ^ 0xFF]))
+        try:
+            load_bundle(path)
+            raise AssertionError("A corrupted array was not detected")
+        except BundleError:
+            pass
+    print("   ✓ Bundle predictions match the compiled models; a corrupted byte fails the checksum")
+except Exception as e:
+    print(f"   ✗ Error: {e}")
+    exit(1)
+
+print("\n19. Checking the compiled tree evaluator against the sklearn models...")
+try:
+    from tree_compiler import verify
+    if not verify(DisasterInferenceEngine(MODEL_DIR, backend='sklearn'), DATA_PATH, rows=1000):
+        raise AssertionError("Compiled outputs on raw input differ from scaler + predict / predict_proba")
+    print("   ✓ Compiled outputs on raw input are identical to scaler + predict / predict_proba")
+except Exception as e:
+    print(f"   ✗ Error: {e}")
     exit(1)
 
 print("\n" + "="*70)
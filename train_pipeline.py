@@ -0,0 +1,368 @@
+"""
+Training Pipeline
+Loads and featurizes the preprocessed dataset once, fits the six cascade models
+concurrently in a process pool and writes every artifact plus
+model_metadata.pkl atomically to the model directory
+
+Usage:
+    python train_pipeline.py [--data CSV] [--model-dir saved_models] [--cpus N]
+                             [--models NAME ...] [--search N] [--hist] [--early-stopping]
+
+Defaults reproduce the hyperparameters of model.ipynb and train_params_quick.py.
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import (GradientBoostingRegressor, HistGradientBoostingRegressor,
+                              RandomForestClassifier, RandomForestRegressor)
+from sklearn.metrics import accuracy_score, mean_absolute_error, r2_score
+from sklearn.model_selection import RandomizedSearchCV, train_test_split
+from sklearn.preprocessing import LabelEncoder, StandardScaler
+
+from drift_monitor import reference_stats
+from inference_engine import DATA_PATH, MODEL_DIR, MODEL_FILES, historical_scenarios
+
+RANDOM_STATE = 42
+TEST_SIZE = 0.2
+
+# Training columns of each feature set (same order as the inference engine's
+# stage inputs) and the scaler fitted on it
+FEATURE_SETS = {
+    'disaster': ['disaster_type_encoded', 'location_encoded', 'latitude', 'longitude',
+                 'severity_level', 'affected_population', 'infrastructure_damage_index',
+                 'month', 'quarter', 'day_of_year'],
+    'damage': ['disaster_type_encoded', 'location_encoded', 'latitude', 'longitude',
+               'severity_level', 'affected_population', 'estimated_economic_loss_usd',
+               'month', 'quarter'],
+    'response': ['disaster_type_encoded', 'location_encoded', 'latitude', 'longitude',
+                 'severity_level', 'affected_population', 'infrastructure_damage_index',
+                 'estimated_economic_loss_usd'],
+    'parameters': ['disaster_type_encoded', 'location_encoded', 'latitude', 'longitude',
+                   'month', 'week', 'quarter', 'is_summer', 'is_winter'],
+}
+SCALERS = {
+    'disaster': 'scaler_disaster',
+    'damage': 'scaler_damage',
+    'response': 'scaler_response',
+    'parameters': 'scaler_parameters',
+}
+
+FOREST_SEARCH = {
+    'n_estimators': [100, 200, 300],
+    'max_depth': [10, 15, 20, None],
+    'min_samples_split': [2, 5, 10],
+    'min_samples_leaf': [1, 2, 4],
+    'max_features': ['sqrt', 1.0],
+}
+BOOSTING_SEARCH = {
+    'n_estimators': [100, 200, 400],
+    'learning_rate': [0.03, 0.05, 0.1, 0.2],
+    'max_depth': [3, 5, 7],
+    'subsample': [0.8, 1.0],
+}
+HIST_SEARCH = {
+    'learning_rate': [0.03, 0.05, 0.1, 0.2],
+    'max_depth': [None, 5, 7, 10],
+    'max_leaf_nodes': [15, 31, 63],
+    'l2_regularization': [0.0, 0.1, 1.0],
+}
+
+# Model artifact -> (feature set, target column, estimator class, default hyperparameters, search space)
+MODEL_SPECS = {
+    'disaster_classifier': ('disaster', 'is_major_disaster', RandomForestClassifier,
+                            dict(n_estimators=100, max_depth=15, min_samples_split=10, min_samples_leaf=4),
+                            FOREST_SEARCH),
+    'damage_regressor': ('damage', 'infrastructure_damage_index', RandomForestRegressor,
+                         dict(n_estimators=100, max_depth=15, min_samples_split=10, min_samples_leaf=4),
+                         FOREST_SEARCH),
+    'response_regressor': ('response', 'response_time_hours', RandomForestRegressor,
+                           dict(n_estimators=100, max_depth=15, min_samples_split=10, min_samples_leaf=4),
+                           FOREST_SEARCH),
+    'severity_model': ('parameters', 'severity_level', GradientBoostingRegressor,
+                       dict(n_estimators=200, learning_rate=0.1, max_depth=5), BOOSTING_SEARCH),
+    'population_model': ('parameters', 'affected_population', RandomForestRegressor,
+                         dict(n_estimators=200, max_depth=15), FOREST_SEARCH),
+    'economic_loss_model': ('parameters', 'estimated_economic_loss_usd', GradientBoostingRegressor,
+                            dict(n_estimators=200, learning_rate=0.1, max_depth=7), BOOSTING_SEARCH),
+}
+PARAMETER_MODELS = ['severity_model', 'population_model', 'economic_loss_model']
+
+
+def load_training_frame(data_path, encoders=None):
+    """
+    Read the preprocessed dataset and add every feature column used by the
+    models. encoders ({'le_disaster', 'le_location', 'le_aid'}) are fitted here
+    unless given.
+    """
+    df = pd.read_csv(data_path)
+    df['date'] = pd.to_datetime(df['date'])
+    df['month'] = df['date'].dt.month
+    df['day_of_year'] = df['date'].dt.dayofyear
+    df['quarter'] = df['date'].dt.quarter
+    df['week'] = df['date'].dt.isocalendar().week.astype(int) % 4 + 1
+    df['is_summer'] = df['month'].isin([6, 7, 8]).astype(int)
+    df['is_winter'] = df['month'].isin([12, 1, 2]).astype(int)
+
+    if encoders is None:
+        encoders = {
+            'le_disaster': LabelEncoder().fit(df['disaster_type']),
+            'le_location': LabelEncoder().fit(df['location']),
+            'le_aid': LabelEncoder().fit(df['aid_provided']),
+        }
+    df['disaster_type_encoded'] = encoders['le_disaster'].transform(df['disaster_type'])
+    df['location_encoded'] = encoders['le_location'].transform(df['location'])
+    df['aid_provided_encoded'] = encoders['le_aid'].transform(df['aid_provided'])
+    return df, encoders
+
+
+def recorded_split(metadata, names, test_size=None, random_state=None):
+    """
+    (test_size, random_state) of the train / test split the models names were
+    trained on, from metadata['training']['splits'], so held-out scores are
+    computed on rows none of them saw. The models must share one split. Models
+    without a recorded split (trained before it was recorded, e.g. by the
+    notebook) need it given explicitly (a warning is printed); otherwise
+    ValueError is raised.
+    """
+    splits = (metadata.get('training') or {}).get('splits', {})
+    recorded = {(splits[name]['test_size'], splits[name]['random_state']) for name in names if name in splits}
+    missing = [name for name in names if name not in splits]
+    if len(recorded) > 1:
+        raise ValueError(f"{', '.join(names)} were trained on different splits {sorted(recorded)}; "
+                         f"score them separately")
+    if not missing:
+        split = recorded.pop()
+        if (test_size, random_state) != (None, None) and (test_size, random_state) != split:
+            print(f"⚠ Using the recorded training split (test_size={split[0]}, random_state={split[1]}); "
+                  f"the given split is ignored")
+        return split
+    if test_size is None or random_state is None:
+        raise ValueError(f"model_metadata.pkl does not record the training split of {', '.join(missing)}; "
+                         f"retrain with train_pipeline.py or give the split the models were trained with "
+                         f"(--test-size and --random-state)")
+    if recorded and recorded.pop() != (test_size, random_state):
+        raise ValueError(f"The given split (test_size={test_size}, random_state={random_state}) differs from "
+                         f"the one recorded for the other models; score them separately")
+    print(f"⚠ model_metadata.pkl does not record the training split of {', '.join(missing)}; assuming "
+          f"test_size={test_size}, random_state={random_state}. Held-out scores are wrong if they were "
+          f"trained on another split")
+    return test_size, random_state
+
+
+def build_estimator(name, hist=False, early_stopping=False, random_state=RANDOM_STATE):
+    """Unfitted estimator and search space for a model artifact"""
+    _, _, estimator_class, params, search_space = MODEL_SPECS[name]
+    params = dict(params, random_state=random_state)
+    if estimator_class is GradientBoostingRegressor:
+        if hist:
+            estimator_class, search_space = HistGradientBoostingRegressor, HIST_SEARCH
+            params = dict(max_iter=params['n_estimators'], learning_rate=params['learning_rate'],
+                          max_depth=params['max_depth'], early_stopping=True, random_state=random_state)
+        elif early_stopping:
+            params.update(n_iter_no_change=10, validation_fraction=0.1)
+    return estimator_class(**params), search_space
+
+
+def fit_model(name, X, y, n_jobs=1, search=0, hist=False, early_stopping=False, random_state=RANDOM_STATE):
+    """
+    Fit one model (optionally through a randomized search with 3-fold CV).
+    Runs in a worker process; returns (name, fitted model, best params, seconds).
+    """
+    start = time.perf_counter()
+    estimator, search_space = build_estimator(name, hist, early_stopping, random_state)
+    if 'n_jobs' in estimator.get_params():
+        estimator.set_params(n_jobs=n_jobs)
+
+    best_params = None
+    if search:
+        searcher = RandomizedSearchCV(estimator, search_space, n_iter=search, cv=3,
+                                      n_jobs=n_jobs, random_state=random_state)
+        searcher.fit(X, y)
+        model, best_params = searcher.best_estimator_, searcher.best_params_
+    else:
+        model = estimator.fit(X, y)
+
+    # Saved forests predict on every core, as the notebook's models did
+    if 'n_jobs' in model.get_params():
+        model.set_params(n_jobs=-1)
+    return name, model, best_params, time.perf_counter() - start
+
+
+def cpu_plan(n_models, cpus):
+    """(worker processes, threads per model) for a CPU budget"""
+    workers = max(1, min(n_models, cpus))
+    return workers, max(1, cpus // workers)
+
+
+def evaluate(name, model, X, y):
+    prediction = model.predict(X)
+    if MODEL_SPECS[name][2] is RandomForestClassifier:
+        return {'accuracy': float(accuracy_score(y, prediction))}
+    return {'r2': float(r2_score(y, prediction)), 'mae': float(mean_absolute_error(y, prediction))}
+
+
+def write_artifacts(artifacts, model_dir):
+    """
+    Dump every artifact to a temporary directory inside model_dir, then move
+    each file into place with os.replace. model_metadata.pkl goes last, so
+    readers never see a new training_date next to old models.
+    """
+    os.makedirs(model_dir, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix='.training-', dir=model_dir)
+    try:
+        names = sorted(artifacts, key=lambda name: name == 'metadata')
+        for name in names:
+            joblib.dump(artifacts[name], os.path.join(staging, MODEL_FILES[name]))
+        for name in names:
+            filename = MODEL_FILES[name]
+            os.replace(os.path.join(staging, filename), os.path.join(model_dir, filename))
+            print(f"Saved: {filename:<35} ({os.path.getsize(os.path.join(model_dir, filename)) / 1024:.2f} KB)")
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def train(data_path=DATA_PATH, model_dir=MODEL_DIR, models=None, cpus=None, search=0, hist=False,
+          early_stopping=False, random_state=RANDOM_STATE):
+    """
+    Train the given models (default: all six) and write them with their scalers,
+    the label encoders and updated metadata. Training a subset keeps the saved
+    label encoders so the new models stay compatible with the others.
+    Returns the metadata dict.
+    """
+    models = list(models or MODEL_SPECS)
+    cpus = cpus or os.cpu_count() or 1
+    start = time.perf_counter()
+
+    metadata_path = os.path.join(model_dir, MODEL_FILES['metadata'])
+    partial = set(models) != set(MODEL_SPECS)
+    if partial:
+        encoders = {name: joblib.load(os.path.join(model_dir, MODEL_FILES[name]))
+                    for name in ('le_disaster', 'le_location', 'le_aid')}
+        metadata = joblib.load(metadata_path) if os.path.exists(metadata_path) else {}
+    else:
+        encoders, metadata = None, {}
+
+    print(f"Loading {data_path}...")
+    df, encoders = load_training_frame(data_path, encoders)
+
+    # One split shared by every model, stratified on the major disaster label
+    train_idx, test_idx = train_test_split(np.arange(len(df)), test_size=TEST_SIZE,
+                                           random_state=random_state, stratify=df['is_major_disaster'])
+
+    artifacts = {} if partial else dict(encoders)
+    inputs = {}
+    for feature_set in {MODEL_SPECS[name][0] for name in models}:
+        X = df[FEATURE_SETS[feature_set]].to_numpy(dtype=np.float64)
+        scaler = StandardScaler().fit(X[train_idx])
+        artifacts[SCALERS[feature_set]] = scaler
+        inputs[feature_set] = scaler.transform(X)
+
+    workers, threads = cpu_plan(len(models), cpus)
+    print(f"Training {len(models)} models with {workers} worker process(es) x {threads} thread(s)"
+          f"{f', randomized search of {search} candidates' if search else ''}...")
+
+    jobs = {}
+    for name in models:
+        feature_set, target = MODEL_SPECS[name][:2]
+        jobs[name] = (inputs[feature_set][train_idx], df[target].to_numpy()[train_idx])
+
+    results = {}
+    if workers == 1:
+        for name, (X, y) in jobs.items():
+            results[name] = fit_model(name, X, y, threads, search, hist, early_stopping, random_state)[1:]
+            print(f"✓ {name} trained in {results[name][2]:.1f}s")
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(fit_model, name, X, y, threads, search, hist, early_stopping, random_state)
+                       for name, (X, y) in jobs.items()]
+            for future in as_completed(futures):
+                name, model, best_params, seconds = future.result()
+                results[name] = (model, best_params, seconds)
+                print(f"✓ {name} trained in {seconds:.1f}s")
+
+    scores, hyperparameters = {}, {}
+    for name in models:
+        model, best_params, _ = results[name]
+        artifacts[name] = model
+        feature_set, target = MODEL_SPECS[name][:2]
+        scores[name] = evaluate(name, model, inputs[feature_set][test_idx], df[target].to_numpy()[test_idx])
+        hyperparameters[name] = best_params or {
+            key: value for key, value in model.get_params().items() if key in MODEL_SPECS[name][3]
+        }
+
+    metadata.update({
+        'training_date': pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'dataset_size': len(df),
+        'feature_columns': {
+            'disaster_prediction': FEATURE_SETS['disaster'],
+            'damage_assessment': FEATURE_SETS['damage'],
+            'response_optimization': FEATURE_SETS['response'],
+            'parameter_prediction': FEATURE_SETS['parameters'],
+        },
+        'disaster_types': encoders['le_disaster'].classes_.tolist(),
+        'locations': encoders['le_location'].classes_.tolist(),
+        # Training distribution the drift monitor compares live traffic with
+        'reference_stats': reference_stats(historical_scenarios(data_path), data_path),
+    })
+    metadata.setdefault('model_scores', {}).update(scores)
+    metadata.setdefault('hyperparameters', {}).update(hyperparameters)
+    if 'disaster_classifier' in scores:
+        metadata['model_accuracy'] = scores['disaster_classifier']['accuracy']
+    if 'damage_regressor' in scores:
+        metadata['damage_r2_score'] = scores['damage_regressor']['r2']
+    if 'response_regressor' in scores:
+        metadata['response_r2_score'] = scores['response_regressor']['r2']
+    # Split of every model trained by this run; models kept from earlier runs keep theirs (or none)
+    splits = dict((metadata.get('training') or {}).get('splits', {}))
+    splits.update({name: {'test_size': TEST_SIZE, 'random_state': random_state, 'data_path': data_path}
+                   for name in models})
+    metadata['training'] = {
+        'data_path': data_path,
+        'models': models,
+        'splits': splits,
+        'cpus': cpus,
+        'search_candidates': search,
+        'hist_gradient_boosting': hist,
+        'early_stopping': early_stopping,
+        'seconds': round(time.perf_counter() - start, 2),
+    }
+    artifacts['metadata'] = metadata
+
+    write_artifacts(artifacts, model_dir)
+    print(f"\n✓ Training finished in {metadata['training']['seconds']:.1f}s")
+    for name, score in scores.items():
+        print(f"   {name:<22}" + ", ".join(f"{key}={value:.4f}" for key, value in score.items()))
+    return metadata
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default=DATA_PATH)
+    parser.add_argument('--model-dir', default=MODEL_DIR)
+    parser.add_argument('--models', nargs='+', choices=list(MODEL_SPECS), default=None,
+                        help="Train only these models (default: all six)")
+    parser.add_argument('--cpus', type=int, default=None, help="CPU budget (default: all cores)")
+    parser.add_argument('--search', type=int, default=0, metavar='N',
+                        help="Randomized search over N candidates per model with 3-fold CV")
+    parser.add_argument('--hist', action='store_true',
+                        help="HistGradientBoosting (with early stopping) instead of GradientBoosting; "
+                             "these models cannot be compiled by tree_compiler.py")
+    parser.add_argument('--early-stopping', action='store_true',
+                        help="Stop GradientBoosting after 10 rounds without validation improvement")
+    parser.add_argument('--seed', type=int, default=RANDOM_STATE)
+    args = parser.parse_args(argv)
+
+    train(args.data, args.model_dir, args.models, args.cpus, args.search, args.hist,
+          args.early_stopping, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,457 @@
+"""
+Tree Compiler
+Flattens the RandomForest / GradientBoosting ensembles of the prediction cascade
+into contiguous node arrays and evaluates them with a pure-NumPy traversal that
+advances every tree of a group one level at a time for the whole batch
+
+Outputs are bit-for-bit identical to sklearn's predict / predict_proba with
+n_jobs=1 (trees are accumulated in the same order with the same arithmetic).
+By default the StandardScaler of every stage is folded into the split
+thresholds, so the compiled stages take raw (unscaled) features.
+
+Usage:
+    python tree_compiler.py compile [--model-dir saved_models] [--keep-scalers]
+    python tree_compiler.py verify  [--model-dir saved_models] [--data CSV] [--rows N]
+"""
+
+import argparse
+import os
+import time
+
+import joblib
+import numpy as np
+from sklearn.ensemble import GradientBoostingRegressor, RandomForestClassifier, RandomForestRegressor
+
+COMPILED_FORMAT_VERSION = 1
+
+# Largest (trees x samples) block traversed at once; keeps the index arrays in cache
+BLOCK_ELEMENTS = 1 << 18
+
+
+class CompiledEnsemble:
+    """
+    A group of tree ensembles that read the same input matrix, stored as one set
+    of node arrays. Leaves point to themselves, so after as many levels as a
+    tree is deep every row sits on its leaf.
+
+    Node arrays (one entry per node, all trees concatenated):
+        feature   int32    input column tested at the node (0 for leaves)
+        threshold float64  go left when x <= threshold
+        children  int32    (2 * n_nodes,) global index of the left child at
+                           2 * node and of the right child at 2 * node + 1
+                           (both are the node itself for leaves)
+        value     float64  (n_nodes, width) leaf outputs, already multiplied by
+                           the learning rate for gradient boosting members
+    Tree arrays:
+        roots     int32    global index of each tree's root
+        depth     int32    depth of each tree
+    Input:
+        input_dtype    dtype the input is cast to before traversal (float32 like
+                       sklearn, float64 once scalers are folded in)
+        folded_scalers True when thresholds are in raw feature units
+    """
+
+    def __init__(self, arrays, members):
+        self.arrays = arrays
+        self.members = members
+        self.feature = arrays['feature']
+        self.threshold = arrays['threshold']
+        self.children = arrays['children']
+        self.value = arrays['value']
+        self.roots = arrays['roots']
+        self.n_features = int(max(member['n_features'] for member in members))
+        self.input_dtype = np.dtype(arrays.get('input_dtype', np.array('float32')).item())
+        self.folded_scalers = bool(arrays.get('folded_scalers', np.array(False)))
+
+        # Deepest trees first: level d only has to advance the trees deeper than d
+        depth = arrays['depth']
+        self._tree_order = np.argsort(-depth, kind='stable')
+        self._sorted_roots = self.roots[self._tree_order]
+        self._active_per_level = [int(np.sum(depth > level)) for level in range(int(depth.max()))]
+
+    def to_dict(self):
+        return {'arrays': self.arrays, 'members': self.members}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['arrays'], data['members'])
+
+    def _leaves(self, X):
+        """Global leaf index reached by every tree for every row: (n_trees, n_samples)"""
+        n = X.shape[0]
+        n_trees = len(self.roots)
+        leaves = np.empty((n_trees, n), dtype=np.int32)
+        block = max(1, BLOCK_ELEMENTS // n_trees)
+        for start in range(0, n, block):
+            stop = min(start + block, n)
+            size = stop - start
+            # Feature-major copy of the block so one flat gather reads every tree's input
+            columns = np.ascontiguousarray(X[start:stop].T).ravel()
+            sample = np.arange(size, dtype=np.int32)
+            node = np.repeat(self._sorted_roots[:, None], size, axis=1)
+            for active in self._active_per_level:
+                current = node[:active]
+                x = columns[self.feature[current] * size + sample]
+                current[...] = self.children[2 * current + (x > self.threshold[current])]
+            leaves[self._tree_order, start:stop] = node
+        return leaves
+
+    def evaluate(self, X):
+        """
+        Evaluate every member on X and return {member name: output}.
+        Regressors give (n_samples,) predictions, classifiers (n_samples, n_classes)
+        probabilities (see predict for class labels).
+        """
+        X = np.asarray(X)
+        if X.ndim != 2 or X.shape[1] < self.n_features:
+            raise ValueError(f"Expected a 2-D input with {self.n_features} columns, got shape {X.shape}")
+        # Same input rounding as sklearn trees (float32) unless scalers were folded in
+        X = X.astype(self.input_dtype, copy=False)
+        n = X.shape[0]
+        leaf_values = self.value[self._leaves(X)]
+
+        outputs = {}
+        for member in self.members:
+            values = leaf_values[member['tree_start']:member['tree_stop'], :, :member['width']]
+            if member['kind'] == 'gradient_boosting':
+                # raw = init, then raw += learning_rate * tree value, stage by stage
+                init = np.full((1, n, 1), member['init'])
+                outputs[member['name']] = np.cumsum(np.concatenate([init, values]), axis=0)[-1][:, 0]
+            else:
+                # Trees summed in order, then divided by the number of trees
+                total = np.cumsum(values, axis=0)[-1]
+                total /= member['tree_stop'] - member['tree_start']
+                outputs[member['name']] = total if member['kind'] == 'forest_classifier' else total[:, 0]
+        return outputs
+
+    def predict(self, X, name):
+        """Regression output or class labels for one member"""
+        output = self.evaluate(X)[name]
+        member = self.member(name)
+        if member['kind'] == 'forest_classifier':
+            return np.asarray(member['classes']).take(output.argmax(axis=1))
+        return output
+
+    def member(self, name):
+        for member in self.members:
+            if member['name'] == name:
+                return member
+        raise KeyError(name)
+
+
+def _ensemble_trees(model):
+    """Return (kind, trees, per-tree value transform, extra member info) for a fitted model"""
+    if isinstance(model, RandomForestClassifier):
+        if model.n_outputs_ != 1:
+            raise NotImplementedError("Multi-output forests are not supported")
+        return 'forest_classifier', [e.tree_ for e in model.estimators_], None, {
+            'classes': model.classes_.tolist(),
+            'width': int(model.n_classes_),
+        }
+    if isinstance(model, RandomForestRegressor):
+        if model.n_outputs_ != 1:
+            raise NotImplementedError("Multi-output forests are not supported")
+        return 'forest_regressor', [e.tree_ for e in model.estimators_], None, {'width': 1}
+    if isinstance(model, GradientBoostingRegressor):
+        if model.loss != 'squared_error':
+            raise NotImplementedError(f"Gradient boosting loss '{model.loss}' is not supported")
+        if model.init_ == 'zero':
+            init = 0.0
+        elif hasattr(model.init_, 'constant_'):
+            init = float(np.ravel(model.init_.constant_)[0])
+        else:
+            raise NotImplementedError("Only constant (DummyRegressor) init estimators are supported")
+        return 'gradient_boosting', [e.tree_ for e in model.estimators_[:, 0]], model.learning_rate, {
+            'init': init,
+            'width': 1,
+        }
+    raise TypeError(f"Cannot compile {type(model).__name__}; expected a RandomForest or GradientBoostingRegressor")
+
+
+def compile_ensembles(models, column_maps=None):
+    """
+    Flatten fitted ensembles that share one input matrix into a CompiledEnsemble.
+
+    models      - {name: fitted RandomForestClassifier / RandomForestRegressor /
+                  GradientBoostingRegressor}, evaluated together
+    column_maps - optional {name: sequence} mapping each model's feature index to
+                  a column of the shared input (default: identity)
+    """
+    column_maps = column_maps or {}
+    feature, threshold, children, value, roots, depth, members = [], [], [], [], [], [], []
+    node_offset = 0
+    tree_count = 0
+    width = max(_ensemble_trees(model)[3]['width'] for model in models.values())
+
+    for name, model in models.items():
+        kind, trees, scale, info = _ensemble_trees(model)
+        column_map = np.asarray(column_maps.get(name, np.arange(model.n_features_in_)), dtype=np.int32)
+        for tree in trees:
+            n_nodes = tree.node_count
+            own = np.arange(node_offset, node_offset + n_nodes, dtype=np.int32)
+            is_leaf = tree.children_left == -1
+
+            tree_feature = column_map[np.where(is_leaf, 0, tree.feature)]
+            tree_feature[is_leaf] = 0
+            tree_value = np.zeros((n_nodes, width))
+            if kind == 'forest_classifier':
+                tree_value[:, :info['width']] = tree.value[:, 0, :info['width']]
+            else:
+                tree_value[:, 0] = tree.value[:, 0, 0]
+                if scale is not None:
+                    tree_value[:, 0] = scale * tree_value[:, 0]
+
+            feature.append(tree_feature.astype(np.int32))
+            threshold.append(tree.threshold.astype(np.float64))
+            children.append(np.column_stack([
+                np.where(is_leaf, own, tree.children_left + node_offset),
+                np.where(is_leaf, own, tree.children_right + node_offset),
+            ]).astype(np.int32).ravel())
+            value.append(tree_value)
+            roots.append(node_offset)
+            depth.append(tree.max_depth)
+            node_offset += n_nodes
+
+        members.append(dict(info, **{
+            'name': name,
+            'kind': kind,
+            'tree_start': tree_count,
+            'tree_stop': tree_count + len(trees),
+            'n_features': int(column_map.max()) + 1,
+        }))
+        tree_count += len(trees)
+
+    arrays = {
+        'feature': np.concatenate(feature),
+        'threshold': np.concatenate(threshold),
+        'children': np.concatenate(children),
+        'value': np.concatenate(value),
+        'roots': np.asarray(roots, dtype=np.int32),
+        'depth': np.asarray(depth, dtype=np.int32),
+        'input_dtype': np.array('float32'),
+    }
+    return CompiledEnsemble(arrays, members)
+
+
+def _ordered_keys(values):
+    """Map float64 values to int64 keys with the same order (-0.0 and 0.0 share a key)"""
+    bits = values.view(np.int64)
+    return np.where(bits >= 0, bits, -(bits & np.int64(0x7FFFFFFFFFFFFFFF)))
+
+
+def _from_ordered_keys(keys):
+    bits = np.where(keys >= 0, keys, (-keys) | np.int64(-0x8000000000000000))
+    return bits.view(np.float64)
+
+
+def _raw_thresholds(threshold, mean, scale):
+    """
+    Largest raw value x with float32((x - mean) / scale) <= threshold, element-wise.
+
+    The scaled and rounded value is non-decreasing in x, so the rows that go
+    left are exactly those with x <= result. Found by bisection over the
+    ordered bit patterns of float64, which gives the exact boundary rather than
+    the rounded threshold * scale + mean. -inf / inf when no / every finite x
+    goes left.
+    """
+    def goes_left(keys):
+        with np.errstate(over='ignore', invalid='ignore'):
+            scaled = (_from_ordered_keys(keys) - mean) / scale
+            return scaled.astype(np.float32) <= threshold
+
+    lo = np.full(threshold.shape, _ordered_keys(np.array([-np.finfo(np.float64).max]))[0])
+    hi = np.full(threshold.shape, _ordered_keys(np.array([np.finfo(np.float64).max]))[0])
+    none_left = ~goes_left(lo)
+    all_left = goes_left(hi)
+    # Invariant: goes_left(lo) and not goes_left(hi)
+    search = ~(none_left | all_left)
+    while True:
+        open_ = search & (lo < hi - 1)
+        if not open_.any():
+            break
+        mid = (lo >> 1) + (hi >> 1) + (lo & hi & 1)
+        left = goes_left(mid)
+        lo = np.where(open_ & left, mid, lo)
+        hi = np.where(open_ & ~left, mid, hi)
+
+    raw = _from_ordered_keys(lo)
+    raw[none_left] = -np.inf
+    raw[all_left] = np.inf
+    return raw
+
+
+def fold_scalers(ensemble, mean, scale):
+    """
+    Return a copy of a compiled ensemble that takes raw features: the split
+    thresholds are mapped back through a StandardScaler with per-column mean
+    and scale (over the ensemble's input columns). Outputs on raw input are
+    identical to the original ensemble on scaled input.
+    """
+    if ensemble.folded_scalers:
+        raise ValueError("Scalers are already folded into this ensemble")
+    arrays = dict(ensemble.arrays)
+    nodes = np.arange(len(arrays['feature']))
+    split = arrays['children'][2 * nodes] != nodes
+    feature = arrays['feature'][split]
+    threshold = arrays['threshold'].copy()
+    threshold[split] = _raw_thresholds(threshold[split], np.asarray(mean, dtype=np.float64)[feature],
+                                       np.asarray(scale, dtype=np.float64)[feature])
+    arrays['threshold'] = threshold
+    arrays['input_dtype'] = np.array('float64')
+    arrays['folded_scalers'] = np.array(True)
+    return CompiledEnsemble(arrays, ensemble.members)
+
+
+def _stage_scaling(artifacts, entries):
+    """Per-column (mean, scale) of a stage input from the scalers of its models"""
+    width = max(offset + artifacts[name].n_features_in_ for name, offset, _ in entries)
+    mean, scale = np.zeros(width), np.ones(width)
+    for name, offset, scaler_name in entries:
+        scaler = artifacts[scaler_name]
+        columns = slice(offset, offset + artifacts[name].n_features_in_)
+        if scaler.with_mean:
+            mean[columns] = scaler.mean_
+        if scaler.with_std:
+            scale[columns] = scaler.scale_
+    return mean, scale
+
+
+def compile_cascade(artifacts, stages, fold=True):
+    """
+    Compile every stage of the cascade.
+
+    stages - {stage name: [(model artifact name, column offset, scaler artifact
+             name), ...]}; models in one stage are evaluated in a single traversal
+             of a shared input whose columns are the concatenated inputs of its models
+    fold   - fold the scalers into the thresholds so the stages take raw input
+    Returns the dict written by save_compiled.
+    """
+    groups = {}
+    for stage, entries in stages.items():
+        models = {name: artifacts[name] for name, _, _ in entries}
+        column_maps = {
+            name: np.arange(artifacts[name].n_features_in_) + offset for name, offset, _ in entries
+        }
+        ensemble = compile_ensembles(models, column_maps)
+        if fold:
+            ensemble = fold_scalers(ensemble, *_stage_scaling(artifacts, entries))
+        groups[stage] = ensemble.to_dict()
+    metadata = artifacts.get('metadata') or {}
+    return {
+        'format_version': COMPILED_FORMAT_VERSION,
+        'training_date': metadata.get('training_date'),
+        'groups': groups,
+    }
+
+
+def load_compiled(compiled):
+    """Build {stage name: CompiledEnsemble} from a loaded compiled_models artifact"""
+    if compiled.get('format_version') != COMPILED_FORMAT_VERSION:
+        raise ValueError(f"Unsupported compiled model format {compiled.get('format_version')}")
+    return {stage: CompiledEnsemble.from_dict(group) for stage, group in compiled['groups'].items()}
+
+
+def save_compiled(compiled, path):
+    """Write compiled groups as an uncompressed joblib file (memory-mappable)"""
+    tmp_path = path + '.tmp'
+    joblib.dump(compiled, tmp_path, compress=0)
+    os.replace(tmp_path, path)
+
+
+def sequential_predict(model, X):
+    """
+    sklearn predict_proba (classifiers) or predict (regressors) with n_jobs=1.
+    With parallel jobs forests add tree outputs in thread completion order,
+    which can change the last bits of the sum; one job adds them in tree order,
+    as the compiled evaluator does.
+    """
+    n_jobs = getattr(model, 'n_jobs', None)
+    if n_jobs is not None:
+        model.n_jobs = 1
+    try:
+        return model.predict_proba(X) if hasattr(model, 'predict_proba') else model.predict(X)
+    finally:
+        if n_jobs is not None:
+            model.n_jobs = n_jobs
+
+
+def _time_call(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def verify(engine, data_path, rows=None, repeat=20, fold=True):
+    """
+    Compare the compiled groups against the scaled sklearn pipeline (scaler
+    transform, then predict / predict_proba) on rows of the preprocessed dataset
+    (all rows by default) and print exact-match and latency results. With
+    fold=True the compiled groups are fed the raw stage inputs.
+    Returns True when every output is identical.
+    """
+    from inference_engine import CASCADE_STAGES, historical_stage_inputs
+
+    compiled = load_compiled(compile_cascade(engine.artifacts, CASCADE_STAGES, fold=fold))
+    raw_inputs = historical_stage_inputs(engine, data_path, rows)
+    inputs = {stage: engine.scale_stage_input(stage, X) for stage, X in raw_inputs.items()}
+    all_equal = True
+
+    print(f"\n  {'Model':<22}{'Identical':>10}{'sklearn 1 row':>16}{'compiled 1 row':>16}"
+          f"{'sklearn batch':>15}{'compiled batch':>16}")
+    for stage, entries in CASCADE_STAGES.items():
+        X = inputs[stage]
+        group = compiled[stage]
+        compiled_X = raw_inputs[stage] if group.folded_scalers else X
+        outputs = group.evaluate(compiled_X)
+        compiled_one = _time_call(lambda: group.evaluate(compiled_X[:1]), repeat)
+        compiled_batch = _time_call(lambda: group.evaluate(compiled_X), max(1, repeat // 10))
+        for name, offset, _ in entries:
+            model = engine.artifacts[name]
+            columns = X[:, offset:offset + model.n_features_in_]
+            expected = sequential_predict(model, columns)
+            identical = np.array_equal(outputs[name], expected)
+            all_equal &= identical
+
+            if hasattr(model, 'predict_proba'):
+                sklearn_one = _time_call(lambda: model.predict_proba(columns[:1]), repeat)
+                sklearn_batch = _time_call(lambda: model.predict_proba(columns), max(1, repeat // 10))
+            else:
+                sklearn_one = _time_call(lambda: model.predict(columns[:1]), repeat)
+                sklearn_batch = _time_call(lambda: model.predict(columns), max(1, repeat // 10))
+            print(f"  {name:<22}{'yes' if identical else 'NO':>10}{sklearn_one * 1000:>13.2f} ms"
+                  f"{compiled_one * 1000:>13.2f} ms{sklearn_batch * 1000:>12.1f} ms{compiled_batch * 1000:>13.1f} ms")
+        print(f"  {'  (stage ' + stage + ')':<22}{'':>10}{'':>16}{'':>16}{'':>15}{'':>16}")
+    print(f"\n  Rows: {len(next(iter(inputs.values())))}, scalers {'folded' if fold else 'kept'}, "
+          f"compiled timings are per stage (all models of the stage)\n")
+    return all_equal
+
+
+def main():
+    from inference_engine import CASCADE_STAGES, COMPILED_FILE, DATA_PATH, MODEL_DIR, DisasterInferenceEngine
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['compile', 'verify'])
+    parser.add_argument('--model-dir', default=MODEL_DIR)
+    parser.add_argument('--data', default=DATA_PATH, help="Preprocessed dataset used by verify")
+    parser.add_argument('--rows', type=int, default=None, help="Dataset rows used by verify (default: all)")
+    parser.add_argument('--keep-scalers', action='store_true',
+                        help="Do not fold the scalers into the thresholds (compiled stages take scaled input)")
+    args = parser.parse_args()
+
+    engine = DisasterInferenceEngine(args.model_dir, backend='sklearn', lazy=False)
+    if args.command == 'compile':
+        path = os.path.join(args.model_dir, COMPILED_FILE)
+        save_compiled(compile_cascade(engine.artifacts, CASCADE_STAGES, fold=not args.keep_scalers), path)
+        print(f"✓ Compiled {', '.join(CASCADE_STAGES)} stages to {path}"
+              f"{' (scaled input)' if args.keep_scalers else ' (raw input, scalers folded)'}")
+    else:
+        if not verify(engine, args.data, args.rows, fold=not args.keep_scalers):
+            print("✗ Compiled outputs differ from the sklearn models")
+            raise SystemExit(1)
+        print("✓ Compiled outputs are identical to the sklearn models")
+
+
+if __name__ == '__main__':
+    main()